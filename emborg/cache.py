@@ -0,0 +1,284 @@
+# Borg Cache
+#
+# Locates and describes the local caches Borg keeps for its repositories.  Each
+# repository that has been accessed has a directory in the Borg cache directory,
+# named after the ID of the repository, that holds its chunk index and its files
+# caches.  Its config file records where the repository was last found.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import configparser
+import hashlib
+import json
+import os
+import re
+import shutil
+import arrow
+from inform import Error, log, os_error, warn
+from .preferences import FILES_CACHES_FILE
+from .shlib import rm, to_path
+
+
+# cache_dir() {{{1
+def cache_dir():
+    """Returns the directory in which Borg keeps its caches."""
+    if os.environ.get("BORG_CACHE_DIR"):
+        return to_path(os.environ["BORG_CACHE_DIR"])
+    base = os.environ.get("BORG_BASE_DIR") or "~"
+    cache_home = os.environ.get("XDG_CACHE_HOME") or to_path(base, ".cache")
+    return to_path(cache_home, "borg")
+
+
+# canonical_location() {{{1
+def canonical_location(repository):
+    """Returns the location of a repository in the form Borg records it.
+
+    Borg records where it last found a repository in its cache.  Remote
+    repositories are recorded as ssh:// URLs, local ones as absolute paths.
+    """
+    repository = str(repository)
+    if repository.startswith("file://"):
+        return os.path.abspath(repository[len("file://"):])
+    match = re.fullmatch(r"ssh://(?:([^@/]+)@)?([^:/]+|\[[^\]]+\])(?::(\d+))?(/.*)", repository)
+    if not match:
+        match = re.fullmatch(r"(?:([^@:/]+)@)?([^:/]+|\[[^\]]+\]):(.+)", repository)
+        if not match:
+            return os.path.abspath(os.path.expanduser(repository))
+        user, host, path = match.groups()
+        port = None
+    else:
+        user, host, port, path = match.groups()
+    if path.startswith("/~"):
+        path = path[1:]
+    if path.startswith("/./"):
+        path = path[3:]
+    if path.startswith("~"):
+        path = "/" + path
+    elif not path.startswith("/"):
+        path = "/./" + path
+    return "ssh://{}{}{}{}".format(
+        f"{user}@" if user else "", host, f":{port}" if port else "", path
+    )
+
+
+# repository_id() {{{1
+def repository_id(repository):
+    """Returns a short name for a repository that may be used in file names.
+
+    Configurations that use the same repository get the same name.
+    """
+    location = canonical_location(repository)
+    return hashlib.sha1(location.encode("utf-8")).hexdigest()[:16]
+
+
+# files_cache_suffix() {{{1
+def files_cache_suffix(settings, record=True):
+    """Returns the files cache suffix of a config that has not chosen one.
+
+    Borg keeps one files cache per repository unless it is given a suffix.
+    The first config to back up to the repository uses that files cache, each
+    later one gets its own, named after the config.  The suffixes are kept in
+    a file named after the repository, which is only updated if record is
+    true.
+    """
+    path = settings.data_dir / FILES_CACHES_FILE.format(
+        repository_id = repository_id(settings.repository)
+    )
+    try:
+        suffixes = json.loads(path.read_text())
+    except FileNotFoundError:
+        suffixes = {}
+    except (OSError, ValueError) as e:
+        warn("ignoring files cache suffixes.", culprit=path, codicil=str(e))
+        suffixes = {}
+    config = settings.config_name
+    if config in suffixes:
+        return suffixes[config]
+    suffix = config if suffixes else ""
+    if record:
+        suffixes[config] = suffix
+        tmp = path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(suffixes))
+            tmp.replace(path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+    return suffix
+
+
+# BorgCache class {{{1
+class BorgCache:
+    """Borg Cache
+
+    The local cache of one repository.
+
+    path (Path):
+        The directory that holds the cache.
+    """
+    # constructor {{{2
+    def __init__(self, path):
+        self.path = path
+        self.config = configparser.ConfigParser(interpolation=None)
+        try:
+            self.config.read(str(path / "config"))
+        except (configparser.Error, UnicodeDecodeError) as e:
+            log(f"{path!s}: {e}")
+
+    # find() {{{2
+    @classmethod
+    def find(cls, repository=None):
+        """Returns the caches in the Borg cache directory.
+
+        If repository is given, only the caches of that repository are
+        returned.
+        """
+        location = canonical_location(repository) if repository else None
+        try:
+            paths = sorted(p for p in cache_dir().iterdir() if p.is_dir())
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            log(os_error(e))
+            return []
+        caches = [cls(p) for p in paths]
+        caches = [c for c in caches if c.is_cache()]
+        if location:
+            caches = [c for c in caches if c.location == location]
+        return caches
+
+    # is_cache() {{{2
+    def is_cache(self):
+        return self.config.has_section("cache")
+
+    # get() {{{2
+    def get(self, name):
+        return self.config.get("cache", name, fallback=None)
+
+    # location {{{2
+    @property
+    def location(self):
+        """Where the repository was when the cache was last used."""
+        return self.get("previous_location")
+
+    # in_use {{{2
+    @property
+    def in_use(self):
+        return (self.path / "lock.exclusive").exists()
+
+    # last_sync {{{2
+    @property
+    def last_sync(self):
+        """When the cache was last committed, or None if unknown."""
+        try:
+            return arrow.get((self.path / "config").stat().st_mtime).to("local")
+        except OSError:
+            return None
+
+    # repository_modified {{{2
+    @property
+    def repository_modified(self):
+        """When the repository was last modified as known to the cache."""
+        timestamp = self.get("timestamp")
+        if not timestamp:
+            return None
+        try:
+            return arrow.get(timestamp, tzinfo="UTC").to("local")
+        except (arrow.parser.ParserError, ValueError):
+            return None
+
+    # sizes() {{{2
+    def sizes(self):
+        """Returns the size of the cache and of each of its files caches."""
+        total = 0
+        files_caches = {}
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                try:
+                    size = os.lstat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    continue
+                total += size
+                if dirpath == str(self.path) and (
+                    name == "files" or name.startswith("files.")
+                ):
+                    files_caches[name] = size
+        return total, files_caches
+
+    # resync_pending() {{{2
+    def resync_pending(self, archives):
+        """Determines whether Borg must resynchronize the cache.
+
+        archives are the archives known to be in the repository, as given by
+        borg list --json.  Returns the name of an archive that is newer than
+        the last state of the repository seen by the cache, False if there is
+        none, or None if this cannot be determined.
+        """
+        modified = self.repository_modified
+        if modified is None or archives is None:
+            return None
+        for archive in archives:
+            try:
+                when = arrow.get(archive.get("start") or archive["time"], tzinfo="local")
+            except (KeyError, arrow.parser.ParserError, ValueError):
+                continue
+            if when > modified:
+                return archive["name"]
+        return False
+
+    # relocate() {{{2
+    def relocate(self, directory):
+        """Moves the cache into directory.
+
+        A symbolic link is left where Borg expects to find the cache.  Moving
+        the cache back into the Borg cache directory removes the link.
+        Returns False if the cache is already in directory.
+        """
+        home = self.path.parent.resolve() / self.path.name
+        current = home.resolve()
+        target = to_path(directory).resolve() / home.name
+        if target == current:
+            return False
+        if self.in_use:
+            raise Error("cache is in use.", culprit=home)
+        if target != home and (target.exists() or target.is_symlink()):
+            raise Error("already exists.", culprit=target)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target == home:
+                home.unlink()
+            shutil.move(str(current), str(target))
+            if target != home:
+                if home.is_symlink():
+                    home.unlink()
+                home.symlink_to(target)
+        except OSError as e:
+            raise Error(os_error(e))
+        return True
+
+    # remove() {{{2
+    def remove(self):
+        """Deletes the cache, including its contents if it was relocated."""
+        if self.in_use:
+            raise Error("cache is in use.", culprit=self.path)
+        try:
+            if self.path.is_symlink():
+                rm(self.path.resolve())
+            rm(self.path)
+        except OSError as e:
+            raise Error(os_error(e))
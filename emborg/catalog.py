@@ -0,0 +1,214 @@
+# Archive Catalog
+#
+# Keeps a local copy of the list of archives contained in a repository so that
+# the latest or nearest archive can be found without contacting the repository.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import json
+import arrow
+from inform import log, narrate, os_error, warn
+from .preferences import ARCHIVES_FILE
+from .shlib import rm, to_path
+from .utilities import to_seconds
+
+# Globals {{{1
+DEFAULT_LIFETIME = "15m"
+
+# Borg commands that never add, remove or rename archives.  The catalog survives
+# these commands, all others invalidate it.
+ARCHIVE_PRESERVING_COMMANDS = set(
+    "break-lock check compact diff export-tar extract info key list mount umount"
+    .split()
+)
+
+# Borg commands that do not write to the repository at all.
+READ_ONLY_COMMANDS = set(
+    "break-lock diff export-tar extract info list mount umount".split()
+)
+
+
+# ArchiveCatalog class {{{1
+class ArchiveCatalog:
+    """Archive Catalog
+
+    A local copy of the output of ‘borg list --json’ for a configuration.
+
+    The catalog is held in the data directory and is keyed by the repository
+    and the archive filters (prefix and glob_archives).  It is considered
+    current if those keys match and either:
+
+    - the repository is local and its latest transaction, as indicated by the
+      name of its index file, has not changed since the catalog was written, or
+    - the repository is remote and the catalog is younger than
+      archive_cache_lifetime.
+
+    For remote repositories, the latest archive can also be confirmed
+    with the repository using is_latest().
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = settings.data_dir / settings.resolve(
+            'ARCHIVES_FILE', ARCHIVES_FILE
+        )
+        self.key = dict(
+            repository = str(settings.repository),
+            prefix = settings.value('prefix'),
+            glob_archives = settings.value('glob_archives'),
+        )
+
+    # transaction() {{{2
+    def transaction(self):
+        """Identifies the latest transaction in a local repository.
+
+        Returns None if the repository is remote or cannot be read.
+        """
+        repository = self.settings.repository
+        if is_remote(repository):
+            return None
+        try:
+            indices = [
+                p.name for p in to_path(repository).glob("index.*")
+                if p.suffix[1:].isdigit()
+            ]
+        except OSError as e:
+            log(os_error(e))
+            return None
+        # sort numerically, index.100 is later than index.99
+        indices.sort(key=lambda name: int(name.split('.')[1]))
+        return indices[-1] if indices else None
+
+    # is_verifiable() {{{2
+    def is_verifiable(self):
+        """Whether changes made by others are detected without asking Borg."""
+        return self.transaction() is not None
+
+    # is_latest() {{{2
+    def is_latest(self, archives, latest):
+        """Confirms that the catalog agrees with the repository.
+
+        latest is the latest archive as reported by the repository, or None if
+        there are no archives.  If the catalog disagrees it is discarded.
+        """
+        if not archives or not latest:
+            agree = not archives and not latest
+        else:
+            ours = archives[-1]
+            agree = (ours.get('id'), ours.get('name')) == (
+                latest.get('id'), latest.get('name')
+            )
+        if not agree:
+            narrate("repository changed since archives were cached.")
+            self.invalidate()
+        return agree
+
+    # lifetime() {{{2
+    def lifetime(self):
+        lifetime = self.settings.value('archive_cache_lifetime', DEFAULT_LIFETIME)
+        if lifetime in ('', None):
+            lifetime = DEFAULT_LIFETIME
+        return to_seconds(lifetime, culprit='archive_cache_lifetime')
+
+    # load() {{{2
+    def load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            warn("ignoring archive catalog.", culprit=self.path, codicil=str(e))
+            return None
+
+    # is_current() {{{2
+    def is_current(self, contents=None):
+        if contents is None:
+            contents = self.load()
+        if not contents or contents.get('key') != self.key:
+            return False
+        transaction = self.transaction()
+        if transaction:
+            return contents.get('transaction') == transaction
+        try:
+            age = (arrow.now() - arrow.get(contents['written'])).total_seconds()
+        except (KeyError, arrow.parser.ParserError):
+            return False
+        return 0 <= age < self.lifetime()
+
+    # read() {{{2
+    def read(self):
+        """Returns the cached archives if they are current, otherwise None."""
+        contents = self.load()
+        if self.is_current(contents):
+            return contents['archives']
+        return None
+
+    # write() {{{2
+    def write(self, archives, written=None):
+        contents = dict(
+            key = self.key,
+            transaction = self.transaction(),
+            written = written or str(arrow.now()),
+            archives = archives,
+        )
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(contents))
+            tmp.replace(self.path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+
+    # invalidate() {{{2
+    def invalidate(self):
+        if self.path.exists():
+            narrate("discarding cached list of archives.")
+            rm(self.path)
+
+    # revalidate() {{{2
+    def revalidate(self):
+        """Mark catalog current after a change that did not affect archives."""
+        contents = self.load()
+        if contents:
+            # retain the original age if the age is what establishes validity
+            written = None if self.transaction() else contents.get('written')
+            self.write(contents['archives'], written)
+
+    # before() {{{2
+    def before(self, cmd, args):
+        """Prepare catalog for a borg command that is about to be run.
+
+        Returns true if the catalog should be revalidated once the command
+        completes successfully.
+        """
+        if cmd in READ_ONLY_COMMANDS:
+            return False
+        if cmd in ARCHIVE_PRESERVING_COMMANDS and '--repair' not in args:
+            # command may commit a new transaction, but archives are unchanged
+            return self.is_current()
+        self.invalidate()
+        return False
+
+
+# is_remote() {{{1
+def is_remote(repository):
+    return ':' in str(repository)
+
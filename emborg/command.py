@@ -20,7 +20,10 @@
 # Imports {{{1
 import json
 import os
+import stat
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from textwrap import dedent, fill
 import arrow
 from docopt import docopt
@@ -38,38 +41,45 @@ from inform import (
     narrate,
     os_error,
     output,
+    plural,
     render,
     title_case,
     warn,
 )
-from quantiphy import Quantity, UnitConversion, QuantiPhyError
+from quantiphy import Quantity, QuantiPhyError
 from .shlib import (
     Cmd, Run, cwd, mkdir, rm, set_prefs as set_shlib_prefs, split_cmd, to_path
 )
-from time import sleep
+from time import monotonic, sleep
+from .cache import BorgCache, cache_dir, canonical_location
+from .catalog import ArchiveCatalog
 from .collection import Collection
+from .compaction import CompactionPolicy
+from .contents import compare_contents
+from .formatter import ManifestFormatter, render_time
+from .journal import ChangeJournal, Watcher
+from .manifests import CACHE_FORMAT, ManifestCache, format_fields
+from .mounts import MountSessions
 from .preferences import (
     BORG_SETTINGS, DEFAULT_COMMAND, EMBORG_SETTINGS, PROGRAM_NAME
 )
+from .pruning import prune_rules, simulate_prune
+from .rotation import DEFAULT_MAX_DURATION, CheckRotation
+from .snapshot import SourceSnapshot
+from .sorting import sort_entries, sort_memory, top_entries
 from .utilities import (
-    gethostname, pager, read_latest, two_columns, update_latest, when
+    gethostname, pager, read_latest, to_seconds, two_columns, update_latest,
+    when
 )
+from .walker import Walker
 
 
 # Utilities {{{1
 hostname = gethostname()
 set_shlib_prefs(use_inform=True, log_cmd=True)
-
-
-# time conversions {{{2
-UnitConversion('s', 'sec second seconds')
-UnitConversion('s', 'm min minute minutes', 60)
-UnitConversion('s', 'h hr hour hours', 60*60)
-UnitConversion('s', 'd day days', 24*60*60)
-UnitConversion('s', 'w week weeks', 7*24*60*60)
-UnitConversion('s', 'M month months', 30*24*60*60)
-UnitConversion('s', 'y year years', 365*24*60*60)
 Quantity.set_prefs(ignore_sf=True)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
 # title() {{{2
 def title(text):
@@ -77,19 +87,58 @@ def title(text):
 
 
 # get_available_archives() {{{2
-def get_available_archives(settings):
+def get_available_archives(
+    settings, refresh=False, include_external=False, latest=False
+):
+    # use the cached list of archives if it is still current
+    # the cache only holds the archives associated with this configuration
+    # if latest is true the latest archive must be correct, which for remote
+    # repositories is confirmed by asking Borg for just the latest archive
+    catalog = ArchiveCatalog(settings)
+    if not refresh and not include_external:
+        archives = catalog.read()
+        if archives is not None and (
+            not latest
+            or catalog.is_verifiable()
+            or catalog.is_latest(archives, get_latest_archive(settings))
+        ):
+            narrate("using cached list of archives.")
+            return archives
+
     # run borg
-    borg = settings.run_borg(cmd="list", args=["--json", settings.destination()])
+    borg = settings.run_borg(
+        cmd = "list",
+        args = ["--json", settings.destination()],
+        strip_prefix = include_external,
+    )
     try:
         data = json.loads(borg.stdout)
-        return data["archives"]
+        archives = data["archives"]
     except json.decoder.JSONDecodeError as e:
         raise Error("Could not decode output of Borg list command.", codicil=e)
+    if not include_external:
+        catalog.write(archives)
+    return archives
+
+
+# get_latest_archive() {{{2
+def get_latest_archive(settings):
+    # asks Borg for the latest archive only, which is much faster than listing
+    # all of the archives in large remote repositories
+    borg = settings.run_borg(
+        cmd = "list",
+        args = ["--json", "--last", "1", settings.destination()],
+    )
+    try:
+        archives = json.loads(borg.stdout)["archives"]
+    except (json.decoder.JSONDecodeError, KeyError) as e:
+        raise Error("Could not decode output of Borg list command.", codicil=e)
+    return archives[-1] if archives else None
 
 
 # get_name_of_latest_archive() {{{2
 def get_name_of_latest_archive(settings):
-    archives = get_available_archives(settings)
+    archives = get_available_archives(settings, latest=True)
     if not archives:
         raise Error("no archives are available.")
     if archives:
@@ -152,16 +201,164 @@ def get_name_of_nearest_archive(settings, date):
 # get_available_files() {{{2
 def get_available_files(settings, archive):
     # run borg
-    borg = settings.run_borg(
+    borg = settings.stream_borg(
         cmd="list", args=["--json-lines", settings.destination(archive)],
     )
+    return list(decode_json_lines(borg, "list"))
+
+
+# list_archive() {{{2
+# fields that emborg adds to the borg entries when formatting the manifest
+EMBORG_FIELDS = {'extra', 'health'}
+
+
+def list_archive(settings, archive, keys, paths=(), emborg_opts=()):
+    """List the files contained in an archive.
+
+    keys is a borg format string that is used to select the fields required.
+    If paths are given, only the entries at or below those paths are returned.
+    Returns the entries and the borg process that produces them.  The process
+    is None if the entries were taken from the manifest cache.
+    """
+    cache = ManifestCache(settings)
+    fields = format_fields(keys) - EMBORG_FIELDS
+    if cache.usable(fields):
+        ids = {a['name']: a['id'] for a in get_available_archives(settings)}
+        archive_id = ids.get(archive)
+        if archive_id:
+            entries = cache.read(archive_id, fields)
+            if entries is not None:
+                if paths:
+                    entries = (e for e in entries if on_paths(e['path'], paths))
+                return entries, None
+
+            if not paths:
+                # request all cached fields so later queries can use the cache
+                borg = settings.stream_borg(
+                    cmd = "list",
+                    args = [
+                        '--json-lines',
+                        '--format', CACHE_FORMAT,
+                        settings.destination(archive)
+                    ],
+                    emborg_opts = emborg_opts,
+                )
+                entries = decode_json_lines(borg, "list")
+                return cache.fill(archive_id, archive, entries), borg
+
+    # borg selects the entries on the given paths itself
+    borg = settings.stream_borg(
+        cmd = "list",
+        args = [
+            '--json-lines',
+            '--format', keys,
+            settings.destination(archive),
+            *paths
+        ],
+        emborg_opts = emborg_opts,
+    )
+    return decode_json_lines(borg, "list"), borg
+
+
+# on_paths() {{{2
+def on_paths(path, paths):
+    # mimics the way borg selects entries given PATH arguments
+    for p in paths:
+        if path == p or path.startswith(p + '/'):
+            return True
+    return False
+
+
+# in_directory() {{{2
+def in_directory(path, directory):
+    # true if path is directory or is directly contained in directory
+    return '/' not in path[len(directory)+1:]
+
+
+# directory_sizes() {{{2
+def directory_sizes(entries, path, fields, max_depth=None):
+    """Sums the given size fields of entries by directory.
+
+    Each directory at or below path, and no more than max_depth levels below
+    it, is credited with the sizes of all the entries it contains.  If path
+    names a file rather than a directory, just the file is reported.  Returns
+    a dictionary that maps the directories to the list of their sizes.
+    """
+    base_depth = len(path.split('/')) if path else 0
+    totals = {}
+    for entry in entries:
+        try:
+            sizes = [entry[f] for f in fields]
+        except KeyError as e:
+            raise Error('not provided by Borg.', culprit=e.args[0])
+        parts = entry['path'].split('/')
+        if entry['type'] != 'd' and len(parts) > base_depth:
+            parts.pop()  # a file contributes to its containing directories
+        depth = len(parts) - base_depth
+        if max_depth is not None:
+            depth = min(depth, max_depth)
+        for i in range(base_depth, base_depth + depth + 1):
+            directory = '/'.join(parts[:i])
+            total = totals.get(directory)
+            if total:
+                for j, size in enumerate(sizes):
+                    total[j] += size
+            else:
+                totals[directory] = list(sizes)
+    return totals
+
+
+# compare_status() {{{2
+def compare_status(archived, st, local_path):
+    # returns the attributes of a local file that differ from its archived copy
+    type, mode, size, mtime, source = archived
+    differences = []
+    local_mode = stat.filemode(st.st_mode)
+    if mode[:1] == 'h':
+        # borg reports hard links after the first as h rather than -
+        mode = '-' + mode[1:]
+    if local_mode[0] != mode[0]:
+        return ['type']
+    if local_mode != mode:
+        differences.append('mode')
+    if stat.S_ISREG(st.st_mode):
+        if st.st_size != size:
+            differences.append('size')
+        if st.st_mtime_ns // 1000 != to_microseconds(mtime):
+            differences.append('mtime')
+    elif stat.S_ISLNK(st.st_mode):
+        try:
+            if os.readlink(local_path) != source:
+                differences.append('target')
+        except OSError as e:
+            warn(os_error(e))
+    return differences
+
+
+# to_microseconds() {{{2
+def to_microseconds(timestamp):
+    # borg gives times in local time, without the time zone in older versions
     try:
-        files = []
-        for line in borg.stdout.splitlines():
-            files.append(json.loads(line))
-        return files
-    except json.decoder.JSONDecodeError as e:
-        raise Error("Could not decode output of Borg list command.", codicil=e)
+        dt = datetime.fromisoformat(timestamp)
+    except AttributeError:
+        # fromisoformat() is not available before python 3.7
+        dt = arrow.parser.DateTimeParser().parse_iso(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+# decode_json_lines() {{{2
+def decode_json_lines(lines, cmd):
+    # decode output of borg one line at a time as it becomes available
+    for line in lines:
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.decoder.JSONDecodeError as e:
+            raise Error(f"Could not decode output of Borg {cmd} command.", codicil=e)
+
 
 # get_archive_paths() {{{2
 def get_archive_paths(paths, settings):
@@ -266,6 +463,25 @@ class Command:
             exit_status = cls.run(name, args if args else [], settings, options)
             return 0 if exit_status is None else exit_status
 
+    @classmethod
+    def execute_deferred(cls, name, settings, options):
+        # execute_deferred() is run after each configuration.  It performs the
+        # repository-wide steps that earlier configurations left to this one
+        # but that this one did not perform, because it failed or skipped them.
+        exit_status = 0
+        for step in settings.unperformed():
+            narrate(f"performing {step} left to {settings.config_name}.")
+            command = dict(check=CheckCommand, compact=CompactCommand)[step]
+            try:
+                status = command.perform_deferred(settings, options)
+            except Error as e:
+                e.report()
+                status = 2
+            finally:
+                settings.deferred(step, discard=True)
+            exit_status = max(exit_status, status or 0)
+        return exit_status
+
     @classmethod
     def execute_late(cls, name, args, settings, options):
         # execute_late() takes same arguments as run(), but is run after all the
@@ -368,6 +584,177 @@ class BreakLockCommand(Command):
         return borg.status
 
 
+# CacheCommand command {{{1
+class CacheCommand(Command):
+    NAMES = "cache".split()
+    DESCRIPTION = "manage the local cache Borg keeps for the repository"
+    USAGE = dedent(
+        """
+        Usage:
+            emborg cache [options] [status]
+            emborg cache prune-stale
+            emborg cache relocate <dir>
+            emborg cache delete
+
+        Options:
+            -r, --refresh   get the list of archives from the repository
+
+        Borg keeps a cache for each repository it accesses.  It holds the chunk
+        index and the files caches and can grow large.  When another client
+        changes the repository, Borg must resynchronize the cache before it can
+        be used, which can take a long time.
+
+        The status action, which is the default, shows the location and size of
+        the cache for the repository, when it was last synchronized, and
+        whether a resynchronization is pending.  That is judged from the cached
+        list of archives, which only includes the archives of this
+        configuration; use --refresh to get the list of all archives from the
+        repository instead.
+
+        The prune-stale action removes the caches of repositories that are not
+        used by any of the available configurations.  Use the Emborg --dry-run
+        option to see which caches would be removed without removing them.
+        Be aware that this also removes the caches of repositories you access
+        with Borg directly.
+
+        The relocate action moves the cache for the repository into the given
+        directory, leaving a symbolic link where Borg expects to find it.
+        Relocating it back into the Borg cache directory removes the link.
+
+        The delete action deletes the cache for the repository.  It is rebuilt
+        the next time the repository is accessed.
+        """
+    ).strip()
+    REQUIRES_EXCLUSIVITY = True
+    COMPOSITE_CONFIGS = "all"
+    LOG_COMMAND = True
+
+    @classmethod
+    def run(cls, command, args, settings, options):
+        # read command line
+        cmdline = docopt(cls.USAGE, argv=[command] + args)
+
+        if cmdline["prune-stale"]:
+            return cls.prune_stale(settings, options)
+        if cmdline["relocate"]:
+            return cls.relocate(settings, cmdline["<dir>"])
+        if cmdline["delete"]:
+            return cls.delete(settings, options)
+        return cls.status(settings, cmdline["--refresh"])
+
+    @classmethod
+    def caches(cls, settings):
+        # the caches of the repository, normally there is only one
+        caches = BorgCache.find(settings.repository)
+        if not caches:
+            raise Error(
+                "no cache found for repository.",
+                culprit = str(settings.repository),
+                codicil = f"Looked in {cache_dir()!s}.",
+            )
+        return caches
+
+    @classmethod
+    def status(cls, settings, refresh):
+        if refresh:
+            archives = get_available_archives(
+                settings, refresh=True, include_external=True
+            )
+        else:
+            contents = ArchiveCatalog(settings).load()
+            archives = contents["archives"] if contents else None
+
+        caches = cls.caches(settings)
+        output(f"      repository: {settings.repository}")
+        for cache in caches:
+            size, files_caches = cache.sizes()
+            path = cache.path
+            if path.is_symlink():
+                path = f"{path!s} → {path.resolve()!s}"
+            output(f"           cache: {path}")
+            output(f"            size: {Quantity(size, 'B').render(prec=3)}")
+            for name, size in files_caches.items():
+                output(f"{name:>16}: {Quantity(size, 'B').render(prec=3)}")
+            synced = cache.last_sync
+            if synced:
+                output(f"       last sync: {synced}, {when(synced)} ago")
+            pending = cache.resync_pending(archives)
+            if pending is None:
+                pending = "unknown"
+            elif pending:
+                pending = f"yes, {pending} is newer than the cache"
+            else:
+                pending = "no"
+            output(f"  resync pending: {pending}")
+            if cache.in_use:
+                output("          in use: yes")
+
+    @classmethod
+    def prune_stale(cls, settings, options):
+        # the caches of all the configurations are considered at once, so this
+        # need only be done for the first member of a composite configuration
+        if not settings.is_first_config():
+            return 0
+
+        # find the repositories of all configurations
+        locations = set()
+        # a cache is only removed if the repositories of all are known
+        for config in settings.all_configs():
+            try:
+                repository = settings.peer(config).value("repository")
+            except Error as e:
+                e.reraise(culprit=config, codicil="No caches were removed.")
+            if repository:
+                locations.add(canonical_location(repository))
+
+        # remove the caches of the other repositories
+        for cache in BorgCache.find():
+            location = cache.location
+            if not location:
+                narrate("location of repository unknown, skipping.", culprit=cache.path)
+                continue
+            if location in locations:
+                continue
+            if cache.in_use:
+                warn("cache is in use, skipping.", culprit=cache.path)
+                continue
+            size = Quantity(cache.sizes()[0], 'B').render(prec=3)
+            output(f"removing cache of {location} ({size}): {cache.path!s}")
+            if "dry-run" not in options:
+                cache.remove()
+
+    @classmethod
+    def relocate(cls, settings, directory):
+        for cache in cls.caches(settings):
+            if cache.relocate(directory):
+                output(f"cache moved to {cache.path.resolve()!s}.")
+            else:
+                output(f"cache is already in {directory}.")
+
+    @classmethod
+    def delete(cls, settings, options):
+        # borg cannot delete a relocated cache as it will not remove a link
+        for cache in BorgCache.find(settings.repository):
+            if cache.path.is_symlink():
+                narrate("removing relocated cache:", cache.path.resolve())
+                if "dry-run" not in options:
+                    cache.remove()
+                return 0
+
+        # run borg
+        borg = settings.run_borg(
+            cmd = "delete",
+            borg_opts = ["--cache-only"],
+            args = [settings.repository],
+            emborg_opts = options,
+            strip_prefix = True,
+        )
+        out = borg.stdout
+        if out:
+            output(out.rstrip())
+        return borg.status
+
+
 # CheckCommand command {{{1
 class CheckCommand(Command):
     NAMES = "check".split()
@@ -381,12 +768,21 @@ class CheckCommand(Command):
             -A, --all                           check all available archives
             -e, --include-external              check all archives in repository, not just
                                                 those associated with this configuration
+            -m, --max-duration <time>           perform a rotating check that spends no
+                                                more than this long checking
             -r, --repair                        attempt to repair any inconsistencies found
             -v, --verify-data                   perform a full integrity verification (slow)
 
         The most recently created archive is checked if one is not specified
         unless --all is given, in which case all archives are checked.
 
+        With --max-duration the repository is checked incrementally.  Each run
+        continues from where the last left off, first checking the repository
+        and then the archives, oldest first, until the time is used up.  The
+        time may be given with units, such as 30m or 2h; seconds are assumed if
+        no units are given.  The check is recorded as having been performed
+        once the whole repository has been covered.
+
         Be aware that the --repair option is considered a dangerous operation
         that might result in the complete loss of corrupt archives.  It is
         recommended that you create a backup copy of your repository and check
@@ -412,12 +808,33 @@ class CheckCommand(Command):
                 raise Error("--dry-run is not available with check command.")
             os.environ['BORG_CHECK_I_KNOW_WHAT_I_AM_DOING'] = 'YES'
 
+        # perform a rotating check
+        max_duration = cmdline["--max-duration"]
+        if max_duration:
+            if archive or verify or repair:
+                raise Error(
+                    "an archive, --repair and --verify-data are not available",
+                    "with --max-duration.",
+                    sep = " ",
+                )
+            max_duration = to_seconds(max_duration, culprit="--max-duration")
+            if max_duration <= 0:
+                raise Error("expected a positive time.", culprit="--max-duration")
+            cls.check_rotating(
+                settings, max_duration, options, include_external_archives
+            )
+            return
+
         # identify archive or archives to check
         if check_all:
             archive = None
         elif not archive:
             archive = get_name_of_latest_archive(settings)
 
+        # the configs that left the check of this repository to this one, it
+        # is not attempted again for them if it fails
+        deferred = settings.deferred('check', discard=True) if check_all else []
+
         # run borg
         borg = settings.run_borg(
             cmd = "check",
@@ -432,7 +849,68 @@ class CheckCommand(Command):
         if borg.status:
             raise Error('repository is corrupt.')
 
-        # update the date file
+        # update the date file, along with those of the configs that left the
+        # check of this repository to this one
+        update_latest('check', settings.date_file)
+        for each in deferred:
+            update_latest('check', each['date_file'])
+
+    @classmethod
+    def perform_deferred(cls, settings, options):
+        # check the repository for the configs that left the check to this one
+        display("Checking repository ...")
+        cls.run("check", ["--all", "--include-external"], settings, options)
+
+    @classmethod
+    def check_rotating(cls, settings, max_duration, options, include_external):
+        # check the repository, then its archives, until time is up
+        rotation = CheckRotation(settings)
+        rotation.save()
+        deadline = monotonic() + max_duration
+        narrate(f"continuing check begun {rotation.started.humanize()}.")
+
+        if not rotation.repository_checked:
+            # borg itself remembers where a partial repository check stopped
+            borg = settings.run_borg(
+                cmd = "check",
+                borg_opts = [
+                    "--info", "--repository-only",
+                    "--max-duration", str(max(round(max_duration), 1)),
+                ],
+                args = [settings.destination()],
+                emborg_opts = options,
+                strip_prefix = True,
+                progress = True,
+            )
+            if borg.status:
+                raise Error('repository is corrupt.')
+            if not rotation.repository_check_ended(borg.stderr):
+                narrate("repository check is incomplete.")
+                return
+
+        archives = get_available_archives(
+            settings, include_external=include_external
+        )
+        pending = rotation.pending(a["name"] for a in archives)
+        while pending and monotonic() < deadline:
+            archive = pending.pop(0)
+            borg = settings.run_borg(
+                cmd = "check",
+                borg_opts = ["--archives-only"],
+                args = [settings.destination(archive)],
+                emborg_opts = options,
+                strip_prefix = include_external,
+            )
+            if borg.status:
+                raise Error('archive is corrupt.', culprit=archive)
+            rotation.archive_checked(archive)
+        if pending:
+            narrate(f"{plural(pending):# archive/s} left to check.")
+            return
+
+        # the whole repository has been checked, start again next time
+        narrate("check of repository is complete.")
+        rotation.discard()
         update_latest('check', settings.date_file)
 
 
@@ -471,6 +949,27 @@ class CompactCommand(Command):
             borg_opts.append("--progress")
         if 'dry-run' in options:
             raise Error("--dry-run is not available with compact command.")
+        return cls.compact(settings, borg_opts, options)
+
+    @classmethod
+    def perform_deferred(cls, settings, options):
+        # compact the repository for the configs that left compaction to this
+        # one, compaction deferred by the compaction policy is only performed
+        # if it was due for one of them
+        for each in settings.deferred('compact'):
+            if each.get('due', True):
+                reason = each.get('reason')
+                reason = f" ({reason}, for {each['config']})" if reason else ""
+                display(f"Compacting repository{reason} ...")
+                return cls.compact(settings, [], options)
+        narrate("Deferring compaction.")
+        return 0
+
+    @classmethod
+    def compact(cls, settings, borg_opts, options):
+        # the configs that left compaction to this one, it is not attempted
+        # again for them if it fails
+        deferred = settings.deferred('compact', discard=True)
 
         # run borg
         borg = settings.run_borg(
@@ -483,8 +982,11 @@ class CompactCommand(Command):
         if out:
             output(out.rstrip())
 
-        # update the date file
+        # update the date files
+        CompactionPolicy(settings).compacted()
         update_latest('compact', settings.date_file)
+        for each in deferred:
+            update_latest('compact', each['date_file'])
 
         return borg.status
 
@@ -502,6 +1004,12 @@ class CompareCommand(Command):
             -a <archive>, --archive <archive>   name of the archive to mount
             -d <date>, --date <date>            date of the desired archive
             -i, --interactive                   perform an interactive comparison
+            -m, --metadata                      compare metadata without mounting
+            -c, --contents                      compare contents without mounting
+            -j <n>, --jobs <n>                  number of files extracted at once
+                                                by --contents [default: 4]
+            -l <bytes>, --limit <bytes>         maximum amount of data compared
+                                                by --contents
 
         Reports and allows you to manage the differences between your local
         files and those in an archive.  The base command simply reports the
@@ -541,7 +1049,27 @@ class CompareCommand(Command):
         that can result in the archive remaining mounted.  In this case you will
         need to resolve any issues that are preventing the unmounting, and then
         explicitly run the :ref:`unmount command <umount>` before you can use
-        this *Borg* repository again.
+        this *Borg* repository again.  If mount_idle_timeout is given, the
+        archive is instead left mounted so later comparisons can reuse it.
+
+        The --metadata option performs a quick comparison that does not require
+        the archive to be mounted.  It lists the files that were added, removed
+        or modified since the archive was created based only on their type,
+        mode, size, modification time and link target.  Local files that are
+        excluded from your backups are not reported as added.  You can then
+        compare the contents of a particular file by running compare on that
+        file without --metadata:
+
+            $ emborg compare -m ~/bin
+
+        The --contents option also compares the contents of the files without
+        mounting the archive.  The local files are hashed while the archived
+        copies of the files are extracted by Borg and hashed, several at a
+        time.  Only files whose contents differ are reported as modified.  Use
+        --jobs to control how many extractions are run at once and --limit to
+        bound the amount of data that is read:
+
+            $ emborg compare -c -l 10GB ~/bin
 
         This command differs from the :ref:`diff command <diff>` in that it
         compares local files to those in an archive where as :ref:`diff <diff>`
@@ -556,9 +1084,6 @@ class CompareCommand(Command):
     def run(cls, command, args, settings, options):
         # read command line
         cmdline = docopt(cls.USAGE, argv=[command] + args)
-        mount_point = settings.as_path("default_mount_point")
-        if not mount_point:
-            raise Error("must specify default_mount_point setting to use this command.")
         path = cmdline['<path>']
         archive = cmdline["--archive"]
         date = cmdline["--date"]
@@ -571,6 +1096,28 @@ class CompareCommand(Command):
                 archive = get_name_of_latest_archive(settings)
             display(f'Using {archive}.')
 
+        if cmdline['--metadata'] or cmdline['--contents']:
+            try:
+                jobs = int(cmdline['--jobs'])
+            except ValueError:
+                jobs = 0
+            if jobs <= 0:
+                raise Error('expected a positive integer.', culprit='--jobs')
+            limit = cmdline['--limit']
+            if limit:
+                try:
+                    limit = Quantity(limit, 'B', ignore_sf=False, binary=True)
+                except QuantiPhyError as e:
+                    raise Error(e, culprit='--limit')
+            return cls.compare_metadata(
+                settings, archive, path or '.', options,
+                cmdline['--contents'], jobs, limit
+            )
+
+        mount_point = settings.as_path("default_mount_point")
+        if not mount_point:
+            raise Error("must specify default_mount_point setting to use this command.")
+
         # get diff tool
         if cmdline['--interactive']:
             differ = settings.manage_diffs_cmd
@@ -589,7 +1136,15 @@ class CompareCommand(Command):
         if not path:
             path = '.'
         archive_path = to_path(path).resolve().relative_to(settings.working_dir)
-        archive_path = to_path(mount_point, archive_path)
+
+        # reuse the archive if it is already mounted and leave it mounted
+        sessions = MountSessions(settings)
+        if sessions.enabled:
+            mounted = sessions.open(mount_point, archive, options)
+            try:
+                return cls.run_differ(differ, to_path(mounted, archive_path), path)
+            finally:
+                sessions.touch(mount_point)
 
         # create mount point if it does not exist
         try:
@@ -604,26 +1159,7 @@ class CompareCommand(Command):
                 args = [settings.destination(archive), mount_point],
                 emborg_opts = options,
             )
-
-            # run diff tool
-            if is_str(differ):
-                cmd = differ.format(
-                    archive_path = str(archive_path),
-                    local_path = str(path)
-                )
-                if cmd == differ:
-                    cmd = split_cmd(differ) + [archive_path, path]
-            else:
-                cmd = differ + [archive_path, path]
-            try:
-                diff = Cmd(cmd, modes='soEW1')
-                diff.run()
-            except Error as e:
-                codicil = e.stdout if e.stdout and not e.stderr else None
-                e.report(codicil=codicil)
-            except KeyboardInterrupt:
-                log('user killed compare command.')
-                diff.kill()
+            return cls.run_differ(differ, to_path(mount_point, archive_path), path)
 
         finally:
             # run borg to un-mount
@@ -636,8 +1172,96 @@ class CompareCommand(Command):
             except OSError as e:
                 warn(os_error(e), codicil="You will need to unmount before proceeding.")
 
+    @classmethod
+    def run_differ(cls, differ, archive_path, path):
+        if is_str(differ):
+            cmd = differ.format(
+                archive_path = str(archive_path),
+                local_path = str(path)
+            )
+            if cmd == differ:
+                cmd = split_cmd(differ) + [archive_path, path]
+        else:
+            cmd = differ + [archive_path, path]
+        try:
+            diff = Cmd(cmd, modes='soEW1')
+            diff.run()
+        except Error as e:
+            codicil = e.stdout if e.stdout and not e.stderr else None
+            e.report(codicil=codicil)
+        except KeyboardInterrupt:
+            log('user killed compare command.')
+            diff.kill()
         return diff.status
 
+    @classmethod
+    def compare_metadata(
+        cls, settings, archive, path, options, contents=False, jobs=1, limit=None
+    ):
+        path = str(get_archive_path(path, settings))
+        walker = Walker(settings)
+
+        # walk the local files while borg lists the archive
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            local = executor.submit(
+                lambda: {p: st for p, st in walker.walk([path])}
+            )
+            entries, borg = list_archive(
+                settings, archive, '{path}{type}{mode}{size}{mtime}{source}',
+                [path], options
+            )
+            archived = {
+                e['path']: (e['type'], e['mode'], e['size'], e['mtime'], e['source'])
+                for e in entries
+            }
+            local = local.result()
+
+        # find the differences
+        differences = {}
+        candidates = []
+        for each, attributes in archived.items():
+            if each not in local:
+                differences[each] = 'removed'
+                continue
+            changes = compare_status(
+                attributes, local[each], walker.local_path(each)
+            )
+            if contents:
+                # only differences in content are of interest
+                changes = [c for c in changes if c in ('type', 'size', 'target')]
+                if not changes and attributes[0] == '-':
+                    candidates.append((each, attributes[2]))
+            if changes:
+                differences[each] = f"modified  ({', '.join(changes)})"
+        for each in local:
+            if each not in archived:
+                differences[each] = 'added'
+
+        # compare contents of the files that may be the same
+        if candidates:
+            total = 0
+            for i, (each, size) in enumerate(candidates):
+                total += size
+                if limit is not None and total > limit:
+                    warn(
+                        f"{len(candidates) - i} files not compared,",
+                        "limit on amount of data reached."
+                    )
+                    candidates = candidates[:i]
+                    break
+            for each in compare_contents(
+                settings, archive, candidates, walker.local_path, jobs, options
+            ):
+                differences[each] = 'modified  (contents)'
+
+        # report the differences
+        for each in sorted(differences):
+            kind, _, changes = differences[each].partition('  ')
+            output(f"{kind:<9} {each}  {changes}".rstrip())
+        if borg and borg.status:
+            return borg.status
+        return 1 if differences else 0
+
 
 # ConfigsCommand command {{{1
 class ConfigsCommand(Command):
@@ -688,9 +1312,25 @@ class CreateCommand(Command):
             -l, --list       list the files and directories as they are processed
             -p, --progress   shows Borg progress
             -s, --stats      show Borg statistics
+            --if-changed     skip the backup if no files have changed
+            --estimate       report the size of the backup without running Borg
 
         To see the files listed as they are backed up, use the Emborg -v option.
         This can help you debug slow create operations.
+
+        With --if-changed, the files that would be backed up are scanned before
+        running Borg.  If none have been added, removed or modified since the
+        last backup made with --if-changed, Borg is not run, but the backup is
+        still recorded as having been performed.  If 'emborg watch' has been
+        running since the last backup, its journal is used instead of
+        scanning the files.
+
+        When estimating, the files that would be backed up are found by
+        scanning the local files, applying the same patterns and excludes as
+        Borg.  The number of files and their total size are reported for each
+        root and for each of the directories it directly contains.  Neither
+        the repository nor the scripts that are run before and after a backup
+        are used.
         """
     ).strip()
     REQUIRES_EXCLUSIVITY = True
@@ -701,6 +1341,8 @@ class CreateCommand(Command):
     def run(cls, command, args, settings, options):
         # read command line
         cmdline = docopt(cls.USAGE, argv=[command] + args)
+        if cmdline["--estimate"]:
+            return cls.estimate(settings)
         borg_opts = []
         show_stats = cmdline["--stats"] or settings.show_stats
         if cmdline["--list"]:
@@ -733,20 +1375,45 @@ class CreateCommand(Command):
                 except Error as e:
                     e.reraise(culprit=(setting, i, cmd.split()[0]))
 
+        # skip the backup if nothing has changed
+        # later configs may then skip their backup too, so repository-wide
+        # steps cannot be left to them
+        settings.queue.may_skip = cmdline["--if-changed"]
+        snapshot = SourceSnapshot(settings) if cmdline["--if-changed"] else None
+        unchanged = snapshot and ChangeJournal(settings).is_unchanged(snapshot)
+
         # run borg
+        # borg reports its statistics as JSON, which also gives the size of the
+        # repository so there is no need to run borg info afterwards
+        # its progress is followed only if it is shown or recorded, or if the
+        # status of each file is needed to count the hits in the files cache
         src_dirs = settings.src_dirs
+        progress = bool(
+            "--progress" in borg_opts
+            or "--list" in borg_opts
+            or settings.record_progress
+            or settings.files_cache_stats
+        )
         with settings.hooks as hooks:
             try:
-                borg = settings.run_borg(
-                    cmd = "create",
-                    borg_opts = borg_opts,
-                    args = [settings.destination(True)] + src_dirs,
-                    emborg_opts = options,
-                    show_borg_output = show_stats,
-                    use_working_dir = True,
-                )
-                create_status = borg.status
-                hooks.report_results(borg)
+                if unchanged:
+                    narrate("no files have changed, skipping backup.")
+                    create_status = 0
+                    stats = repo_size = None
+                else:
+                    borg = settings.run_borg(
+                        cmd = "create",
+                        borg_opts = borg_opts + ["--json"],
+                        args = [settings.destination(True)] + src_dirs,
+                        emborg_opts = options,
+                        show_borg_output = show_stats,
+                        use_working_dir = True,
+                        progress = progress,
+                    )
+                    create_status = borg.status
+                    stats, repo_size = cls.get_stats(borg)
+                    summary = cls.report_stats(stats, show_stats)
+                    hooks.report_results(borg, summary)
             except Error as e:
                 if e.stderr and "is not a valid repository" in e.stderr:
                     e.reraise(codicil="Run 'emborg init' to initialize the repository.")
@@ -765,9 +1432,14 @@ class CreateCommand(Command):
                         except Error as e:
                             e.reraise(culprit=(setting, i, cmd.split()[0]))
 
-        if cmdline["--fast"]:
+        # remember the state of the files that were backed up
+        if snapshot and not unchanged and create_status == 0:
+            if "dry-run" not in options:
+                snapshot.save()
+
+        if cmdline["--fast"] or unchanged:
             # update the date file
-            update_latest('create', settings.date_file, repo_size=False)
+            update_latest('create', settings.date_file, repo_size, stats)
             return create_status
 
         # check and prune the archives if requested
@@ -781,7 +1453,20 @@ class CreateCommand(Command):
                 elif settings.check_after_create in [True, "all"]:
                     args = ["--all"]
                 elif settings.check_after_create == "all in repository":
-                    args = ["--all", "--include-external"]
+                    successor = settings.repository_successor(
+                        lambda peer: peer.check_after_create == "all in repository"
+                    )
+                    if successor:
+                        narrate(
+                            f"leaving check to {successor}, which shares the repository."
+                        )
+                        settings.defer('check', successor)
+                        args = None
+                    else:
+                        args = ["--all", "--include-external"]
+                elif settings.check_after_create == "rotating":
+                    max_duration = settings.check_max_duration or DEFAULT_MAX_DURATION
+                    args = ["--max-duration", max_duration]
                 else:
                     warn(
                         "unknown value: {}, checking latest.".format(
@@ -790,15 +1475,16 @@ class CreateCommand(Command):
                         cuplrit = "check_after_create",
                     )
                     args = []
-                if '--all' in args:
-                    announce("Checking repository ...")
-                else:
-                    announce("Checking archive ...")
-                check = CheckCommand()
-                try:
-                    check.run("check", args, settings, options)
-                except Error:
-                    check_status = 1
+                if args is not None:
+                    if '--all' in args or '--max-duration' in args:
+                        announce("Checking repository ...")
+                    else:
+                        announce("Checking archive ...")
+                    check = CheckCommand()
+                    try:
+                        check.run("check", args, settings, options)
+                    except Error:
+                        check_status = 1
 
             # prune the repository if requested
             activity = "pruning"
@@ -810,22 +1496,8 @@ class CreateCommand(Command):
             else:
                 prune_status = 0
 
-            # get the size of the repository
-            activity = "sizing"
-            # now output the information from borg about the repository
-            info = settings.run_borg(
-                cmd = "info",
-                args = [settings.destination()],
-                emborg_opts = options,
-                borg_opts = ['--json'],
-                strip_prefix = True,
-            )
-            out = info.stdout
-            out = json.loads(out)
-            repo_size = Quantity(out['cache']['stats']['unique_csize'], 'B')
-
             # update the date file
-            update_latest('create', settings.date_file, repo_size.render(prec='full'))
+            update_latest('create', settings.date_file, repo_size, stats)
 
         except Error as e:
             e.reraise(
@@ -834,7 +1506,95 @@ class CreateCommand(Command):
                     "No error was reported while creating the archive.",
                 )
             )
-        return max([create_status, check_status, prune_status, info.status])
+        return max([create_status, check_status, prune_status])
+
+    @classmethod
+    def estimate(cls, settings):
+        # total the files of each root and of the directories it contains
+        settings.resolve_patterns([])
+        walker = Walker(settings)
+        totals = {}
+        for local_root in settings.roots:
+            root = str(local_root).lstrip("/") or "."
+            prefix = "" if root == "." else root + "/"
+            directories = totals.setdefault(root, {root: [0, 0]})
+            for path, st in walker.walk([local_root]):
+                if stat.S_ISDIR(st.st_mode):
+                    continue
+                size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+                name, slash, rest = path[len(prefix):].partition("/")
+                for directory in {root, prefix + name if slash else root}:
+                    total = directories.setdefault(directory, [0, 0])
+                    total[0] += 1
+                    total[1] += size
+
+        # report the totals
+        def show_size(size):
+            return Quantity(size, 'B').render(prec=2, spacer="")
+
+        output(f"{'size':>7}  {'files':>11}  path")
+        grand_total = [0, 0]
+        for root, directories in totals.items():
+            for directory in [root] + sorted(d for d in directories if d != root):
+                count, size = directories[directory]
+                output(f"{show_size(size):>7}  {count:>11,}  {directory}")
+            grand_total[0] += directories[root][0]
+            grand_total[1] += directories[root][1]
+        count, size = grand_total
+        output(f"{show_size(size):>7}  {count:>11,}  total")
+
+    @classmethod
+    def get_stats(cls, borg):
+        # extract the statistics from the JSON output of borg create
+        # returns the archive statistics and the size of the repository
+        if not borg.stdout or not borg.stdout.strip():
+            return None, None   # borg gives no statistics on a dry run
+        try:
+            data = json.loads(borg.stdout)
+            archive = data['archive']
+            archive_stats = archive['stats']
+            stats = {
+                'archive': archive['name'],
+                'files': str(archive_stats['nfiles']),
+                'original size': archive_stats['original_size'],
+                'compressed size': archive_stats['compressed_size'],
+                'deduplicated size': archive_stats['deduplicated_size'],
+                'duration': Quantity(archive['duration'], 's').render(prec=3),
+            }
+            repo_size = data['cache']['stats']['unique_csize']
+        except (json.decoder.JSONDecodeError, KeyError, TypeError) as e:
+            warn("could not decode statistics from Borg create command.", codicil=e)
+            return None, None
+        for name in ['original size', 'compressed size', 'deduplicated size']:
+            stats[name] = Quantity(stats[name], 'B').render(prec='full')
+
+        # files found unchanged in the files cache are not read again, the
+        # rest are chunked; many added files on an unchanged tree suggest that
+        # the files cache was lost or that its entries had expired
+        monitor = getattr(borg, 'progress', None)
+        statuses = monitor.statuses if monitor else {}
+        looked_up = sum(statuses.get(s, 0) for s in "AMU")
+        if looked_up:
+            hits = statuses.get('U', 0)
+            stats['files cache'] = (
+                f"{hits} unchanged, {statuses.get('M', 0)} modified, "
+                f"{statuses.get('A', 0)} added ({hits/looked_up:.1%} hits)"
+            )
+        return stats, Quantity(repo_size, 'B').render(prec='full')
+
+    @classmethod
+    def report_stats(cls, stats, show_stats):
+        # statistics are displayed if requested, otherwise they are just logged
+        if not stats:
+            return None
+        summary = "\n".join(
+            f"{name}: {value}" for name, value in stats.items()
+        )
+        if show_stats:
+            display(summary)
+        else:
+            log(summary)
+        return summary
 
 # DeleteCommand command {{{1
 class DeleteCommand(Command):
@@ -858,7 +1618,8 @@ class DeleteCommand(Command):
         the compact command is run.  You can specify that a compaction is
         performed as part of the deletion by setting compact_after_delete.  If
         set, the --fast flag causes the compaction to be skipped.  If not set,
-        the --fast flag has no effect.
+        the --fast flag has no effect.  Setting compact_threshold or
+        compact_max_deferral defers compaction until it is worthwhile.
 
         Using --repo causes the entire repository to be deleted.  Unlike borg
         itself, no warning is issued and no additional conformation is required.
@@ -873,43 +1634,51 @@ class DeleteCommand(Command):
         # read command line
         cmdline = docopt(cls.USAGE, argv=[command] + args)
         archives = cmdline["<archive>"]
-        cache_only = ['--cache-only'] if cmdline['--cache-only'] else []
         if cmdline['--repo']:
             if archives:
                 raise Error("must not specify an archive along with --repo.")
             os.environ['BORG_DELETE_I_KNOW_WHAT_I_AM_DOING'] = 'YES'
-        elif cache_only:
+        elif cmdline['--cache-only']:
             if archives:
                 raise Error("must not specify an archive along with --cache-only.")
+            return CacheCommand.delete(settings, options)
         else:
             if not archives:
                 archives = [get_name_of_latest_archive(settings)]
                 if not archives:
                     raise Error("no archives available.")
         show_stats = cmdline["--stats"] or settings.show_stats
+        policy = CompactionPolicy(settings)
+        record = policy.active and 'dry-run' not in options
 
         # run borg
         borg = settings.run_borg(
             cmd = "delete",
-            args = cache_only + [settings.repository] + archives,
+            borg_opts = ["--stats"] if record else [],
+            args = [settings.repository] + archives,
             emborg_opts = options,
             strip_prefix = True,
             show_borg_output = show_stats,
+            progress = record,
         )
         out = borg.stdout
         if out:
             output(out.rstrip())
         delete_status = borg.status
+        if record and not cmdline['--repo']:
+            policy.record('delete', borg.stderr)
 
         if cmdline["--fast"]:
             return delete_status
 
         try:
             # compact the repository if requested
-            if settings.compact_after_delete and 'dry-run' not in options:
-                narrate("Compacting repository ...")
-                compact = CompactCommand()
-                compact_status = compact.run("compact", [], settings, options)
+            if (
+                settings.compact_after_delete
+                and 'dry-run' not in options
+                and not cmdline['--repo']
+            ):
+                compact_status = policy.compact_if_due(CompactCommand(), options)
             else:
                 compact_status = 0
 
@@ -936,10 +1705,22 @@ class DiffCommand(Command):
         Options:
             -R, --recursive                     show files in sub directories
                                                 when path is specified
+            -s, --summary                       summarize the changes by
+                                                directory
+            --depth <n>                         depth of the directories used
+                                                by summary [default: 2]
+            --top <n>                           number of directories shown
+                                                by summary [default: 20]
 
         Shows the differences between two archives.  You can constrain the 
         output listing to only those files in a particular directory by 
         adding that path to the end of the command.
+
+        With --summary, the changes are totaled by directory rather than being
+        listed individually.  Changes are attributed to the directory that
+        contains them, or to its ancestor that is --depth levels below the
+        given path.  The directories with the most bytes added and removed are
+        shown, along with the number of entries added, removed and modified.
         """
     ).strip()
     REQUIRES_EXCLUSIVITY = True
@@ -954,6 +1735,20 @@ class DiffCommand(Command):
         archive2 = cmdline["<archive2>"]
         path = cmdline['<path>']
         recursive = cmdline['--recursive']
+        summary = cmdline['--summary']
+        if summary:
+            try:
+                depth = int(cmdline['--depth'])
+            except ValueError:
+                depth = 0
+            if depth <= 0:
+                raise Error('expected a positive integer.', culprit='--depth')
+            try:
+                top = int(cmdline['--top'])
+            except ValueError:
+                top = 0
+            if top <= 0:
+                raise Error('expected a positive integer.', culprit='--top')
 
         # resolve the path relative to working directory
         if path:
@@ -961,26 +1756,30 @@ class DiffCommand(Command):
         else:
             path = ''
 
-        # run borg
-        borg = settings.run_borg(
+        # run borg, borg selects the entries on the path
+        paths = [path] if path else []
+        borg = settings.stream_borg(
             cmd = "diff",
-            args = [settings.destination(archive1), archive2],
+            args = [settings.destination(archive1), archive2] + paths,
             emborg_opts = options,
             borg_opts = ['--json-lines'],
         )
 
-        # convert from JSON-lines to JSON
-        json_data = '[' + ','.join(borg.stdout.splitlines()) + ']'
-        diffs = json.loads(json_data)
+        diffs = decode_json_lines(borg, "diff")
+        if summary:
+            return cls.report_summary(diffs, path, depth, top)
+        return cls.report_differences(diffs, path, recursive)
 
+    @classmethod
+    def report_differences(cls, diffs, path, recursive):
+        # report differences as they arrive
+        differences = False
         for diff in diffs:
             this_path = diff['path']
-            if path:
-                if not this_path.startswith(path):
-                    continue  # skip files not on the path
-                if not recursive:
-                    if '/' in this_path[len(path)+1:]:
-                        continue  # skip files is subdirs of specified path
+            if path and not recursive:
+                if not in_directory(this_path, path):
+                    continue  # skip files is subdirs of specified path
+            differences = True
             changes = diff['changes'][0]
             type = changes.get('type', '')
             if 'size' in changes:
@@ -992,7 +1791,160 @@ class DiffCommand(Command):
             desc = type + sep + size
             print(desc, this_path)
 
-        return 1 if diffs else 0
+        return 1 if differences else 0
+
+    @classmethod
+    def report_summary(cls, diffs, path, depth, top):
+        # accumulate the changes by directory in a single pass
+        # each total is: [added, removed, modified, bytes added, bytes removed]
+        base_depth = len(path.split('/')) if path else 0
+        totals = {}
+        for diff in diffs:
+            directory = '/'.join(
+                diff['path'].split('/')[:-1][:base_depth + depth]
+            )
+            total = totals.get(directory)
+            if not total:
+                total = totals[directory] = [0, 0, 0, 0, 0]
+            kinds = set()
+            for change in diff['changes']:
+                type = change.get('type', '')
+                kind = type.split()[0] if type else ''
+                if kind == 'added':
+                    total[3] += change.get('size', 0)
+                elif kind == 'removed':
+                    total[4] += change.get('size', 0)
+                elif type == 'modified':
+                    total[3] += change.get('added', 0)
+                    total[4] += change.get('removed', 0)
+                kinds.add(kind)
+            if 'added' in kinds:
+                total[0] += 1
+            elif 'removed' in kinds:
+                total[1] += 1
+            else:
+                total[2] += 1
+        if not totals:
+            return 0
+
+        # report the directories with the most churn
+        ranked = sorted(totals.items(), key=lambda t: -(t[1][3] + t[1][4]))
+        print(f"{'added':>8} {'removed':>8} {'modified':>8} {'+bytes':>9} {'-bytes':>9}  directory")
+        for directory, total in ranked[:top]:
+            added, removed, modified, bytes_added, bytes_removed = total
+            bytes_added = Quantity(bytes_added, 'B').render(prec=2)
+            bytes_removed = Quantity(bytes_removed, 'B').render(prec=2)
+            print(
+                f"{added:8} {removed:8} {modified:8}",
+                f"{bytes_added:>9} {bytes_removed:>9} ",
+                directory or '.'
+            )
+        if len(ranked) > top:
+            print(f"... and {len(ranked) - top} more directories.")
+        return 1
+
+
+# DuCommand command {{{1
+class DuCommand(Command):
+    NAMES = "du".split()
+    DESCRIPTION = "show the space used by the directories in an archive"
+    USAGE = dedent(
+        """
+        Usage:
+            emborg du [options] [<path>]
+
+        Options:
+            -a <archive>, --archive <archive>   name of the archive to use
+            -d <date>, --date <date>            date of the desired archive
+            -c, --compressed                    also show the compressed and
+                                                deduplicated sizes (slower)
+            -m <depth>, --max-depth <depth>     only show directories that are
+                                                at most <depth> levels below path
+            -s <size>, --min-size <size>        only show directories that hold
+                                                at least <size> bytes
+            -S, --sort-by-size                  sort by size
+
+        Shows the total size of the files contained in each directory of an
+        archive, including those in its subdirectories, much like the Unix du
+        command.  If a path is given, only the directories within that path are
+        shown.  The size is the original size of the files.  With --compressed
+        the compressed size and the deduplicated size, the space consumed by
+        chunks that are unique to this archive, are also shown.
+
+        The archive is chosen as with the manifest command, so by default the
+        most recent archive is used.  For example, to show the directories in
+        your home directory that hold more than 1 GB, use:
+
+            emborg du --max-depth 1 --min-size 1GB ~
+        """
+    ).strip()
+    REQUIRES_EXCLUSIVITY = True
+    COMPOSITE_CONFIGS = "first"
+    LOG_COMMAND = True
+
+    @classmethod
+    def run(cls, command, args, settings, options):
+        # read command line
+        cmdline = docopt(cls.USAGE, argv=[command] + args)
+        path = cmdline["<path>"]
+        archive = cmdline["--archive"]
+        date = cmdline["--date"]
+        max_depth = cmdline["--max-depth"]
+        min_size = cmdline["--min-size"]
+        if max_depth:
+            try:
+                max_depth = int(max_depth)
+            except ValueError:
+                max_depth = -1
+            if max_depth < 0:
+                raise Error(
+                    'expected a non-negative integer.', culprit='--max-depth'
+                )
+        if min_size:
+            try:
+                min_size = Quantity(min_size, 'B', ignore_sf=False, binary=True)
+            except QuantiPhyError as e:
+                raise Error(e, culprit='--min-size')
+        fields = ['size']
+        if cmdline["--compressed"]:
+            fields += ['csize', 'dsize']
+
+        # resolve the path relative to working directory
+        if path:
+            path = str(get_archive_path(path, settings))
+        else:
+            path = ''
+
+        # get the desired archive
+        if date and not archive:
+            archive = get_name_of_nearest_archive(settings, date)
+        if not archive:
+            archive = get_name_of_latest_archive(settings)
+        output("Archive:", archive)
+
+        # accumulate the sizes of the directories in a single pass
+        keys = '{path}{type}' + ''.join('{' + f + '}' for f in fields)
+        entries, borg = list_archive(
+            settings, archive, keys, [path] if path else [], options
+        )
+        totals = directory_sizes(entries, path, fields, max_depth)
+
+        # report the totals
+        if cmdline["--sort-by-size"]:
+            directories = sorted(totals, key=lambda d: totals[d][0])
+        else:
+            directories = sorted(totals)
+        if len(fields) > 1:
+            print('  '.join(f'{field:>7}' for field in fields), 'directory')
+        for directory in directories:
+            sizes = totals[directory]
+            if min_size and sizes[0] < min_size:
+                continue
+            sizes = (Quantity(size, 'B').render(prec=2, spacer="") for size in sizes)
+            columns = '  '.join(f'{size:>7}' for size in sizes)
+            print(columns, directory or '.')
+
+        return borg.status if borg else 0
 
 
 # DueCommand command {{{1
@@ -1402,6 +2354,109 @@ class HelpCommand(Command):
         return 0
 
 
+# HistoryCommand command {{{1
+class HistoryCommand(Command):
+    NAMES = "history".split()
+    DESCRIPTION = "show the versions of a file held in the archives"
+    USAGE = dedent(
+        """
+        Usage:
+            emborg history [options] <path>
+
+        Options:
+            -s <date>, --since <date>           first archive to consider
+            -u <date>, --until <date>           last archive to consider
+            -j <n>, --jobs <n>                  number of archives to list at
+                                                once [default: 4]
+            -R, --recursive                     show the history of the files
+                                                in sub directories
+
+        Shows which archives hold each version of a file.  Each distinct
+        version, as identified by its type, size and modification time, is
+        shown once along with the first and last archive of the run of
+        consecutive archives that contain it.
+
+        All archives are examined unless --since or --until are given.  They
+        take the same values as the --date option of the manifest command and
+        select the archive in the same way.  For example:
+
+            emborg history --since 3M ~/.bashrc
+
+        If the path is a directory, only the history of the directory itself is
+        shown unless --recursive is given, in which case the history of every
+        file contained within it is shown.
+        """
+    ).strip()
+    REQUIRES_EXCLUSIVITY = True
+    COMPOSITE_CONFIGS = "first"
+    LOG_COMMAND = True
+
+    @classmethod
+    def run(cls, command, args, settings, options):
+        # read command line
+        cmdline = docopt(cls.USAGE, argv=[command] + args)
+        path = str(get_archive_path(cmdline["<path>"], settings))
+        recursive = cmdline["--recursive"]
+        try:
+            jobs = int(cmdline["--jobs"])
+        except ValueError:
+            jobs = 0
+        if jobs <= 0:
+            raise Error('expected a positive integer.', culprit='--jobs')
+
+        # choose the archives
+        archives = [a["name"] for a in get_available_archives(settings)]
+        if not archives:
+            raise Error("no archives are available.")
+        first, last = 0, len(archives)
+        if cmdline["--since"]:
+            since = get_name_of_nearest_archive(settings, cmdline["--since"])
+            first = archives.index(since)
+        if cmdline["--until"]:
+            until = get_name_of_nearest_archive(settings, cmdline["--until"])
+            last = archives.index(until) + 1
+        archives = archives[first:last]
+
+        # list the path in each archive, several at a time
+        def list_path(archive):
+            entries, borg = list_archive(
+                settings, archive, '{path}{type}{mode}{size}{mtime}', [path],
+                options
+            )
+            return {
+                e['path']: (e['mode'][0], e['size'], e['mtime'])
+                for e in entries
+                if recursive or e['path'] == path
+            }
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            listings = list(executor.map(list_path, archives))
+
+        # find the runs of consecutive archives that hold the same version
+        paths = sorted(set().union(*listings))
+        if not paths:
+            raise Error("not found in any archive.", culprit=path)
+        for each in paths:
+            runs = []
+            for archive, listing in zip(archives, listings):
+                version = listing.get(each)
+                if runs and runs[-1][0] == version:
+                    runs[-1][2] = archive
+                else:
+                    runs.append([version, archive, archive])
+
+            # report them
+            output(f"{each}:")
+            for version, first, last in runs:
+                archives_used = first if first == last else f"{first} – {last}"
+                if version:
+                    type, size, mtime = version
+                    mtime = render_time(mtime, 'YYYY-MM-DD HH:mm:ss')
+                    size = Quantity(size, 'B').render(prec=2)
+                    output(f"    {mtime} {size:>9}  {archives_used}")
+                else:
+                    output(f"    {'absent':29}  {archives_used}")
+
+
 # InfoCommand command {{{1
 class InfoCommand(Command):
     NAMES = "info".split()
@@ -1596,6 +2651,8 @@ class ManifestCommand(Command):
             -G, --sort-by-group                 sort by group
             -K <name>, --sort-by-key <name>     sort by key (the Borg field name)
             -r, --reverse-sort                  reverse the sort order
+            -T <n>, --top <n>                   only show the <n> entries with
+                                                the largest sort key
             -R, --recursive                     show files in sub directories
                                                 when path is specified
 
@@ -1641,6 +2698,12 @@ class ManifestCommand(Command):
         example, sort by size, use:
 
             emborg manifest -S
+
+        You can limit the output to the files with the largest values of the
+        sort key.  For example, to list the 50 largest files, with the largest
+        first, use:
+
+            emborg manifest -S -r --top 50
         """
     ).strip()
     REQUIRES_EXCLUSIVITY = True
@@ -1655,6 +2718,14 @@ class ManifestCommand(Command):
         archive = cmdline["--archive"]
         date = cmdline["--date"]
         recursive = cmdline["--recursive"]
+        top = cmdline["--top"]
+        if top:
+            try:
+                top = int(top)
+            except ValueError:
+                top = 0
+            if top <= 0:
+                raise Error('expected a positive integer.', culprit='--top')
 
         # resolve the path relative to working directory
         if path:
@@ -1717,6 +2788,8 @@ class ManifestCommand(Command):
             sort_key = 'group'
         elif cmdline["--sort-by-key"]:
             sort_key = cmdline["--sort-by-key"]
+        if top and not sort_key:
+            raise Error('a sort key is required.', culprit='--top')
 
         # process format options
         if cmdline["--name"]:
@@ -1741,26 +2814,23 @@ class ManifestCommand(Command):
             # lower case it so we get size when user requests Size
         if sort_key and '{' + sort_key not in keys:
             keys = keys + '{' + sort_key + '}'
-        args = [
-            '--json-lines',
-            '--format', keys,
-            settings.destination(archive),
-        ]
-        borg = settings.run_borg(
-            cmd="list", args=args, emborg_opts=options,
-        )
-        # convert from JSON-lines to JSON
-        json_data = '[' + ','.join(borg.stdout.splitlines()) + ']'
-        lines = json.loads(json_data)
-
-        # sort the output
-        if sort_key:
-            try:
-                lines = sorted(lines, key=lambda x: x[sort_key])
-            except KeyError:
-                raise Error('unknown key.', culprit=sort_key)
-        if cmdline["--reverse-sort"]:
-            lines.reverse()
+        # entries are decoded as they arrive, only gathered up if sorted
+        paths = [path] if path else []
+        lines, borg = list_archive(settings, archive, keys, paths, options)
+        if path and not recursive:
+            # skip files in subdirs of specified path before sorting
+            lines = (v for v in lines if in_directory(v['path'], path))
+
+        # sort the output, spilling to disk if needed to bound memory use
+        reverse = cmdline["--reverse-sort"]
+        if top:
+            lines = top_entries(lines, sort_key, top, reverse)
+        elif sort_key or reverse:
+            # spill to the data directory, the system temporary directory is
+            # often held in memory
+            lines = sort_entries(
+                lines, sort_key, reverse, sort_memory(settings), settings.data_dir
+            )
 
         # import QuantiPhy for Size
         Quantity.set_prefs(spacer="")
@@ -1771,67 +2841,19 @@ class ManifestCommand(Command):
         else:
             healthy_color = Color("green", enable=Color.isTTY())
             broken_color = Color("red", enable=Color.isTTY())
-        total_size = 0
-        for values in lines:
-            # this loop can be quite slow. the biggest issue is arrow. parsing
-            # time is slow. also output() can be slow, so use print() instead.
-            if path:
-                if not values['path'].startswith(path):
-                    continue  # skip files not on the path
-                if not recursive:
-                    if '/' in values['path'][len(path)+1:]:
-                        continue  # skip files is subdirs of specified path
-            if values['healthy']:
-                colorize = healthy_color
-            else:
-                colorize = broken_color
-            values['health'] = 'healthy' if values['healthy'] else 'broken'
-            type = values['mode'][0]
-            values['Type'] = ''
-            values['extra'] = ''
-            if type == 'd':
-                values['Type'] = '/'  # directory
-            elif type == 'l':
-                values['Type'] = '@'  # directory
-                values['extra'] = ' —> ' + values['source']
-            elif type == 'h':
-                values['extra'] = ' links to ' + values['source']
-            elif type == 'p':
-                values['Type'] = '|'
-            elif type != '-':
-                log('UNKNOWN TYPE:', type, values['path'])
-            if 'mtime' in values and 'MTime' in template:
-                values['MTime'] = arrow.get(values['mtime'])
-            if 'ctime' in values and 'CTime' in template:
-                values['CTime'] = arrow.get(values['ctime'])
-            if 'atime' in values and 'ATime' in template:
-                values['ATime'] = arrow.get(values['atime'])
-            if 'size' in values:
-                total_size += values['size']
-                if '{Size' in template:
-                    values['Size'] = Quantity(values['size'], "B")
-            if 'csize' in values and '{CSize' in template:
-                values['CSize'] = Quantity(values['csize'], "B")
-            if 'dsize' in values and '{DSize' in template:
-                values['DSize'] = Quantity(values['dsize'], "B")
-            if 'dcsize' in values and '{DCSize' in template:
-                values['DCSize'] = Quantity(values['dcsize'], "B")
-            try:
-                print(colorize(template.format(**values)))
-            except ValueError as e:
-                raise Error(
-                    full_stop(e),
-                    'Likely due to a bad format specification in manifest_formats:',
-                    codicil=template
-                )
-            except KeyError as e:
-                raise Error('Unknown key in:', culprit=e, codicil=template)
+        formatter = ManifestFormatter(template, healthy_color, broken_color)
+        try:
+            for values in lines:
+                formatter.write(values)
+        finally:
+            formatter.flush()
 
+        total_size = formatter.total_size
         if total_size:
             total_size = Quantity(total_size, 'B')
             print(f"Total size = {total_size:0.2s}.")
 
-        return borg.status
+        return borg.status if borg else 0
 
 
 # MountCommand command {{{1
@@ -1891,7 +2913,10 @@ class MountCommand(Command):
 
             emborg mount --all backups
 
-        You should use `emborg umount` when you are done.
+        You should use `emborg umount` when you are done.  Alternatively, if
+        the mount_idle_timeout setting is given, the archive is unmounted once
+        it has not been used by mount or compare for that long.  Mounting an
+        archive that is already mounted reuses the existing mount.
         """
     ).strip()
     REQUIRES_EXCLUSIVITY = True
@@ -1922,6 +2947,17 @@ class MountCommand(Command):
             elif not mount_all:
                 archive = get_name_of_latest_archive(settings)
 
+        # reuse the archive if it is already mounted
+        sessions = MountSessions(settings)
+        if sessions.enabled:
+            directory = sessions.open(
+                mount_point, archive, options, include_external_archives
+            )
+            if directory != to_path(sessions.key(mount_point)):
+                # the whole repository is mounted, the archive is within it
+                display("archive is at:", directory)
+            return 0
+
         # create mount point if it does not exist
         try:
             mkdir(mount_point)
@@ -1957,13 +2993,20 @@ class PruneCommand(Command):
             -f, --fast               skip compacting
             -l, --list               show fate of each archive
             -s, --stats              show Borg statistics
+            --simulate               show fate of each archive without pruning
 
         The prune command deletes archives that are no longer needed as
         determined by the prune rules.  However, the disk space is not reclaimed
         until the compact command is run.  You can specify that a compaction is
         performed as part of the prune by setting compact_after_delete.  If set,
         the --fast flag causes the compaction to be skipped.  If not set, the
-        --fast flag has no effect.
+        --fast flag has no effect.  Setting compact_threshold or
+        compact_max_deferral defers compaction until it is worthwhile.
+
+        When simulating, the prune rules are applied locally to the list of
+        archives, which is taken from the cache of archives if it is current,
+        so Borg need not be run.  The archives that would be kept are shown
+        along with the rule that keeps them.
         """
     ).strip()
     REQUIRES_EXCLUSIVITY = True
@@ -1993,14 +3036,23 @@ class PruneCommand(Command):
                 wrap = True,
             )
 
+        if cmdline["--simulate"]:
+            return cls.simulate(settings, include_external_archives)
+
         # run borg
+        policy = CompactionPolicy(settings)
+        record = policy.active and 'dry-run' not in options
+        show_stats = "--stats" in borg_opts
+        if record and not show_stats:
+            borg_opts.append("--stats")
         borg = settings.run_borg(
             cmd = "prune",
             borg_opts = borg_opts,
             args = [settings.destination()],
             emborg_opts = options,
             strip_prefix = include_external_archives,
-            show_borg_output = "--stats" in borg_opts,
+            show_borg_output = show_stats,
+            progress = record,
         )
         out = borg.stdout
         if out:
@@ -2008,17 +3060,24 @@ class PruneCommand(Command):
         prune_status = borg.status
 
         # update the date file
-        update_latest('prune', settings.date_file)
+        if record:
+            policy.record('prune', borg.stderr)
+        else:
+            update_latest('prune', settings.date_file)
 
         if fast:
             return prune_status
 
         try:
             # compact the repository if requested
-            if settings.compact_after_delete:
-                narrate("Compacting repository ...")
-                compact = CompactCommand()
-                compact_status = compact.run("compact", [], settings, options)
+            if settings.compact_after_delete and 'dry-run' not in options:
+                compact_status = policy.compact_if_due(
+                    CompactCommand(), options,
+                    performs = lambda peer: peer.compact_after_delete and (
+                        settings.queue.command != "create"
+                        or peer.prune_after_create
+                    ),
+                )
             else:
                 compact_status = 0
 
@@ -2032,6 +3091,28 @@ class PruneCommand(Command):
 
         return max([prune_status, compact_status])
 
+    @classmethod
+    def simulate(cls, settings, include_external):
+        # apply the prune rules to the archives without running borg prune
+        archives = get_available_archives(
+            settings, include_external=include_external
+        )
+        fates = simulate_prune(archives, prune_rules(settings))
+        width = max((len(a["name"]) for a, r in fates), default=0)
+        pruned = 0
+        for archive, reason in fates:
+            if not reason:
+                reason = "would prune"
+                pruned += 1
+            when = archive["when"].format("YYYY-MM-DD HH:mm:ss")
+            output(f"{archive['name']:<{width}}  {when}  {reason}")
+        kept = len(fates) - pruned
+        output(
+            f"{plural(kept):# archive/s} would be kept,",
+            f"{plural(pruned):# archive/s} would be pruned.",
+        )
+        return 0
+
 
 # RestoreCommand command {{{1
 class RestoreCommand(Command):
@@ -2232,6 +3313,7 @@ class UmountCommand(Command):
             borg = settings.run_borg(
                 cmd="umount", args=[mount_point], emborg_opts=options,
             )
+            MountSessions(settings).forget(mount_point)
             try:
                 mount_point.rmdir()
             except OSError as e:
@@ -2277,3 +3359,34 @@ class VersionCommand(Command):
         # file, so if we keep going emborg might emit spurious errors if the
         # settings files are not yet properly configured.
         return 0
+
+
+# WatchCommand {{{1
+class WatchCommand(Command):
+    NAMES = "watch".split()
+    DESCRIPTION = "watch the files for changes"
+    USAGE = dedent(
+        """
+        Usage:
+            emborg watch
+
+        Watches the files that would be backed up and keeps a journal of the
+        directories in which files are added, removed or modified.  Runs until
+        interrupted.  While it runs 'emborg create --if-changed' uses the
+        journal to determine whether a backup is needed rather than scanning
+        the files.  Restart it after changing the files to be backed up.
+
+        Requires the inotify_simple Python package and Linux.
+        """
+    ).strip()
+    REQUIRES_EXCLUSIVITY = False
+    COMPOSITE_CONFIGS = "error"
+    LOG_COMMAND = False
+
+    @classmethod
+    def run(cls, command, args, settings, options):
+        # read command line
+        docopt(cls.USAGE, argv=[command] + args)
+
+        Watcher(settings).run()
+        return 0
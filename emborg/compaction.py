@@ -0,0 +1,201 @@
+# Compaction Policy
+#
+# Decides whether the repository should be compacted after a prune or delete.
+# The space freed by each prune or delete is taken from the statistics
+# reported by Borg and accumulated in the date file until the next compaction,
+# so that compaction can be deferred until it is worthwhile.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import re
+import arrow
+from inform import Error, narrate
+from quantiphy import Quantity, QuantiPhyError
+from .cache import repository_id
+from .preferences import COMPACTION_FILE
+from .utilities import read_latest, to_seconds, update_latest, when
+
+# Globals {{{1
+UNKNOWN = "unknown"
+
+# the line of the --stats output of prune and delete that gives the space
+# freed, the last column is the deduplicated size
+DELETED_DATA = re.compile(
+    r"^Deleted data:\s+(-?[\d.]+ ?\w*B)\s+(-?[\d.]+ ?\w*B)\s+(-?[\d.]+ ?\w*B)\s*$",
+    re.MULTILINE
+)
+
+
+# to_bytes() {{{1
+def to_bytes(value, culprit=None):
+    try:
+        return Quantity(str(value).lstrip('-'), 'B', ignore_sf=False)
+    except QuantiPhyError as e:
+        raise Error(e, culprit=culprit)
+
+
+# reclaimed_space() {{{1
+def reclaimed_space(stderr):
+    """Returns the space freed by a prune or delete, or None if not reported.
+
+    stderr holds the messages from Borg, which include the statistics if
+    --stats was given.  The freed space only becomes available once the
+    repository is compacted.
+    """
+    matches = DELETED_DATA.findall(stderr or "")
+    if not matches:
+        return None
+    return Quantity(sum(to_bytes(m[2]) for m in matches), 'B')
+
+
+# CompactionPolicy class {{{1
+class CompactionPolicy:
+    """Compaction Policy
+
+    Tracks the space that would be reclaimed by compacting the repository and
+    decides whether compaction is due.  The policy is active if either
+    compact_threshold or compact_max_deferral is set, otherwise the repository
+    is compacted after every prune or delete.
+
+    The reclaimable space and the time of the last compaction are kept in
+    a file named after the repository, so that they are shared by all the
+    configurations that use it.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.threshold = settings.compact_threshold
+        self.max_deferral = settings.compact_max_deferral
+        self.path = settings.data_dir / COMPACTION_FILE.format(
+            repository_id = repository_id(settings.repository)
+        )
+
+    # active {{{2
+    @property
+    def active(self):
+        return bool(self.threshold or self.max_deferral)
+
+    # load() {{{2
+    def load(self):
+        try:
+            return read_latest(self.path)
+        except FileNotFoundError:
+            return {}
+
+    # record() {{{2
+    def record(self, command, stderr):
+        """Adds the space freed by a prune or delete to the pending total."""
+        freed = reclaimed_space(stderr)
+        pending = self.load().get('reclaimable space')
+        if freed is None or pending == UNKNOWN:
+            total = UNKNOWN
+        else:
+            total = freed + (to_bytes(pending) if pending else 0)
+            total = Quantity(total, 'B').render(prec='full')
+        update_latest(command, self.settings.date_file)
+        update_latest(command, self.path, reclaimable=total)
+
+    # compacted() {{{2
+    def compacted(self):
+        """Records that the repository was just compacted."""
+        update_latest('compact', self.path, reclaimable=False)
+
+    # decide() {{{2
+    def decide(self):
+        """Returns whether the repository should be compacted and why."""
+        if not self.active:
+            return True, "compact_after_delete is set"
+        latest = self.load()
+        pending = latest.get('reclaimable space')
+        last_compact = latest.get('compact last run')
+
+        if self.max_deferral:
+            max_deferral = to_seconds(self.max_deferral, 'compact_max_deferral')
+            if not last_compact:
+                return True, "repository has not been compacted before"
+            age = (arrow.now() - last_compact).total_seconds()
+            if age >= max_deferral:
+                return True, (
+                    f"last compaction was {when(last_compact)} ago, "
+                    f"exceeds compact_max_deferral of {self.max_deferral}"
+                )
+        if not self.threshold:
+            return False, (
+                f"last compaction was {when(last_compact)} ago, "
+                f"within compact_max_deferral of {self.max_deferral}"
+            )
+        if pending == UNKNOWN:
+            return True, "reclaimable space is unknown"
+        pending = to_bytes(pending or 0)
+
+        threshold = str(self.threshold).strip()
+        if threshold.endswith('%'):
+            try:
+                percentage = float(threshold[:-1])
+            except ValueError:
+                raise Error(
+                    "expected a percentage, such as 5%.",
+                    culprit="compact_threshold"
+                )
+            repo_size = read_latest(self.settings.date_file).get('repository size')
+            if not repo_size:
+                return True, "repository size is unknown"
+            limit = Quantity(to_bytes(repo_size) * percentage / 100, 'B')
+        else:
+            limit = to_bytes(threshold, 'compact_threshold')
+        if pending >= limit:
+            return True, f"reclaimable space of {pending} reaches threshold of {limit}"
+        return False, f"reclaimable space of {pending} is below threshold of {limit}"
+
+    # compact_if_due() {{{2
+    def compact_if_due(self, compact, options, performs=None):
+        """Runs the compact command if compaction is due.
+
+        compact is the compact command, it is run with the given options.  The
+        decision and its reason are narrated, and so are always logged.
+        Returns the exit status of the compaction, or 0 if it was deferred.
+
+        performs is passed the settings of each later configuration of
+        a composite configuration and returns True if it would also compact
+        the repository.  If one that shares the repository would, compaction
+        is left to it and is performed if due for either.
+        """
+        settings = self.settings
+        due, reason = self.decide()
+        if performs:
+            successor = settings.repository_successor(performs)
+            if successor:
+                narrate(
+                    f"Leaving compaction to {successor}, which shares the repository."
+                )
+                settings.defer('compact', successor, due=due, reason=reason)
+                return 0
+        if not due:
+            for each in settings.deferred('compact'):
+                if each.get('due'):
+                    due, reason = True, f"{each['reason']}, for {each['config']}"
+                    break
+        if due:
+            narrate(f"Compacting repository ({reason}) ...")
+            return compact.run("compact", [], settings, options)
+        narrate(f"Deferring compaction ({reason}).")
+        settings.deferred('compact', discard=True)
+        return 0
@@ -0,0 +1,141 @@
+# Contents
+#
+# Compares the contents of local files to those held in an archive without
+# mounting the archive.  The archived files are streamed from borg extract
+# --stdout and hashed while the local files are hashed in parallel.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from inform import Error, narrate, os_error, warn
+
+# Globals {{{1
+BLOCK_SIZE = 1 << 20            # bytes read at once from local files
+MAX_BATCH_FILES = 500           # files extracted by one borg process
+MAX_BATCH_BYTES = 1 << 30       # bytes extracted by one borg process
+MAX_BATCH_ARGS = 1 << 16        # length of the paths given to one borg process
+
+
+# new_hash() {{{1
+def new_hash():
+    return hashlib.blake2b(digest_size=32)
+
+
+# hash_local_file() {{{1
+def hash_local_file(path):
+    """Returns the digest of a local file, or None if it cannot be read."""
+    digest = new_hash()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                digest.update(block)
+    except OSError as e:
+        warn(os_error(e))
+        return None
+    return digest.digest()
+
+
+# hash_archived_files() {{{1
+def hash_archived_files(settings, archive, files, emborg_opts=()):
+    """Returns the digests of files held in an archive.
+
+    files is a list of (path, size) pairs in the order they occur in the
+    archive.  The files are extracted to standard output by a single borg
+    process, which writes them one after the other in archive order, so the
+    sizes are used to find where each file ends.  Returns a dictionary that
+    maps each path to its digest.
+    """
+    borg = settings.stream_borg(
+        cmd = "extract",
+        args = ["--stdout", settings.destination(archive)] + [f[0] for f in files],
+        emborg_opts = emborg_opts,
+        binary = True,
+    )
+    digests = {}
+    remaining = iter(files)
+    path, size = next(remaining, (None, 0))
+    digest = new_hash()
+    for block in borg:
+        while block:
+            if path is None:
+                raise Error("more output than expected.", culprit=(archive, "extract"))
+            used = block[:size]
+            digest.update(used)
+            size -= len(used)
+            block = block[len(used):]
+            if size == 0:
+                digests[path] = digest.digest()
+                path, size = next(remaining, (None, 0))
+                digest = new_hash()
+    # empty files at the end of the list produce no output
+    while path is not None and size == 0:
+        digests[path] = digest.digest()
+        path, size = next(remaining, (None, 0))
+        digest = new_hash()
+    if path is not None:
+        raise Error("less output than expected.", culprit=(archive, "extract"))
+    return digests
+
+
+# batch_files() {{{1
+def batch_files(files):
+    """Splits the files into batches that are each extracted by one process."""
+    batch = []
+    total_bytes = total_args = 0
+    for path, size in files:
+        if batch and (
+            len(batch) >= MAX_BATCH_FILES
+            or total_bytes + size > MAX_BATCH_BYTES
+            or total_args + len(path) + 1 > MAX_BATCH_ARGS
+        ):
+            yield batch
+            batch = []
+            total_bytes = total_args = 0
+        batch.append((path, size))
+        total_bytes += size
+        total_args += len(path) + 1
+    if batch:
+        yield batch
+
+
+# compare_contents() {{{1
+def compare_contents(settings, archive, files, local_path, jobs, emborg_opts=()):
+    """Compares the contents of local files to those in an archive.
+
+    files is a list of (path, size) pairs for archived files in archive order.
+    local_path converts a path to the path of the corresponding local file.
+    Up to jobs borg processes are run at once, along with as many threads that
+    hash the local files.  Returns the paths of the files whose contents differ.
+    """
+    batches = list(batch_files(files))
+    narrate(f"extracting {len(files)} files using {len(batches)} processes.")
+    with ThreadPoolExecutor(max_workers=jobs) as extractors, \
+         ThreadPoolExecutor(max_workers=jobs) as hashers:
+        local = hashers.map(hash_local_file, [local_path(f[0]) for f in files])
+        archived = extractors.map(
+            lambda batch: hash_archived_files(settings, archive, batch, emborg_opts),
+            batches
+        )
+        local = list(local)
+        archived = {p: d for digests in archived for p, d in digests.items()}
+    return [
+        path
+        for (path, size), digest in zip(files, local)
+        if digest is not None and digest != archived.get(path)
+    ]
@@ -18,8 +18,11 @@
 
 # Imports {{{1
 import errno
+import io
 import os
 import re
+import subprocess
+import threading
 import arrow
 from inform import (
     Color,
@@ -41,6 +44,7 @@ from inform import (
     join,
     log,
     narrate,
+    os_error,
     output,
     plural,
     render,
@@ -50,8 +54,11 @@ from .shlib import (
     Run, cd, cwd, getmod, mv, render_command, rm, to_path,
     set_prefs as set_shlib_prefs
 )
+from .cache import files_cache_suffix
+from .catalog import ArchiveCatalog
 from .collection import Collection, split_lines
 from .hooks import Hooks
+from .mounts import MountSessions
 from .patterns import (
     check_excludes,
     check_excludes_files,
@@ -79,11 +86,18 @@ from .preferences import (
     SETTINGS_FILE,
     convert_name_to_option,
 )
+from .progress import ProgressMonitor
 from .python import PythonFile
+from .snapshot import SourceSnapshot
 from .utilities import getfullhostname, gethostname, getusername
 
 # Globals {{{1
 borg_commands_with_dryrun = "create delete extract prune upgrade recreate".split()
+STREAM_BLOCK_SIZE = 1 << 20   # bytes read at once from binary borg streams
+INHERITED_ENVIRON = {   # files cache controls given by the user's environment
+    k: v for k, v in os.environ.items()
+    if k in ["BORG_FILES_CACHE_SUFFIX", "BORG_FILES_CACHE_TTL"]
+}
 set_shlib_prefs(use_inform=True, log_cmd=True, encoding=DEFAULT_ENCODING)
 
 # Utilities {{{1
@@ -107,10 +121,22 @@ for name, attrs in BORG_SETTINGS.items():
     if "arg" in attrs and attrs["arg"]:
         borg_options_arg_count[convert_name_to_option(name)] = 1
 
+# repository_key() {{{2
+def repository_key(repository):
+    # identifies a repository, local paths are made absolute
+    if not repository:
+        return None
+    repository = str(repository)
+    return repository if ":" in repository else str(to_path(repository))
+
 # ConfigQueue {{{1
 class ConfigQueue:
     def __init__(self, command=None):
         self.uninitialized = True
+        self.deferred = {}  # repository-wide steps left to later configs
+        self.peers = {}  # settings of the other configs, read as needed
+        self.may_skip = False  # later configs may skip the steps left to them
+        self.command = command.NAMES[0] if command else None
         if command:
             self.requires_exclusivity = command.REQUIRES_EXCLUSIVITY
             self.composite_config_response = command.COMPOSITE_CONFIGS
@@ -293,6 +319,7 @@ class Emborg:
             if queue.uninitialized:
                 queue.initialize(name, settings)
             config = queue.get_active_config()
+            self.queue = queue
             self.configs = queue.configs
             self.log_command = queue.log_command
             self.requires_exclusivity = queue.requires_exclusivity
@@ -673,17 +700,10 @@ class Emborg:
         self.settings[setting] = []  # erase the setting so it is not run again
         self.borg_ran = True  # indicate that before has run so after should run
 
-    # run_borg() {{{2
-    def run_borg(
-        self,
-        cmd,
-        args=(),
-        borg_opts=None,
-        emborg_opts=(),
-        strip_prefix=False,
-        show_borg_output=False,
-        use_working_dir=False,
-    ):
+    # prepare_borg() {{{2
+    def prepare_borg(self, cmd, args, borg_opts, emborg_opts, strip_prefix):
+        # unmount archives that are idle or that would block the command
+        MountSessions.before(self, cmd.split()[0])
 
         # run the run_before_borg commands
         self.run_user_commands('run_before_borg')
@@ -694,14 +714,26 @@ class Emborg:
             os.environ["BORG_DISPLAY_PASSPHRASE"] = "no"
         if self.ssh_command:
             os.environ["BORG_RSH"] = self.ssh_command
+        self.publish_files_cache(cmd, emborg_opts)
         environ = {k: v for k, v in os.environ.items() if k.startswith("BORG_")}
         if "BORG_PASSPHRASE" in environ:
             environ["BORG_PASSPHRASE"] = "<redacted>"
         executable = to_path(self.value("borg_executable", BORG))
         borg_opts = self.borg_options(cmd, borg_opts, emborg_opts, strip_prefix)
-        command = [executable] + cmd.split() + borg_opts + args
+        command = [executable] + cmd.split() + borg_opts + list(args)
         narrate("Borg-related environment variables:", render(environ))
 
+        # keep the cached list of archives consistent with the repository
+        if "--dry-run" in borg_opts:
+            revalidate_catalog = False
+        else:
+            revalidate_catalog = ArchiveCatalog(self).before(
+                cmd.split()[0], borg_opts + list(args)
+            )
+            if cmd.split()[0] in ["delete", "recreate"]:
+                # the latest archive may no longer hold the files as they are
+                SourceSnapshot(self).discard()
+
         # check if ssh agent is present
         if self.needs_ssh_agent:
             if "SSH_AUTH_SOCK" not in os.environ:
@@ -710,23 +742,79 @@ class Emborg:
                     "Is ssh-agent running?",
                 )
 
+        return command, borg_opts, revalidate_catalog
+
+    # publish_files_cache() {{{2
+    def publish_files_cache(self, cmd, emborg_opts):
+        # Borg keeps one files cache per repository, so configs that back up
+        # different trees to the same repository evict each other's entries
+        # and unchanged files are chunked again.  Each config that backs up to
+        # the repository after the first gets its own files cache, unless the
+        # user chose otherwise.  Only create uses the files cache.
+        suffix = INHERITED_ENVIRON.get("BORG_FILES_CACHE_SUFFIX")
+        ttl = INHERITED_ENVIRON.get("BORG_FILES_CACHE_TTL")
+        if cmd == "create":
+            if "files_cache_suffix" in self.settings:
+                suffix = self.value("files_cache_suffix")
+            elif suffix is None:
+                suffix = files_cache_suffix(self, "dry-run" not in emborg_opts)
+            if "files_cache_ttl" in self.settings:
+                ttl = self.value("files_cache_ttl")
+        for name, value in [
+            ("BORG_FILES_CACHE_SUFFIX", suffix),
+            ("BORG_FILES_CACHE_TTL", ttl),
+        ]:
+            if value:
+                os.environ[name] = str(value)
+            else:
+                os.environ.pop(name, None)
+
+    # unpublish_passcode() {{{2
+    def unpublish_passcode(self):
+        # remove passcode env variables created by emborg
+        if self.borg_passcode_env_var_set_by_emborg:
+            narrate(f"Unsetting {self.borg_passcode_env_var_set_by_emborg}.")
+            os.environ.pop(self.borg_passcode_env_var_set_by_emborg, None)
+
+    # run_borg() {{{2
+    def run_borg(
+        self,
+        cmd,
+        args=(),
+        borg_opts=None,
+        emborg_opts=(),
+        strip_prefix=False,
+        show_borg_output=False,
+        use_working_dir=False,
+        progress=None,
+    ):
+        if progress:
+            return self.monitor_borg(
+                cmd, args, borg_opts, emborg_opts, strip_prefix,
+                show_borg_output, use_working_dir, progress
+            )
+        command, borg_opts, revalidate_catalog = self.prepare_borg(
+            cmd, args, borg_opts, emborg_opts, strip_prefix
+        )
+
         # run the command
         with cd(self.working_dir if use_working_dir else "."):
             narrate("running in:", cwd())
-            if "--json" in command or "--json-lines" in command:
-                narrating = False
-            else:
-                narrating = (
-                    show_borg_output
-                    or "--verbose" in borg_opts
-                    or "--progress" in borg_opts
-                    or "--list" in borg_opts
-                    or "verbose" in emborg_opts
-                    or "narrate" in emborg_opts
-                )
+            narrating = (
+                show_borg_output
+                or "--verbose" in borg_opts
+                or "--progress" in borg_opts
+                or "--list" in borg_opts
+                or "verbose" in emborg_opts
+                or "narrate" in emborg_opts
+            )
             if narrating:
-                modes = "soeW1"
                 display("\nRunning Borg {} command ...".format(cmd))
+                if "--json" in command or "--json-lines" in command:
+                    # JSON output is captured, but messages are still shown
+                    modes = "sOeW1"
+                else:
+                    modes = "soeW1"
             else:
                 modes = "sOEW1"
             narrate(
@@ -741,14 +829,13 @@ class Emborg:
             except Error as e:
                 self.report_borg_error(e, cmd)
             finally:
-                # remove passcode env variables created by emborg
-                if self.borg_passcode_env_var_set_by_emborg:
-                    narrate(f"Unsetting {self.borg_passcode_env_var_set_by_emborg}.")
-                    del os.environ[self.borg_passcode_env_var_set_by_emborg]
+                self.unpublish_passcode()
             ends_at = arrow.now()
             log("ends at: {!s}".format(ends_at))
             log("elapsed: {!s}".format(ends_at - starts_at))
         narrate("Borg exit status:", borg.status)
+        if revalidate_catalog:
+            ArchiveCatalog(self).revalidate()
         if borg.status == 1 and borg.stderr:
             warnings = borg.stderr.partition(72*'-')[0]
             warn('warning emitted by Borg:', codicil=warnings)
@@ -761,6 +848,68 @@ class Emborg:
 
         return borg
 
+    # monitor_borg() {{{2
+    def monitor_borg(
+        self, cmd, args, borg_opts, emborg_opts, strip_prefix,
+        show_borg_output, use_working_dir, progress
+    ):
+        # run borg while following its progress, used by run_borg()
+        borg_opts = list(borg_opts or [])
+        narrating = (
+            show_borg_output
+            or "--verbose" in borg_opts
+            or "--list" in borg_opts
+            or "verbose" in emborg_opts
+            or "narrate" in emborg_opts
+        )
+        if narrating or "--progress" in borg_opts:
+            display("\nRunning Borg {} command ...".format(cmd))
+        listing = "--list" in borg_opts
+        if (
+            cmd == "create"
+            and self.files_cache_stats
+            and not listing
+            and "dry-run" not in emborg_opts
+        ):
+            # have borg report the status of each file, without showing it,
+            # so that the hits in the files cache can be counted
+            borg_opts.append("--list")
+        monitor = ProgressMonitor(
+            self, cmd,
+            callback = progress if callable(progress) else None,
+            show = "--progress" in borg_opts,
+            echo = narrating,
+            listing = listing,
+        )
+        borg = BorgStream(
+            self, cmd, args, borg_opts, emborg_opts, strip_prefix,
+            use_working_dir, progress=monitor
+        )
+        borg.stdout = "\n".join(borg)
+        return borg
+
+    # stream_borg() {{{2
+    def stream_borg(
+        self,
+        cmd,
+        args=(),
+        borg_opts=None,
+        emborg_opts=(),
+        strip_prefix=False,
+        use_working_dir=False,
+        binary=False,
+    ):
+        """Run borg and return its output line by line as it is produced.
+
+        Takes the same arguments as run_borg(), but returns a BorgStream.  Borg
+        is not run until the stream is iterated.  If binary is true, the output
+        is returned as blocks of bytes rather than as lines.
+        """
+        return BorgStream(
+            self, cmd, args, borg_opts, emborg_opts, strip_prefix,
+            use_working_dir, binary
+        )
+
     # run_borg_raw() {{{2
     def run_borg_raw(self, args):
 
@@ -780,6 +929,12 @@ class Emborg:
             + [a.replace('@repo', repository) for a in args]
         )
 
+        # the command is unknown, so assume it changes the archives unless it
+        # is known not to
+        catalog = ArchiveCatalog(self)
+        borg_cmd = next((a for a in args if not a.startswith('-')), '')
+        revalidate_catalog = catalog.before(borg_cmd, args)
+
         # run the command
         narrate(
             "running:\n{}".format(
@@ -797,6 +952,8 @@ class Emborg:
             ends_at = arrow.now()
             log("ends at: {!s}".format(ends_at))
             log("elapsed: {!s}".format(ends_at - starts_at))
+        if revalidate_catalog:
+            catalog.revalidate()
         if borg.status == 1:
             warn('warning emitted by Borg, see logfile for details.')
         if borg.stdout:
@@ -870,6 +1027,126 @@ class Emborg:
     def is_last_config(self):
         return self.config_name == self.configs[-1]
 
+    # peer() {{{2
+    def peer(self, config):
+        """Returns the settings of another configuration.
+
+        Only the settings files of the configuration are read, so the result
+        may be used to look up its settings, but not to run Borg.
+        """
+        queue = getattr(self, "queue", None)
+        if queue is not None and config in queue.peers:
+            return queue.peers[config]
+        peer = Emborg.__new__(Emborg)
+        peer.settings = dict()
+        peer.do_not_expand = ()
+        peer.emborg_opts = self.emborg_opts
+        peer.config_dir = self.config_dir
+        peer.config_name = config
+        settings = PythonFile(self.config_dir, SETTINGS_FILE).run()
+        settings["config_name"] = config
+        settings["cmd_name"] = self.cmd_name
+        peer.settings.update(settings)
+        includes = Collection(settings.get(INCLUDE_SETTING))
+        for include in [config] + list(includes.values()):
+            peer.read_config(_include_path=to_path(self.config_dir, include))
+        peer.check()
+        if queue is not None:
+            queue.peers[config] = peer
+        return peer
+
+    # all_configs() {{{2
+    def all_configs(self):
+        """Returns the names of all the configurations, but not the groups."""
+        configs = {}
+        for config in Collection(self.configurations):
+            group, _, members = config.partition("=")
+            for name in members.split(",") if members else [group]:
+                configs[name] = None
+        return list(configs)
+
+    # repository_successor() {{{2
+    def repository_successor(self, performs):
+        """Returns the next configuration that shares the repository.
+
+        Steps that act on the whole repository, such as compaction, need only
+        be performed once when a composite configuration has several members
+        that share a repository.  They are left to the last configuration that
+        uses the repository.
+
+        performs is a function that is passed the settings of a later
+        configuration and returns True if that configuration performs the step.
+        Returns the name of the first later configuration that uses the same
+        repository and performs the step, or None if there is none or if the
+        later configurations may skip the step, as when create is run with
+        --if-changed.
+        """
+        configs = self.configs or []
+        if self.config_name not in configs or self.queue.may_skip:
+            return None
+        repository = repository_key(self.repository)
+        for config in configs[configs.index(self.config_name)+1:]:
+            try:
+                peer = self.peer(config)
+                peers_repository = repository_key(peer.value("repository"))
+                if peers_repository == repository and performs(peer):
+                    return config
+            except Error as e:
+                narrate(e, culprit=config)
+        return None
+
+    # defer() {{{2
+    def defer(self, step, successor, **details):
+        """Leaves a repository-wide step to a later configuration.
+
+        The details are kept, along with the name and date file of this
+        configuration, until successor performs the step and collects them
+        using deferred().  Steps left to this configuration by earlier ones
+        are passed on to successor.
+        """
+        key = (step, str(self.repository))
+        entries = self.queue.deferred.setdefault(key, [])
+        for each in entries:
+            each['successor'] = successor
+        entries.append(dict(
+            details,
+            config = self.config_name,
+            date_file = self.date_file,
+            successor = successor,
+        ))
+
+    # deferred() {{{2
+    def deferred(self, step, discard=False):
+        """Returns the details of the step as left by earlier configurations.
+
+        Use discard once the step has been performed.
+        """
+        queue = getattr(self, "queue", None)
+        if queue is None:
+            return []
+        key = (step, str(self.repository))
+        if discard:
+            return queue.deferred.pop(key, [])
+        return queue.deferred.get(key, [])
+
+    # unperformed() {{{2
+    def unperformed(self):
+        """Returns the steps left to this configuration that it did not perform.
+
+        This occurs if the configuration failed, or skipped the step.
+        """
+        queue = getattr(self, "queue", None)
+        if queue is None:
+            return []
+        repository = str(self.repository)
+        return [
+            step
+            for (step, repo), entries in queue.deferred.items()
+            if repo == repository and any(
+                e['successor'] == self.config_name for e in entries
+            )
+        ]
+
     # get attribute {{{2
     def __getattr__(self, name):
         return self.settings.get(name)
@@ -886,6 +1163,7 @@ class Emborg:
             return self
 
         self.borg_passcode_env_var_set_by_emborg = None
+        self.borg_lock = threading.Lock()
 
         # resolve src directories
         self.src_dirs = self.as_paths("src_dirs", resolve=False)
@@ -993,3 +1271,142 @@ class Emborg:
         # run the run_after_borg commands
         if self.borg_ran:
             self.run_user_commands('run_after_borg')
+
+
+# BorgStream class {{{1
+class BorgStream:
+    """Borg Output Stream
+
+    Iterating over a BorgStream runs the Borg command and yields the lines it
+    writes to its standard output, without the trailing newline, as they are
+    produced, or blocks of bytes if binary is true.  Borg's standard error is
+    collected in the background.  If a ProgressMonitor is given, Borg is run
+    with --log-json and --progress and its standard error is passed to the
+    monitor as it arrives.  Once the iteration completes the exit status and
+    standard error are available as the status and stderr attributes.  If the
+    iteration is abandoned early Borg is killed.
+
+    Use Emborg.stream_borg() to create a BorgStream.
+    """
+    # constructor {{{2
+    def __init__(
+        self, settings, cmd, args, borg_opts, emborg_opts, strip_prefix,
+        use_working_dir, binary=False, progress=None
+    ):
+        self.settings = settings
+        self.cmd = cmd
+        self.args = args
+        self.borg_opts = borg_opts
+        self.emborg_opts = emborg_opts
+        self.strip_prefix = strip_prefix
+        self.use_working_dir = use_working_dir
+        self.binary = binary
+        self.progress = progress
+        self.status = None
+        self.stdout = None
+        self.stderr = None
+
+    # __iter__() {{{2
+    def __iter__(self):
+        settings = self.settings
+        cmd = self.cmd
+        working_dir = settings.working_dir if self.use_working_dir else cwd()
+        encoding = settings.encoding if settings.encoding else DEFAULT_ENCODING
+
+        # start borg; the passcode is only published in the environment until
+        # borg starts, hold the lock so streams may be started from threads
+        with settings.borg_lock:
+            command, borg_opts, revalidate_catalog = settings.prepare_borg(
+                cmd, self.args, self.borg_opts, self.emborg_opts,
+                self.strip_prefix
+            )
+            command = [str(c) for c in command]
+            if self.progress:
+                # insert the options just after the borg command
+                at = 1 + len(cmd.split())
+                command[at:at] = ["--log-json", "--progress"]
+            narrate("running in:", working_dir)
+            narrate(
+                "running:\n{}".format(
+                    indent(render_command(command, borg_options_arg_count))
+                )
+            )
+            starts_at = arrow.now()
+            log("starts at: {!s}".format(starts_at))
+            try:
+                process = subprocess.Popen(
+                    command,
+                    stdin = subprocess.DEVNULL,
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.PIPE,
+                    cwd = str(working_dir),
+                    env = os.environ,
+                )
+            except OSError as e:
+                raise Error(os_error(e), culprit=(cmd, settings.config_name))
+            finally:
+                settings.unpublish_passcode()
+
+        # collect stderr in the background so borg never blocks on it
+        stderr = []
+        if self.progress:
+            def collect():
+                lines = io.TextIOWrapper(
+                    process.stderr, encoding=encoding, errors='replace'
+                )
+                for line in lines:
+                    text = self.progress.update(line)
+                    if text:
+                        stderr.append(text.encode(encoding))
+        else:
+            def collect():
+                stderr.append(process.stderr.read())
+        collector = threading.Thread(target=collect, daemon=True)
+        collector.start()
+
+        # pass along stdout as it arrives
+        completed = False
+        try:
+            if self.binary:
+                read = process.stdout.read1
+                for block in iter(lambda: read(STREAM_BLOCK_SIZE), b''):
+                    yield block
+            else:
+                for line in io.TextIOWrapper(process.stdout, encoding=encoding):
+                    yield line.rstrip('\n')
+            completed = True
+        finally:
+            if not completed:
+                process.kill()
+            process.wait()
+            collector.join()
+            if self.progress:
+                self.progress.finish()
+            ends_at = arrow.now()
+            log("ends at: {!s}".format(ends_at))
+            log("elapsed: {!s}".format(ends_at - starts_at))
+        self.status = process.returncode
+        self.stderr = b''.join(stderr).decode(encoding, errors='replace')
+        narrate("Borg exit status:", self.status)
+        if self.stderr:
+            narrate("Borg stderr:")
+            narrate(indent(self.stderr))
+
+        # report errors
+        if self.status < 0 or self.status > 1:
+            try:
+                raise Error(
+                    msg = self.stderr.strip() or f"unexpected exit status ({self.status}).",
+                    status = self.status,
+                    stdout = None,
+                    stderr = self.stderr.rstrip() or None,
+                    cmd = render_command(command),
+                    template = "{msg}",
+                )
+            except Error as e:
+                settings.report_borg_error(e, cmd)
+        if revalidate_catalog:
+            ArchiveCatalog(settings).revalidate()
+        if self.status == 1 and self.stderr:
+            warnings = self.stderr.partition(72*'-')[0]
+            warn('warning emitted by Borg:', codicil=warnings)
@@ -0,0 +1,288 @@
+# Manifest Formatter
+#
+# Converts the entries listed by borg into lines of output.  The format is
+# compiled once into a list of specialized field getters so that rendering
+# each entry is as cheap as possible.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import re
+import sys
+from datetime import datetime, timezone
+from functools import lru_cache
+from operator import itemgetter
+from string import Formatter
+import arrow
+from arrow.formatter import DateTimeFormatter
+from inform import Error, full_stop, log
+from quantiphy import Quantity
+
+# Globals {{{1
+# fields computed by emborg from the borg timestamps and sizes
+TIMES = dict(MTime='mtime', CTime='ctime', ATime='atime')
+SIZES = dict(Size='size', CSize='csize', DSize='dsize', DCSize='dcsize')
+
+# suffixes added to the path based on the file type
+TYPES = {'d': '/', 'l': '@', 'p': '|', 'h': '', '-': ''}
+
+# number of lines written at once
+BLOCK_SIZE = 4096
+
+# format specifications that can be handled by the fast size renderer
+SIMPLE_SPEC = re.compile(r'([<>^]?)(\d*)(?:\.(\d+))?')
+
+date_formatter = DateTimeFormatter()
+
+
+# Timestamps {{{1
+# to_datetime() {{{2
+@lru_cache(maxsize=4096)
+def to_datetime(timestamp):
+    # equivalent to arrow.get(timestamp).datetime, but much faster
+    # fromisoformat() is not available before python 3.7
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except (AttributeError, TypeError, ValueError):
+        return arrow.get(timestamp).datetime
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+# render_time() {{{2
+@lru_cache(maxsize=4096)
+def render_time(timestamp, spec):
+    # equivalent to format(arrow.get(timestamp), spec)
+    dt = to_datetime(timestamp)
+    if spec:
+        return date_formatter.format(dt, spec)
+    return dt.isoformat()
+
+
+# Sizes {{{1
+# SizeRenderer class {{{2
+class SizeRenderer:
+    """Renders a byte count as Quantity(size, 'B') would for a given format.
+
+    Only handles the simple format specifications that consist of an optional
+    alignment, width and precision, in which case the Quantity preferences in
+    effect when the renderer is created are honored.  Any other specification
+    is passed on to Quantity.
+    """
+    def __init__(self, spec):
+        match = SIMPLE_SPEC.fullmatch(spec)
+        self.spec = spec
+        if not match or Quantity.get_pref('form') != 'si':
+            self.fast = False
+            return
+        self.fast = True
+        align, width, prec = match.groups()
+        self.align = (align or '>') + width
+        prec = Quantity.get_pref('prec') if prec is None else int(prec)
+        self.prec = 'full' if prec == 'full' else int(prec)
+        if self.prec == 'full' or Quantity.get_pref('map_sf'):
+            self.fast = False
+            return
+        self.spacer = Quantity.get_pref('spacer')
+        self.unity_units = self.spacer + Quantity.get_pref('unity_sf') + 'B'
+        output_sf = Quantity.get_pref('output_sf')
+        self.prefixes = {
+            e: p for e, p in zip(range(3, 25, 3), 'kMGTPEZY') if p in output_sf
+        }
+        self.strip_zeros = Quantity.get_pref('strip_zeros')
+        self.strip_radix = Quantity.get_pref('strip_radix')
+
+    def __call__(self, size):
+        if self.fast and isinstance(size, int) and 0 <= size:
+            text = self.render(size)
+            if text:
+                return format(text, self.align)
+        return format(Quantity(size, 'B'), self.spec)
+
+    def render(self, size):
+        mantissa, _, exp = f'{size:.{self.prec}e}'.partition('e')
+        exp = int(exp)
+        exp3 = exp - exp % 3
+        if exp3:
+            prefix = self.prefixes.get(exp3)
+            if not prefix:
+                return None
+            units = self.spacer + prefix + 'B'
+        else:
+            units = self.unity_units
+        digits = mantissa.replace('.', '')
+        shift = exp - exp3 + 1
+        whole, fraction = digits[:shift], digits[shift:]
+        whole += '0' * (shift - len(whole))
+        if self.strip_zeros:
+            fraction = fraction.rstrip('0')
+        if fraction:
+            return f'{whole}.{fraction}{units}'
+        if not exp3 and not self.strip_radix:
+            # Quantity keeps the radix only on unscaled values
+            return f'{whole}.{units}'
+        return whole + units
+
+
+# ManifestFormatter class {{{1
+class ManifestFormatter:
+    """Manifest Formatter
+
+    Renders manifest entries using a format string.  In addition to the fields
+    provided by borg, the format may use:
+
+        Type: a suffix that indicates the type of the file
+        extra: the target of a link
+        health: either 'healthy' or 'broken'
+        MTime, CTime, ATime: the timestamps as arrow objects
+        Size, CSize, DSize, DCSize: the sizes as quantities
+
+    template (str):
+        The format string.
+    healthy_color, broken_color (callable):
+        Used to colorize the lines of healthy and broken files.
+    """
+    # constructor {{{2
+    def __init__(self, template, healthy_color, broken_color):
+        self.template = template
+
+        # convert the template into a pattern with positional fields and the
+        # list of functions that get the value of each field from an entry
+        pattern = []
+        keys = []
+        self.getters = []
+        for literal, name, spec, conversion in Formatter().parse(template):
+            pattern.append(literal.replace('{', '{{').replace('}', '}}'))
+            if name is not None:
+                key, getter, spec = self.compile_field(name, spec, conversion)
+                pattern.append(f'{{{len(self.getters)}:{spec}}}')
+                keys.append(key)
+                self.getters.append(getter)
+        self.pattern = ''.join(pattern)
+
+        # fetch the fields together if all are taken directly from the entry
+        if len(keys) > 1 and all(keys):
+            self.get_values = itemgetter(*keys)
+        else:
+            self.get_values = self.get_each_value
+
+        # a colorizer wraps its argument, so find the prefix and suffix it adds
+        self.healthy_color = healthy_color('\0').split('\0')
+        self.broken_color = broken_color('\0').split('\0')
+        self.block = []
+        self.total_size = 0
+
+    # compile_field() {{{2
+    def compile_field(self, name, spec, conversion):
+        """Returns how to get the value of a field and its format spec.
+
+        Returns the key if the field is taken directly from the entry, the
+        function that gets the value from an entry, and the spec to use when
+        formatting the value.
+        """
+        if '{' in spec:
+            raise Error(
+                'nested replacement fields are not supported.',
+                codicil=self.template
+            )
+        base = re.match(r'[^.[]*', name).group()
+
+        if base != name or conversion:
+            # attributes, indices or conversions need the actual objects
+            formatter = Formatter()
+            get = self.get_object(base)
+
+            def get_field(entry):
+                value, _ = formatter.get_field(name, (), {base: get(entry)})
+                return formatter.convert_field(value, conversion)
+            return None, get_field, spec
+
+        if base in TIMES:
+            key = TIMES[base]
+            return None, lambda entry: render_time(entry[key], spec), ''
+        if base in SIZES:
+            key = SIZES[base]
+            render_size = SizeRenderer(spec)
+            return None, lambda entry: render_size(entry[key]), ''
+        if base in ('Type', 'extra', 'health'):
+            return None, self.get_object(base), spec
+        return base, itemgetter(base), spec
+
+    # get_each_value() {{{2
+    def get_each_value(self, entry):
+        return [get(entry) for get in self.getters]
+
+    # get_object() {{{2
+    @staticmethod
+    def get_object(name):
+        """Returns a function that gets the value of a field from an entry."""
+        if name in TIMES:
+            key = TIMES[name]
+            return lambda entry: arrow.get(entry[key])
+        if name in SIZES:
+            key = SIZES[name]
+            return lambda entry: Quantity(entry[key], 'B')
+        if name == 'Type':
+            return lambda entry: TYPES.get(entry['mode'][0], '')
+        if name == 'extra':
+            def extra(entry):
+                type = entry['mode'][0]
+                if type == 'l':
+                    return ' —> ' + entry['source']
+                if type == 'h':
+                    return ' links to ' + entry['source']
+                return ''
+            return extra
+        if name == 'health':
+            return lambda entry: 'healthy' if entry['healthy'] else 'broken'
+        return lambda entry: entry[name]
+
+    # render() {{{2
+    def render(self, entry):
+        """Returns the line that corresponds to an entry."""
+        if entry['mode'][0] not in TYPES:
+            log('UNKNOWN TYPE:', entry['mode'][0], entry['path'])
+        if 'size' in entry:
+            self.total_size += entry['size']
+        try:
+            line = self.pattern.format(*self.get_values(entry))
+        except ValueError as e:
+            raise Error(
+                full_stop(e),
+                'Likely due to a bad format specification in manifest_formats:',
+                codicil=self.template
+            )
+        except KeyError as e:
+            raise Error('Unknown key in:', culprit=e, codicil=self.template)
+        prefix, suffix = self.healthy_color if entry['healthy'] else self.broken_color
+        return prefix + line + suffix
+
+    # write() {{{2
+    def write(self, entry):
+        """Renders an entry and queues it for output."""
+        block = self.block
+        block.append(self.render(entry))
+        if len(block) >= BLOCK_SIZE:
+            self.flush()
+
+    # flush() {{{2
+    def flush(self):
+        if self.block:
+            self.block.append('')
+            sys.stdout.write('\n'.join(self.block))
+            self.block = []
@@ -38,9 +38,10 @@ class Hooks:
             if c.is_active():
                 self.active_hooks.append(c)
 
-    def report_results(self, borg):
+    def report_results(self, borg, summary=None):
         for hook in self.active_hooks:
             hook.borg = borg
+            hook.summary = summary
 
     def __enter__(self):
         for hook in self.active_hooks:
@@ -91,6 +92,7 @@ class HealthChecks(Hooks):
         if not self.url:
             self.url = self.URL
         self.borg = None
+        self.summary = None
 
     def signal_start(self):
         url = f'{self.url}/{self.uuid}/start'
@@ -117,7 +119,9 @@ class HealthChecks(Hooks):
             result = 'success'
             if self.borg:
                 status = self.borg.status
-                payload = self.borg.stderr
+                payload = '\n'.join(
+                    p for p in [self.summary, self.borg.stderr] if p
+                )
             else:
                 status = 0
                 payload = ''
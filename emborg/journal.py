@@ -0,0 +1,331 @@
+# Change Journal
+#
+# Watches the files that would be backed up using inotify and keeps a journal
+# of the directories in which changes occur, so that create --if-changed need
+# not scan the files to learn whether a backup is needed.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import time
+import arrow
+from inform import Error, display, log, narrate, os_error, warn
+from .preferences import JOURNAL_FILE
+from .shlib import rm
+from .snapshot import SourceSnapshot
+from .walker import Walker
+
+# Globals {{{1
+FLUSH_INTERVAL = 5      # seconds between writes of the journal
+MAX_DIRTY = 1000        # directories held in the journal
+
+
+# selection() {{{1
+def selection(settings):
+    """Returns a digest of the settings that select the files to back up."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in [
+        "src_dirs", "patterns", "excludes", "exclude_if_present",
+        "exclude_caches", "one_file_system", "working_dir",
+    ]:
+        digest.update(repr((name, settings.values(name))).encode())
+    for name in ["patterns_from", "exclude_from"]:
+        for path in settings.as_paths(name):
+            try:
+                digest.update(path.read_bytes())
+            except OSError:
+                digest.update(str(path).encode())
+    return digest.hexdigest()
+
+
+# collapse() {{{1
+def collapse(paths):
+    """Drops the paths that are contained within another path."""
+    subtrees = []
+    for path in sorted(paths):
+        if subtrees and (
+            subtrees[-1] == "." or path.startswith(subtrees[-1] + "/")
+        ):
+            continue
+        subtrees.append(path)
+    return subtrees
+
+
+# ChangeJournal class {{{1
+class ChangeJournal:
+    """Change Journal
+
+    The journal is written by a watcher, started using 'emborg watch', and
+    records each directory in which a file that would be backed up is added,
+    removed or modified, along with when it last changed.  The watcher holds a
+    lock on the journal while it runs, the journal is only trusted while the
+    lock is held.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = settings.data_dir / settings.resolve(
+            'JOURNAL_FILE', JOURNAL_FILE
+        )
+        self.lock_path = self.path.with_suffix('.lock')
+
+    # load() {{{2
+    def load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            warn("ignoring journal.", culprit=self.path, codicil=str(e))
+            return None
+
+    # save() {{{2
+    def save(self, journal):
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(journal))
+            tmp.replace(self.path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+
+    # is_watched() {{{2
+    def is_watched(self):
+        """Indicates whether a watcher is running."""
+        try:
+            with open(self.lock_path, 'a') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return True
+                fcntl.flock(f, fcntl.LOCK_UN)
+        except OSError:
+            pass
+        return False
+
+    # changes_since() {{{2
+    def changes_since(self, when):
+        """Returns the directories that have changed since the given time.
+
+        Returns None if the journal cannot be trusted, which occurs if the
+        watcher is not running, was started after the given time, has lost
+        events since then, or was started with different settings.
+        """
+        if not when or not self.is_watched():
+            return None
+        journal = self.load()
+        if not journal:
+            return None
+        when = arrow.get(when).timestamp()
+        if journal.get('selection') != selection(self.settings):
+            narrate("journal is stale, settings have changed.")
+            return None
+        if journal['started'] > when:
+            narrate("journal started after last backup.")
+            return None
+        if journal['overflowed'] and journal['overflowed'] >= when:
+            narrate("journal lost changes since last backup.")
+            return None
+        return collapse(
+            path for path, changed in journal['dirty'].items()
+            if changed >= when
+        )
+
+    # is_unchanged() {{{2
+    def is_unchanged(self, snapshot):
+        """Indicates whether the files are as they were at the last backup.
+
+        Consults the journal if it can be trusted, otherwise the files are
+        scanned.  snapshot (SourceSnapshot) holds the state of the files at
+        the last backup.
+        """
+        previous = snapshot.load()
+        if previous and previous.get('repository') == str(self.settings.repository):
+            started = arrow.now()
+            changes = self.changes_since(previous.get('started'))
+            if changes is not None:
+                snapshot.started = started
+                if changes:
+                    narrate("files changed in:", *changes, sep="\n    ")
+                    log("files changed in:", *changes, sep="\n    ")
+                return not changes
+        return snapshot.is_unchanged()
+
+
+# Watcher class {{{1
+class Watcher:
+    """Watcher
+
+    Watches the directories that would be backed up and records those in
+    which changes occur in the journal.  Runs until interrupted.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        try:
+            import inotify_simple
+        except ImportError:
+            raise Error(
+                "inotify_simple is not available",
+                "it must be installed to watch for changes.",
+                sep=", ",
+                codicil="Install it using: pip install emborg[watch]",
+            )
+        self.settings = settings
+        self.flags = inotify_simple.flags
+        self.inotify = inotify_simple.INotify()
+        self.journal = ChangeJournal(settings)
+        settings.resolve_patterns([])
+        self.walker = Walker(settings)
+        self.snapshot = SourceSnapshot(settings)
+        self.watches = {}
+        self.dirty = {}
+        self.overflowed = None
+        self.last_backup = None
+        self.last_checked = None
+        self.modified = False
+        self.urgent = False
+
+    # add_tree() {{{2
+    def add_tree(self, path):
+        """Watches a directory and the directories it contains."""
+        f = self.flags
+        mask = (
+            f.CREATE | f.DELETE | f.MODIFY | f.ATTRIB | f.MOVED_FROM
+            | f.MOVED_TO | f.DONT_FOLLOW | f.ONLYDIR
+        )
+        for directory, st in self.walker.walk([path], only_directories=True):
+            try:
+                wd = self.inotify.add_watch(
+                    self.walker.local_path(directory), mask
+                )
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise Error(
+                        "too many directories to watch.",
+                        codicil = "Increase fs.inotify.max_user_watches.",
+                    )
+                if e.errno != errno.ENOENT:
+                    warn(os_error(e))
+                continue
+            self.watches[wd] = directory
+
+    # refresh() {{{2
+    def refresh(self):
+        # learn when the last backup started, changes before then are forgotten
+        try:
+            checked = self.snapshot.path.stat().st_mtime_ns
+        except OSError:
+            checked = None
+        if checked == self.last_checked:
+            return
+        self.last_checked = checked
+        started = (self.snapshot.load() or {}).get('started')
+        self.last_backup = arrow.get(started).timestamp() if started else None
+        if self.last_backup:
+            self.dirty = {
+                p: t for p, t in self.dirty.items() if t >= self.last_backup
+            }
+        self.modified = True
+
+    # mark() {{{2
+    def mark(self, directory, now):
+        # the journal is written at once if a directory becomes dirty so that
+        # create never misses it, later changes are written periodically
+        changed = self.dirty.get(directory)
+        if changed is None or (self.last_backup and changed < self.last_backup):
+            self.urgent = True
+        self.dirty[directory] = now
+        self.modified = True
+        if len(self.dirty) > MAX_DIRTY:
+            self.overflowed = now
+            self.dirty = {}
+
+    # handle() {{{2
+    def handle(self, event, now):
+        f = self.flags
+        if event.mask & f.Q_OVERFLOW:
+            self.overflowed = now
+            self.modified = self.urgent = True
+            return
+        directory = self.watches.get(event.wd)
+        if directory is None:
+            return
+        if event.mask & f.IGNORED:
+            del self.watches[event.wd]
+            return
+        path = os.path.join(directory, event.name) if directory != "." else event.name
+        if event.mask & f.ISDIR:
+            if event.mask & (f.CREATE | f.MOVED_TO):
+                self.add_tree(path)
+            self.mark(directory, now)
+        elif self.walker.matcher.match(path) in (None, "+"):
+            self.mark(directory, now)
+
+    # flush() {{{2
+    def flush(self, started):
+        self.journal.save(dict(
+            pid = os.getpid(),
+            selection = selection(self.settings),
+            started = started,
+            overflowed = self.overflowed,
+            dirty = self.dirty,
+        ))
+        self.modified = self.urgent = False
+
+    # run() {{{2
+    def run(self):
+        journal = self.journal
+        with open(journal.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise Error("already being watched.", culprit=journal.lock_path)
+            try:
+                for root in self.settings.roots:
+                    self.add_tree(root)
+                started = time.time()
+                self.refresh()
+                self.flush(started)
+                display(f"watching {len(self.watches)} directories.")
+
+                flushed = started
+                while True:
+                    events = self.inotify.read(timeout=FLUSH_INTERVAL * 1000)
+                    now = time.time()
+                    self.refresh()
+                    for event in events:
+                        self.handle(event, now)
+                    if self.urgent or (
+                        self.modified and now - flushed >= FLUSH_INTERVAL
+                    ):
+                        self.flush(started)
+                        flushed = now
+            finally:
+                rm(journal.path)
+                self.inotify.close()
+                fcntl.flock(lock, fcntl.LOCK_UN)
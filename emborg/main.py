@@ -126,6 +126,13 @@ def main():
                         settings.fail(e, cmd=' '.join(sys.argv))
                         e.report()
 
+                    # perform any steps left to this config that it did not
+                    deferred_status = cmd.execute_deferred(
+                        cmd_name, settings, emborg_opts
+                    )
+                    if deferred_status > (exit_status or 0):
+                        exit_status = deferred_status
+
                 if exit_status and exit_status > worst_exit_status:
                     worst_exit_status = exit_status
                     inform.errors_accrued(reset=True)
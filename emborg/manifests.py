@@ -0,0 +1,347 @@
+# Manifest Cache
+#
+# Keeps local copies of the file listings of archives.  Archives never change
+# once written, so a listing can be reused until the archive is deleted.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import zlib
+from array import array
+from itertools import chain
+from string import Formatter
+from inform import Error, log, narrate, os_error, warn
+from quantiphy import Quantity, QuantiPhyError
+from .shlib import mkdir, rm, to_path
+
+# Globals {{{1
+MANIFESTS_DIR = "manifests"
+MAGIC = b"emborg manifest 1\n"
+SUFFIX = ".manifest"
+CHUNK_SIZE = 1 << 18
+
+# fields held in the cache and the kind of each column
+COLUMNS = dict(
+    path = "str",
+    type = "str",
+    mode = "str",
+    user = "str",
+    group = "str",
+    uid = "int",
+    gid = "int",
+    healthy = "bool",
+    source = "str",
+    size = "int",
+    mtime = "str",
+    ctime = "str",
+    atime = "str",
+)
+CACHED_FIELDS = set(COLUMNS)
+
+# fields borg always includes in its JSON output, the rest only when asked for
+BASIC_FIELDS = set("path type mode user group uid gid healthy source".split())
+
+# the format given to borg when filling the cache
+CACHE_FORMAT = "".join("{" + f + "}" for f in COLUMNS)
+
+# typecodes used for the numeric columns, always held in little-endian order
+TYPECODES = dict(int="q", bool="B")
+
+
+# format_fields() {{{1
+def format_fields(template):
+    """Returns the names of the fields used in a borg format string."""
+    return set(
+        name.partition('.')[0].partition('[')[0]
+        for _, name, _, _ in Formatter().parse(template)
+        if name
+    )
+
+
+# Column writer {{{1
+class ColumnWriter:
+    """Accumulates one column, compressing it into a temporary file."""
+
+    def __init__(self, directory, kind):
+        self.kind = kind
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.compressor = zlib.compressobj(6)
+        self.length = 0
+        if kind == "str":
+            self.buffer = bytearray()
+        else:
+            self.buffer = array(TYPECODES[kind])
+
+    def add(self, value):
+        if self.kind == "str":
+            if not isinstance(value, str):
+                raise TypeError(value)
+            self.buffer += value.encode('utf-8', 'surrogateescape') + b"\0"
+            if len(self.buffer) > CHUNK_SIZE:
+                self.flush()
+        else:
+            if isinstance(value, bool) != (self.kind == "bool"):
+                raise TypeError(value)
+            self.buffer.append(value)
+            if len(self.buffer) > CHUNK_SIZE // 8:
+                self.flush()
+
+    def flush(self, final=False):
+        buffer = self.buffer
+        if self.kind != "str" and sys.byteorder == "big":
+            buffer.byteswap()
+        data = self.compressor.compress(bytes(buffer))
+        if final:
+            data += self.compressor.flush()
+        self.file.write(data)
+        self.length += len(data)
+        del self.buffer[:]
+
+    def copy(self, dest):
+        self.file.seek(0)
+        while True:
+            data = self.file.read(CHUNK_SIZE)
+            if not data:
+                break
+            dest.write(data)
+        self.file.close()
+
+
+# decompress() {{{1
+def decompress(f, length):
+    """Generates the decompressed data in blocks of limited size."""
+    decompressor = zlib.decompressobj()
+    compressed = b""
+    while length > 0 or compressed:
+        if not compressed:
+            compressed = f.read(min(length, CHUNK_SIZE))
+            if not compressed:
+                raise EOFError
+            length -= len(compressed)
+        # limit the size of each block, columns can be very compressible
+        yield decompressor.decompress(compressed, CHUNK_SIZE)
+        compressed = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+# read_column() {{{1
+def read_column(path, offset, length, kind):
+    """Generates the values held in one column of a cached manifest.
+
+    The values are produced in lists, one list per block.
+    """
+    remainder = b""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for data in decompress(f, length):
+            data = remainder + data
+            if kind == "str":
+                values = data.decode('utf-8', 'surrogateescape').split("\0")
+                remainder = values.pop().encode('utf-8', 'surrogateescape')
+                yield values
+            else:
+                values = array(TYPECODES[kind])
+                usable = len(data) - len(data) % values.itemsize
+                values.frombytes(data[:usable])
+                remainder = data[usable:]
+                if sys.byteorder == "big":
+                    values.byteswap()
+                if kind == "bool":
+                    yield [bool(v) for v in values]
+                else:
+                    yield values.tolist()
+
+
+# ManifestCache class {{{1
+class ManifestCache:
+    """Manifest Cache
+
+    Holds the listings of archives in the data directory, one file per archive.
+    Each file contains a short JSON header followed by the listing stored by
+    column, each column being compressed separately.  That way only the columns
+    needed are decompressed when a listing is read.
+
+    Listings are identified by the repository and the archive id, so an
+    archive that is deleted and then recreated with the same name is not
+    confused with the original.  The least recently used listings are dropped
+    once the cache grows beyond manifest_cache_size.  The cache is not used if
+    manifest_cache_size is not given.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.root = to_path(settings.data_dir, MANIFESTS_DIR)
+        repository = str(settings.repository)
+        key = hashlib.sha1(repository.encode('utf-8')).hexdigest()[:16]
+        self.dir = self.root / key
+        self.limit = self.size_limit()
+
+    # size_limit() {{{2
+    def size_limit(self):
+        size = self.settings.value('manifest_cache_size')
+        if size in ('', None):
+            return 0
+        try:
+            return float(Quantity(size, 'B', ignore_sf=False, binary=True))
+        except QuantiPhyError as e:
+            raise Error(e, culprit='manifest_cache_size')
+
+    # enabled {{{2
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    # usable() {{{2
+    def usable(self, fields):
+        """Indicates whether the cache can supply the given fields."""
+        return self.enabled and fields <= CACHED_FIELDS
+
+    # path() {{{2
+    def path(self, archive_id):
+        return self.dir / (archive_id + SUFFIX)
+
+    # read() {{{2
+    def read(self, archive_id, fields=()):
+        """Returns the entries of a cached archive, or None if not cached.
+
+        Each entry is a dictionary that contains the basic fields that borg
+        always provides plus any of the requested fields.
+        """
+        path = self.path(archive_id)
+        try:
+            with open(path, 'rb') as f:
+                if f.readline() != MAGIC:
+                    raise ValueError("not a manifest.")
+                header = json.loads(f.readline())
+                offset = f.tell()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            warn("ignoring cached manifest.", culprit=path, codicil=str(e))
+            rm(path)
+            return None
+
+        # locate the required columns
+        wanted = [f for f in COLUMNS if f in BASIC_FIELDS or f in fields]
+        columns = []
+        for name, (kind, length) in header["columns"].items():
+            if name in wanted:
+                columns.append((name, offset, length, kind))
+            offset += length
+        if len(columns) != len(wanted):
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError as e:
+            log(os_error(e))
+
+        narrate(f"using cached manifest of {header['archive']}.")
+        return self._entries(path, columns)
+
+    def _entries(self, path, columns):
+        names = [c[0] for c in columns]
+        readers = [
+            chain.from_iterable(read_column(path, *c[1:])) for c in columns
+        ]
+        for values in zip(*readers):
+            yield dict(zip(names, values))
+
+    # fill() {{{2
+    def fill(self, archive_id, archive, entries):
+        """Pass entries through while saving them to the cache.
+
+        The listing is only saved if all of the entries are consumed and each
+        has the expected fields.
+        """
+        try:
+            mkdir(self.dir)
+            self.dir.chmod(0o700)
+            writers = {k: ColumnWriter(self.dir, v) for k, v in COLUMNS.items()}
+        except OSError as e:
+            warn(os_error(e))
+            yield from entries
+            return
+        count = 0
+        for entry in entries:
+            if writers:
+                try:
+                    for name, writer in writers.items():
+                        writer.add(entry[name])
+                    count += 1
+                except (KeyError, TypeError, OverflowError):
+                    log("manifest not cached, unexpected entry:", entry)
+                    writers = None
+            yield entry
+        if writers:
+            self.write(archive_id, archive, count, writers)
+
+    # write() {{{2
+    def write(self, archive_id, archive, count, writers):
+        path = self.path(archive_id)
+        tmp = path.with_suffix('.tmp')
+        try:
+            # lengths of the compressed columns are only known after flushing
+            for writer in writers.values():
+                writer.flush(final=True)
+            header = dict(
+                archive = archive,
+                id = archive_id,
+                repository = str(self.settings.repository),
+                entries = count,
+                columns = {k: (w.kind, w.length) for k, w in writers.items()},
+            )
+            with open(tmp, 'wb') as f:
+                f.write(MAGIC)
+                f.write(json.dumps(header).encode('utf-8') + b"\n")
+                for writer in writers.values():
+                    writer.copy(f)
+            tmp.replace(path)
+            narrate(f"cached manifest of {archive}.")
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+            return
+        self.trim()
+
+    # trim() {{{2
+    def trim(self):
+        """Discard least recently used listings until cache fits its limit."""
+        try:
+            listings = []
+            for path in self.root.glob("*/*" + SUFFIX):
+                stat = path.stat()
+                listings.append((stat.st_mtime, stat.st_size, path))
+        except OSError as e:
+            log(os_error(e))
+            return
+        total = sum(l[1] for l in listings)
+        for mtime, size, path in sorted(listings):
+            if total <= self.limit:
+                break
+            narrate("discarding cached manifest:", path.stem)
+            rm(path)
+            total -= size
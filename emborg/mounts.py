@@ -0,0 +1,223 @@
+# Mount Sessions
+#
+# Keeps mounted archives alive between invocations of emborg so that they can
+# be reused, which avoids loading the archive metadata again for each mount.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import json
+import os
+import arrow
+from inform import Error, narrate, os_error, warn
+from .cache import repository_id
+from .catalog import READ_ONLY_COMMANDS
+from .preferences import MOUNTS_FILE
+from .shlib import mkdir, rm, to_path
+from .utilities import to_seconds
+
+
+# MountSessions class {{{1
+class MountSessions:
+    """Mount Sessions
+
+    Tracks the archives that are left mounted by the compare and mount
+    commands.  A session is recorded for each mount point, along with the
+    archive mounted there, or an empty string if the whole repository is
+    mounted, when it was last used, and how long it may then be left idle.
+    Sessions are only kept if mount_idle_timeout is given.
+
+    The sessions are kept in a file named after the repository, so that they
+    are shared by all the configurations that use it.  Sessions that have been
+    idle too long are unmounted the next time Borg is run for any of these
+    configurations.  All sessions are unmounted before running a Borg command
+    that writes to the repository, as a mounted repository is locked.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = settings.data_dir / MOUNTS_FILE.format(
+            repository_id = repository_id(settings.repository)
+        )
+        timeout = settings.value('mount_idle_timeout')
+        if timeout in ('', None):
+            self.timeout = None
+        else:
+            self.timeout = to_seconds(timeout, culprit='mount_idle_timeout')
+
+    # enabled {{{2
+    @property
+    def enabled(self):
+        return self.timeout is not None
+
+    # load() {{{2
+    def load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            warn("ignoring mount sessions.", culprit=self.path, codicil=str(e))
+            return {}
+
+    # save() {{{2
+    def save(self, sessions):
+        if not sessions:
+            rm(self.path)
+            return
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(sessions))
+            tmp.replace(self.path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+
+    # key() {{{2
+    @staticmethod
+    def key(mount_point):
+        return os.path.abspath(str(mount_point))
+
+    # find() {{{2
+    def find(self, mount_point, archive):
+        """Returns the directory that holds archive if it is already mounted.
+
+        Returns None if mount_point does not hold a live session that contains
+        the archive.
+        """
+        key = self.key(mount_point)
+        session = self.load().get(key)
+        if not session or not os.path.ismount(key):
+            return None
+        if session['archive'] == archive:
+            return to_path(key)
+        if archive and session['archive'] == '':
+            # the whole repository is mounted, it holds each archive
+            directory = to_path(key, archive)
+            if directory.is_dir():
+                return directory
+        return None
+
+    # open() {{{2
+    def open(self, mount_point, archive, emborg_opts=(), strip_prefix=False):
+        """Mounts an archive, or reuses an existing mount of the archive.
+
+        archive is None to mount the whole repository.  Returns the directory
+        that holds the contents of the archive.
+        """
+        archive = archive or ''
+        directory = self.find(mount_point, archive)
+        if directory:
+            narrate(f"reusing mounted archive at {mount_point!s}.")
+            self.touch(mount_point)
+            return directory
+
+        # something else may be mounted there
+        key = self.key(mount_point)
+        if os.path.ismount(key):
+            self.close(mount_point, emborg_opts)
+        try:
+            mkdir(mount_point)
+        except OSError as e:
+            raise Error(os_error(e))
+        self.settings.run_borg(
+            cmd = "mount",
+            args = [self.settings.destination(archive or None), mount_point],
+            emborg_opts = emborg_opts,
+            strip_prefix = strip_prefix,
+        )
+        sessions = self.load()
+        sessions[key] = dict(
+            archive = archive,
+            last_used = str(arrow.now()),
+            timeout = self.timeout,
+        )
+        self.save(sessions)
+        return to_path(key)
+
+    # touch() {{{2
+    def touch(self, mount_point):
+        """Records that a session was just used."""
+        key = self.key(mount_point)
+        sessions = self.load()
+        if key in sessions:
+            sessions[key]['last_used'] = str(arrow.now())
+            self.save(sessions)
+
+    # forget() {{{2
+    def forget(self, mount_point):
+        """Discards a session, used once the mount point is unmounted."""
+        key = self.key(mount_point)
+        sessions = self.load()
+        if sessions.pop(key, None):
+            self.save(sessions)
+
+    # close() {{{2
+    def close(self, mount_point, emborg_opts=()):
+        """Unmounts a mount point and discards its session."""
+        narrate(f"unmounting {mount_point!s}.")
+        self.settings.run_borg(
+            cmd="umount", args=[mount_point], emborg_opts=emborg_opts,
+        )
+        try:
+            to_path(mount_point).rmdir()
+        except OSError as e:
+            warn(os_error(e))
+        self.forget(mount_point)
+
+    # before() {{{2
+    @classmethod
+    def before(cls, settings, cmd):
+        """Reap sessions before running a borg command.
+
+        The sessions left by every configuration that uses the repository are
+        reaped, as any of them may hold the lock on the repository.
+        """
+        if cmd in ("mount", "umount") or not settings.repository:
+            return
+        sessions = cls(settings)
+        if sessions.path.exists():
+            sessions.reap(cmd)
+
+    # reap() {{{2
+    def reap(self, cmd):
+        """Reap sessions before running a borg command.
+
+        Sessions whose mount point is no longer mounted are discarded, and
+        sessions that are idle or that would block the command are unmounted.
+        """
+        sessions = self.load()
+        now = arrow.now()
+        for key, session in list(sessions.items()):
+            if not os.path.ismount(key):
+                narrate(f"discarding stale mount session: {key}.")
+                self.forget(key)
+                continue
+            try:
+                idle = (now - arrow.get(session['last_used'])).total_seconds()
+                timeout = session['timeout'] or 0
+            except (KeyError, TypeError, arrow.parser.ParserError):
+                idle = None
+            if cmd in READ_ONLY_COMMANDS and idle is not None and idle < timeout:
+                continue
+            try:
+                self.close(key)
+            except Error as e:
+                warn("could not unmount.", culprit=key, codicil=str(e))
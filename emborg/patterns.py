@@ -17,6 +17,9 @@
 # along with this program.  If not, see http://www.gnu.org/licenses.
 
 # Imports {{{1
+import fnmatch
+import posixpath
+import re
 from os.path import expanduser as expand_user
 from inform import Error, error
 from .shlib import to_path
@@ -188,3 +191,141 @@ def check_excludes_files(filenames, roots):
     for filename in filenames:
         excludes = to_path(filename).read_text().splitlines()
         check_excludes(excludes, roots, filename, expand_tilde=False)
+
+
+# Pattern matching {{{1
+# translate_shell_pattern() {{{2
+def translate_shell_pattern(pattern):
+    # converts a borg shell style pattern to a regular expression
+    # ** followed by / matches zero or more directories, * and ? do not match /
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if pattern[i:i+2] == "*/":
+                regex.append(r"(?:[^/]*/)*")
+                i += 2
+            else:
+                regex.append(r"[^/]*")
+        elif c == "?":
+            regex.append(r"[^/]")
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                regex.append(r"\[")
+            else:
+                chars = pattern[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if chars[0] == "!":
+                    chars = "^" + chars[1:]
+                elif chars[0] == "^":
+                    chars = "\\" + chars
+                regex.append(f"[{chars}]")
+        else:
+            regex.append(re.escape(c))
+    return "(?ms)" + "".join(regex) + r"\Z"
+
+
+# compile_pattern() {{{2
+def compile_pattern(pattern, default_style):
+    """Returns a function that indicates whether a path matches a pattern.
+
+    Paths are given as they are stored in an archive, without a leading slash.
+    The styles are those supported by borg: fm, sh, re, pp and pf.
+    """
+    style, colon, path = pattern.partition(":")
+    if not colon or len(style) != 2:
+        style, path = default_style, pattern
+    if style not in known_styles:
+        raise Error("unknown pattern style.", culprit=pattern)
+
+    if style == "re":
+        try:
+            return re.compile(path).search
+        except re.error as e:
+            raise Error(e, culprit=pattern)
+    if style == "pf":
+        path = posixpath.normpath(path).lstrip("/")
+        return lambda p: p == path
+    if style == "pp":
+        prefix = posixpath.normpath(path).rstrip("/").lstrip("/") + "/"
+        return lambda p: (p + "/").startswith(prefix)
+
+    # fm and sh patterns match the given path and anything below it
+    wildcard = "*" if style == "fm" else "**/*"
+    if path.endswith("/"):
+        path = posixpath.normpath(path).rstrip("/") + "/" + wildcard + "/"
+    else:
+        path = posixpath.normpath(path) + "/" + wildcard
+    path = path.lstrip("/")
+    if style == "fm":
+        regex = re.compile(fnmatch.translate(path))
+    else:
+        regex = re.compile(translate_shell_pattern(path))
+    return lambda p: regex.match(p + "/") is not None
+
+
+# PatternMatcher class {{{2
+class PatternMatcher:
+    """Pattern Matcher
+
+    Determines whether borg would include a path in an archive given the
+    patterns and excludes of a configuration.  As with borg, the first pattern
+    that matches a path decides its fate.  Paths that match no pattern are
+    included.
+    """
+    def __init__(self):
+        self.patterns = []
+
+    # add_patterns() {{{3
+    def add_patterns(self, patterns, expand_tilde=True):
+        """Add patterns in the form given to borg --pattern."""
+        default_style = "sh"
+        for pattern in patterns:
+            pattern = str(pattern).strip()
+            if not pattern or pattern[0] == "#":
+                continue
+            kind, arg = pattern[0], pattern[1:].strip()
+            if kind == "R":
+                continue
+            if kind == "P":
+                default_style = arg
+                continue
+            if kind not in "+-!":
+                raise Error("unknown pattern type.", culprit=pattern)
+            if expand_tilde and arg[:1] == "~":
+                arg = expand_user(arg)
+            self.patterns.append((kind, compile_pattern(arg, default_style)))
+
+    # add_excludes() {{{3
+    def add_excludes(self, excludes, expand_tilde=True):
+        """Add patterns in the form given to borg --exclude."""
+        for pattern in excludes:
+            pattern = str(pattern).strip()
+            if not pattern or pattern[0] == "#":
+                continue
+            if expand_tilde and pattern[:1] == "~":
+                pattern = expand_user(pattern)
+            # borg does not descend into directories that are excluded
+            self.patterns.append(("!", compile_pattern(pattern, "fm")))
+
+    # match() {{{3
+    def match(self, path):
+        """Returns the kind of the first pattern that matches path.
+
+        The kind is '+' if path is included, '-' if it is excluded, and '!' if
+        it is excluded along with anything it contains.  None is returned if
+        no pattern matches.
+        """
+        for kind, matches in self.patterns:
+            if matches(path):
+                return kind
+        return None
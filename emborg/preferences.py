@@ -50,6 +50,14 @@ OVERDUE_LOG_FILE = "overdue.log"
 PREV_LOG_FILE = "{config_name}.log.prev"
 LOCK_FILE = "{config_name}.lock"
 DATE_FILE = "{config_name}.latest.nt"
+ARCHIVES_FILE = "{config_name}.archives.json"
+MOUNTS_FILE = "{repository_id}.mounts.json"
+COMPACTION_FILE = "{repository_id}.compaction.nt"
+FILES_CACHES_FILE = "{repository_id}.files-caches.json"
+SNAPSHOT_FILE = "{config_name}.snapshot.json"
+JOURNAL_FILE = "{config_name}.journal.json"
+PROGRESS_FILE = "{config_name}.progress.json"
+CHECK_FILE = "{config_name}.check.json"
 
 CONFIGS_SETTING = "configurations"
 DEFAULT_CONFIG_SETTING = "default_configuration"
@@ -59,10 +67,12 @@ DEFAULT_ENCODING = "utf-8"
 # Emborg settings {{{2
 EMBORG_SETTINGS = dict(
     archive="template Borg should use when creating archive names",
+    archive_cache_lifetime="how long the cached list of archives in a remote repository is trusted",
     avendesora_account="account name that holds passphrase for encryption key in Avendesora",
     avendesora_field="name of field in Avendesora that holds the passphrase",
     borg_executable="path to borg",
     check_after_create="run check as the last step of an archive creation",
+    check_max_duration="time spent by each rotating check run after a backup",
     cmd_name="name of Emborg command being run (read only)",
     colorscheme="the color scheme",
     config_dir="absolute path to configuration directory (read-only)",
@@ -75,12 +85,18 @@ EMBORG_SETTINGS = dict(
     encryption="encryption method (see Borg documentation)",
     excludes="list of glob strings of files or directories to skip",
     exclude_from="file that contains exclude patterns",
+    files_cache_stats="report the hit rate of the Borg files cache after each backup",
+    files_cache_suffix="name that distinguishes the Borg files cache of this config",
+    files_cache_ttl="number of backups a file may be absent before it is dropped from the Borg files cache",
     home_dir="users home directory (read only)",
     include="include the contents of another file",
     log_dir="emborg log directory (read only)",
     manage_diffs_cmd="command to use to manage differences in files and directories",
+    manifest_cache_size="maximum space used to hold the cached manifests of archives",
+    manifest_sort_memory="maximum memory used when sorting the manifest",
     manifest_formats="format strings used by manifest",
     manifest_default_format="the format that manifest should use if none is specified",
+    mount_idle_timeout="unmount archives left mounted by compare and mount after this much idle time",
     must_exist="if set, each of these files or directories must exist or create will quit with an error",
     needs_ssh_agent="if set, Emborg will complain if ssh_agent is not available",
     notifier="notification program",
@@ -91,6 +107,9 @@ EMBORG_SETTINGS = dict(
     patterns_from="file that contains patterns",
     prune_after_create="run prune after creating an archive",
     compact_after_delete="run compact after deleting an archive or pruning a repository",
+    compact_max_deferral="maximum time compaction may be deferred after a delete or prune",
+    compact_threshold="reclaimable space needed to compact after a delete or prune",
+    record_progress="record the progress of create in a status file as it runs",
     report_diffs_cmd="shell command to use to report differences in files and directories",
     repository="path to remote directory that contains repository",
     run_after_backup="commands to run after archive has been created",
@@ -0,0 +1,307 @@
+# Progress
+#
+# Follows the progress of a running Borg command.  Borg is run with --log-json
+# and --progress, which causes it to write its progress to standard error as
+# JSON messages.  These are parsed as they arrive and made available through a
+# callback, a status file in the data directory, and a one-line display.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+import arrow
+from inform import Error, display, os_error, warn
+from quantiphy import Quantity, QuantiPhyError
+from .preferences import PROGRESS_FILE
+from .shlib import rm
+from .utilities import read_latest
+
+# Globals {{{1
+STATUS_INTERVAL = 5         # seconds between writes of the status file
+DISPLAY_INTERVAL = 0.2      # seconds between updates of the display
+RATE_WINDOW = 30            # seconds over which the throughput is averaged
+
+
+# Progress class {{{1
+class Progress:
+    """Progress
+
+    The progress of a Borg command as last reported by Borg.
+
+    Attributes:
+        command (str):
+            The Borg command.
+        files (int):
+            The number of files processed, only reported by create.
+        bytes (int):
+            The number of bytes processed; the original size of the files
+            processed by create.
+        compressed (int), deduplicated (int):
+            The compressed and deduplicated size of the files processed by
+            create.
+        current (int), total (int):
+            The number of items processed and the total number of items for
+            commands that report their progress as a percentage.
+        path (str):
+            The path currently being processed.
+        message (str):
+            The last progress message from Borg.
+        elapsed (float):
+            Seconds since Borg was started.
+        rate (float):
+            Recent throughput in bytes/s, or items/s if bytes are not reported.
+        eta (float):
+            Estimated seconds until Borg completes, or None if unknown.
+        finished (bool):
+            Borg has completed.
+    """
+    # constructor {{{2
+    def __init__(self, command):
+        self.command = command
+        self.files = 0
+        self.bytes = 0
+        self.compressed = 0
+        self.deduplicated = 0
+        self.current = None
+        self.total = None
+        self.path = None
+        self.message = None
+        self.elapsed = 0
+        self.rate = None
+        self.eta = None
+        self.finished = False
+
+    # as_dict() {{{2
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    # render() {{{2
+    def render(self):
+        """Returns a one-line summary of the progress."""
+        fields = []
+        if self.files:
+            fields.append(f"{self.files:,} files")
+        if self.bytes:
+            fields.append(Quantity(self.bytes, 'B').render(prec=2))
+        if self.total:
+            fields.append(f"{100*self.current/self.total:.1f}%")
+        if self.rate:
+            units = 'B/s' if self.bytes else '/s'
+            fields.append(Quantity(self.rate, units).render(prec=2))
+        if self.eta is not None:
+            fields.append(f"ETA {timedelta(seconds=round(self.eta))}")
+        if self.path:
+            fields.append(self.path)
+        elif self.message:
+            fields.append(self.message)
+        return "  ".join(fields)
+
+
+# ProgressMonitor class {{{1
+class ProgressMonitor:
+    """Progress Monitor
+
+    Parses the messages Borg writes to standard error when run with --log-json.
+    The progress messages are consumed, the others are converted back to the
+    text Borg would otherwise have written.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    command (str):
+        The Borg command.
+    callback (callable):
+        Called with a Progress object each time Borg reports its progress.
+        It is called from the thread that reads the output of Borg.
+    show (bool):
+        Show the progress on a single line of the terminal.
+    echo (bool):
+        Show the messages from Borg as they arrive.
+    listing (bool):
+        Keep the status of each file reported by Borg.  The status letters are
+        counted in statuses whether or not they are kept.
+    """
+    # constructor {{{2
+    def __init__(
+        self, settings, command, callback=None, show=False, echo=False,
+        listing=True
+    ):
+        self.settings = settings
+        self.listing = listing
+        self.statuses = Counter()
+        self.progress = Progress(command)
+        self.callback = callback
+        self.show = show and sys.stdout.isatty()
+        self.echo = echo
+        self.path = settings.data_dir / settings.resolve(
+            'PROGRESS_FILE', PROGRESS_FILE
+        )
+        self.lock = threading.Lock()
+        self.samples = deque()
+        self.expected = self.expected_bytes() if command == "create" else None
+        self.started = time.monotonic()
+        self.written = None
+        self.displayed = None
+        self.shown = False
+
+    # expected_bytes() {{{2
+    def expected_bytes(self):
+        # estimate the size of an archive from the size of the previous one
+        try:
+            stats = read_latest(self.settings.date_file).get('create stats') or {}
+            return float(Quantity(stats['original size'], 'B', ignore_sf=False))
+        except (Error, OSError, KeyError, QuantiPhyError):
+            return None
+
+    # update() {{{2
+    def update(self, line):
+        """Handles a line from standard error.
+
+        Returns the text to keep as the standard error of Borg, if any.
+        """
+        try:
+            message = json.loads(line)
+            kind = message['type']
+        except (ValueError, TypeError, KeyError):
+            return self.keep(line)
+
+        if kind == 'log_message':
+            return self.keep(message.get('message', '') + '\n')
+        if kind == 'file_status':
+            status = message.get('status')
+            self.statuses[status] += 1
+            if self.listing:
+                return self.keep(f"{status} {message.get('path')}\n")
+            return None
+
+        progress = self.progress
+        if kind == 'archive_progress':
+            if message.get('finished'):
+                return None
+            progress.files = message.get('nfiles', progress.files)
+            progress.bytes = message.get('original_size', progress.bytes)
+            progress.compressed = message.get('compressed_size', progress.compressed)
+            progress.deduplicated = message.get(
+                'deduplicated_size', progress.deduplicated
+            )
+            progress.path = message.get('path') or progress.path
+            self.advance(progress.bytes, self.expected)
+        elif kind == 'progress_percent':
+            if message.get('finished'):
+                return None
+            progress.current = message.get('current')
+            progress.total = message.get('total')
+            progress.message = message.get('message')
+            if progress.current is not None:
+                self.advance(progress.current, progress.total)
+        elif kind == 'progress_message':
+            if message.get('finished'):
+                return None
+            progress.message = message.get('message')
+            self.advance(None, None)
+        else:
+            return None
+        self.report()
+        return None
+
+    # keep() {{{2
+    def keep(self, text):
+        if self.echo:
+            self.clear()
+            display(text.rstrip('\n'))
+        return text
+
+    # advance() {{{2
+    def advance(self, done, total):
+        # update the elapsed time, throughput and estimated time remaining
+        progress = self.progress
+        now = time.monotonic()
+        progress.elapsed = now - self.started
+        if done is None:
+            return
+        samples = self.samples
+        samples.append((now, done))
+        while len(samples) > 2 and now - samples[0][0] > RATE_WINDOW:
+            samples.popleft()
+        then, before = samples[0]
+        if now > then and done >= before:
+            progress.rate = (done - before) / (now - then)
+        if progress.rate and total and total > done:
+            progress.eta = (total - done) / progress.rate
+        else:
+            progress.eta = None
+
+    # report() {{{2
+    def report(self):
+        progress = self.progress
+        now = time.monotonic()
+        if self.callback:
+            self.callback(progress)
+        if self.written is None or now - self.written >= STATUS_INTERVAL:
+            self.write()
+            self.written = now
+        if self.show and (
+            self.displayed is None or now - self.displayed >= DISPLAY_INTERVAL
+        ):
+            width = shutil.get_terminal_size().columns - 1
+            line = progress.render()[:width]
+            with self.lock:
+                sys.stdout.write(f"\r{line:<{width}}")
+                sys.stdout.flush()
+            self.displayed = now
+            self.shown = True
+
+    # write() {{{2
+    def write(self):
+        # write the status file
+        status = self.progress.as_dict()
+        status['pid'] = os.getpid()
+        status['updated'] = str(arrow.now())
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(status))
+            tmp.replace(self.path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+
+    # clear() {{{2
+    def clear(self):
+        # erase the progress line
+        if self.shown:
+            width = shutil.get_terminal_size().columns - 1
+            with self.lock:
+                sys.stdout.write(f"\r{'':<{width}}\r")
+                sys.stdout.flush()
+            self.shown = False
+
+    # finish() {{{2
+    def finish(self):
+        """Called once Borg terminates."""
+        self.progress.finished = True
+        self.progress.elapsed = time.monotonic() - self.started
+        self.progress.eta = None
+        if self.callback:
+            self.callback(self.progress)
+        self.clear()
+        rm(self.path)
@@ -0,0 +1,167 @@
+# Pruning
+#
+# Applies the prune rules locally to a list of archives, following the same
+# algorithm as borg prune, so that the effect of the rules can be seen without
+# contacting the repository.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import re
+import arrow
+from inform import Error
+
+# Globals {{{1
+# the rules in the order borg applies them, along with the format of the
+# period each covers; keep_last is borg's keep_secondly
+PRUNING_PATTERNS = {
+    "last": "YYYY-MM-DD HH:mm:ss",
+    "minutely": "YYYY-MM-DD HH:mm",
+    "hourly": "YYYY-MM-DD HH",
+    "daily": "YYYY-MM-DD",
+    "weekly": None,     # ISO year and week
+    "monthly": "YYYY-MM",
+    "yearly": "YYYY",
+}
+INTERVAL_UNITS = dict(
+    S=1, M=60, H=3600, d=24*3600, w=7*24*3600, m=31*24*3600, y=365*24*3600
+)
+CHECKPOINT = re.compile(r"\.checkpoint(\.\d+)?$")
+
+
+# interval() {{{1
+def interval(value):
+    """Converts a keep_within interval, such as 7d or 2w, to seconds."""
+    match = re.fullmatch(r"\s*(\d+)\s*([SMHdwmy])\s*", str(value))
+    if not match:
+        raise Error(
+            "invalid interval.",
+            codicil = "Expected a number followed by one of: S, M, H, d, w, m, y.",
+            culprit = "keep_within",
+        )
+    count, unit = match.groups()
+    if int(count) <= 0:
+        raise Error("interval must be positive.", culprit="keep_within")
+    return int(count) * INTERVAL_UNITS[unit]
+
+
+# prune_rules() {{{1
+def prune_rules(settings):
+    """Returns the prune rules from the settings.
+
+    Returns a dictionary that maps the name of each rule given, without the
+    keep_ prefix, to the interval in seconds for within and to the number of
+    archives to keep otherwise.
+    """
+    rules = {}
+    within = settings.value("keep_within")
+    if within:
+        rules["within"] = interval(within)
+    for rule in PRUNING_PATTERNS:
+        value = settings.value("keep_" + rule)
+        if value:
+            try:
+                count = int(value)
+            except ValueError:
+                count = -1
+            if count < 0:
+                raise Error(
+                    "expected a non-negative integer.", culprit="keep_" + rule
+                )
+            rules[rule] = count
+    return rules
+
+
+# prune_split() {{{1
+def prune_split(archives, rule, count, kept_because):
+    # keep the newest archive of each of the count most recent periods
+    keep = []
+    if count == 0:
+        return keep
+    pattern = PRUNING_PATTERNS[rule]
+    last = None
+    archive = None
+    for archive in archives:
+        if rule == "weekly":
+            year, week, _ = archive["when"].isocalendar()
+            period = (year, week)
+        else:
+            period = archive["when"].format(pattern)
+        if period != last:
+            last = period
+            if archive["name"] not in kept_because:
+                keep.append(archive)
+                kept_because[archive["name"]] = (rule, len(keep))
+                if len(keep) == count:
+                    break
+    # keep the oldest archive if the target count was not reached
+    if archive is not None and len(keep) < count and archive["name"] not in kept_because:
+        keep.append(archive)
+        kept_because[archive["name"]] = (rule + "[oldest]", len(keep))
+    return keep
+
+
+# simulate_prune() {{{1
+def simulate_prune(archives, rules, now=None):
+    """Determines the fate of each archive under the prune rules.
+
+    archives is a list of archives as given by borg list --json.  rules is as
+    returned by prune_rules().  Returns a list of (archive, reason) pairs,
+    newest archive first, where reason is None if the archive would be pruned
+    and otherwise explains why it is kept.  Each archive is augmented with its
+    start time as an Arrow object under the key 'when'.
+    """
+    # borg reports archive times as naive local times
+    every = []
+    for archive in archives:
+        archive = dict(archive)
+        timestamp = archive.get("start") or archive["time"]
+        archive["when"] = arrow.get(timestamp, tzinfo="local")
+        every.append(archive)
+    every.sort(key=lambda a: a["when"], reverse=True)
+    checkpoints = [a for a in every if CHECKPOINT.search(a["name"])]
+    regular = [a for a in every if not CHECKPOINT.search(a["name"])]
+
+    kept_because = {}
+    if "within" in rules:
+        cutoff = (now or arrow.now()).shift(seconds=-rules["within"])
+        count = 0
+        for archive in regular:
+            if archive["when"] > cutoff:
+                count += 1
+                kept_because[archive["name"]] = ("within", count)
+    for rule in PRUNING_PATTERNS:
+        if rule in rules:
+            prune_split(regular, rule, rules[rule], kept_because)
+
+    # the latest checkpoint is kept if it is newer than the latest archive
+    if checkpoints and (
+        not regular or checkpoints[0]["when"] > regular[0]["when"]
+    ):
+        kept_because[checkpoints[0]["name"]] = ("checkpoint", None)
+
+    fates = []
+    for archive in every:
+        because = kept_because.get(archive["name"])
+        if because is None:
+            reason = None
+        elif because[0] == "checkpoint":
+            reason = "keeping checkpoint archive"
+        else:
+            reason = "keeping archive (rule: {} #{})".format(*because)
+        fates.append((archive, reason))
+    return fates
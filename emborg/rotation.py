@@ -0,0 +1,137 @@
+# Check Rotation
+#
+# Spreads the checking of a repository over several runs, each of which is
+# given a limited amount of time.  Records how far the checking has progressed
+# so that the next run continues where the last one left off.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import json
+import arrow
+from inform import os_error, warn
+from .preferences import CHECK_FILE
+from .shlib import rm
+
+# Globals {{{1
+DEFAULT_MAX_DURATION = "1h"    # used if check_max_duration is not given
+
+# messages borg logs at the end of a repository check with --max-duration
+PARTIAL_CHECK = "finished partial segment check"
+COMPLETE_CHECK = "finished segment check"
+
+
+# CheckRotation class {{{1
+class CheckRotation:
+    """Check Rotation
+
+    Holds the state of a rotating check.  Each cycle first checks the
+    repository, which borg may split over several runs using --max-duration,
+    and then checks the archives that were present when the repository check
+    completed, one at a time, oldest first.  The state is kept in the data
+    directory and is discarded once the cycle is complete.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = settings.data_dir / settings.resolve(
+            'CHECK_FILE', CHECK_FILE
+        )
+        self.state = self.load()
+
+    # load() {{{2
+    def load(self):
+        repository = str(self.settings.repository)
+        try:
+            state = json.loads(self.path.read_text())
+            if state.get('repository') == repository:
+                return state
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            warn("ignoring state of rotating check.", culprit=self.path, codicil=str(e))
+        return dict(
+            repository = repository,
+            started = str(arrow.now()),
+            repository_checked = False,
+            pending = None,
+        )
+
+    # save() {{{2
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(self.state))
+            tmp.replace(self.path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+
+    # discard() {{{2
+    def discard(self):
+        rm(self.path)
+
+    # repository_checked {{{2
+    @property
+    def repository_checked(self):
+        return self.state['repository_checked']
+
+    # repository_check_ended() {{{2
+    def repository_check_ended(self, stderr):
+        """Records the outcome of a partial check of the repository.
+
+        stderr holds the messages from borg check --info --max-duration.
+        Returns True if the whole repository has now been checked.
+        """
+        messages = (stderr or "").lower()
+        if PARTIAL_CHECK in messages:
+            return False
+        if COMPLETE_CHECK not in messages:
+            warn("could not determine whether the repository check completed.")
+            return False
+        self.state['repository_checked'] = True
+        self.save()
+        return True
+
+    # pending() {{{2
+    def pending(self, archives):
+        """Returns the archives that are yet to be checked in this cycle.
+
+        archives are the names of the archives now in the repository.  The
+        archives to check are fixed when they are first requested, archives
+        created later are checked in the next cycle and those that have since
+        been deleted are dropped.
+        """
+        archives = list(archives)
+        if self.state['pending'] is None:
+            self.state['pending'] = archives
+            self.save()
+        available = set(archives)
+        return [a for a in self.state['pending'] if a in available]
+
+    # archive_checked() {{{2
+    def archive_checked(self, archive):
+        self.state['pending'] = [a for a in self.state['pending'] if a != archive]
+        self.save()
+
+    # started {{{2
+    @property
+    def started(self):
+        return arrow.get(self.state['started'])
@@ -0,0 +1,132 @@
+# Source Snapshot
+#
+# Summarizes the state of the files that would be backed up so that a backup
+# can be skipped if nothing has changed since the last one.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import hashlib
+import json
+import arrow
+from inform import narrate, os_error, warn
+from .preferences import SNAPSHOT_FILE
+from .shlib import rm
+from .walker import Walker
+
+# Globals {{{1
+MODULUS = 1 << 128
+
+
+# SourceSnapshot class {{{1
+class SourceSnapshot:
+    """Source Snapshot
+
+    A digest of the path, mode, size, modification time, change time and inode
+    of each file that would be included in an archive.  Each file is hashed
+    separately and the hashes are summed, so the digest does not depend on the
+    order in which the files are found.  The digest of the files as they were
+    when the last archive was created is kept in the data directory.
+
+    settings (Emborg):
+        The settings of the active configuration.
+    """
+    # constructor {{{2
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = settings.data_dir / settings.resolve(
+            'SNAPSHOT_FILE', SNAPSHOT_FILE
+        )
+        self.digest = None
+        self.count = 0
+        self.started = None
+
+    # scan() {{{2
+    def scan(self):
+        """Computes the digest of the files that would be backed up."""
+        settings = self.settings
+        settings.resolve_patterns([])
+        walker = Walker(settings)
+        total = 0
+        count = 0
+        for path, st in walker.walk(settings.roots):
+            key = (
+                f"{path}\0{st.st_mode}\0{st.st_size}\0"
+                f"{st.st_mtime_ns}\0{st.st_ctime_ns}\0{st.st_ino}"
+            )
+            digest = hashlib.blake2b(
+                key.encode('utf-8', 'surrogateescape'), digest_size=16
+            )
+            total += int.from_bytes(digest.digest(), 'little')
+            count += 1
+        self.digest = f"{total % MODULUS:032x}"
+        self.count = count
+        narrate(f"scanned {count} files.")
+        return self.digest
+
+    # load() {{{2
+    def load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            warn("ignoring snapshot.", culprit=self.path, codicil=str(e))
+            return None
+
+    # is_unchanged() {{{2
+    def is_unchanged(self):
+        """Indicates whether the files are as they were at the last backup."""
+        previous = self.load()
+        self.started = arrow.now()
+        if self.digest is None:
+            self.scan()
+        if not previous:
+            return False
+        return (
+            previous.get('repository') == str(self.settings.repository)
+            and previous.get('digest') == self.digest
+            and previous.get('files') == self.count
+        )
+
+    # save() {{{2
+    def save(self):
+        """Records the digest once the files have been backed up.
+
+        The digest is None if the files were not scanned, in which case they
+        are scanned before the next backup.
+        """
+        if self.started is None:
+            return
+        contents = dict(
+            repository = str(self.settings.repository),
+            digest = self.digest,
+            files = self.count,
+            started = str(self.started),
+            written = str(arrow.now()),
+        )
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(contents))
+            tmp.replace(self.path)
+        except OSError as e:
+            warn(os_error(e))
+            rm(tmp)
+
+    # discard() {{{2
+    def discard(self):
+        rm(self.path)
@@ -0,0 +1,162 @@
+# Sorting
+#
+# Sorts manifest entries in bounded memory.  Entries are sorted in runs that
+# fit in memory, runs are spilled to temporary files, and then the runs are
+# merged.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import heapq
+import marshal
+import sys
+import tempfile
+from inform import Error, narrate
+from quantiphy import Quantity, QuantiPhyError
+
+# Globals {{{1
+DEFAULT_MEMORY = "256MB"
+SAMPLE_SIZE = 1000      # number of records used to estimate their size
+MAX_FAN_IN = 64         # maximum number of runs merged at once
+
+
+# sort_memory() {{{1
+def sort_memory(settings):
+    """Returns manifest_sort_memory in bytes."""
+    memory = settings.value('manifest_sort_memory') or DEFAULT_MEMORY
+    try:
+        return float(Quantity(memory, 'B', ignore_sf=False, binary=True))
+    except QuantiPhyError as e:
+        raise Error(e, culprit='manifest_sort_memory')
+
+
+# record_size() {{{1
+def record_size(record):
+    # approximate memory used by a (key, seq, values) record
+    key, seq, values = record
+    size = sys.getsizeof(record) + sys.getsizeof(key) + sys.getsizeof(values)
+    return size + sum(sys.getsizeof(v) for v in values)
+
+
+# Run class {{{1
+class Run:
+    """A sorted run of records held in a temporary file in directory."""
+
+    def __init__(self, records, directory=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        for record in records:
+            marshal.dump(record, self.file)
+        self.file.flush()
+
+    def __iter__(self):
+        self.file.seek(0)
+        load = marshal.load
+        file = self.file
+        while True:
+            try:
+                yield load(file)
+            except EOFError:
+                break
+        file.close()
+
+
+# top_entries() {{{1
+def top_entries(entries, key, count, reverse):
+    """Return the entries with the largest values of key.
+
+    Gives the same entries as the last count entries of a stable sort, in the
+    same order, or reversed if reverse is true.  Only count entries are held
+    in memory at once.
+    """
+    try:
+        top = heapq.nlargest(
+            count,
+            ((entry[key], seq, entry) for seq, entry in enumerate(entries)),
+            key = lambda record: record[:2],
+        )
+    except KeyError:
+        raise Error('unknown key.', culprit=key)
+    if not reverse:
+        top.reverse()
+    return [record[2] for record in top]
+
+
+# sort_entries() {{{1
+def sort_entries(entries, key, reverse, memory, directory=None):
+    """Sort manifest entries in bounded memory.
+
+    Entries are dictionaries.  They are sorted by the value of the given key,
+    or are simply reversed if key is None.  The sort is stable, and reversing
+    gives the same order as reversing the result of a stable sort.  No more
+    than roughly memory bytes are held at once, the rest is spilled to
+    temporary files in directory, or in the system temporary directory if not
+    given.  Returns an iterator.
+    """
+    # entries are held as compact tuples: (key, sequence number, values)
+    names = None
+    runs = []
+    records = []
+    used = 0
+    per_record = None
+    for seq, entry in enumerate(entries):
+        if names is None:
+            names = tuple(entry)
+        values = tuple(entry.values())
+        if tuple(entry) != names:
+            values = (entry,)  # rare, entry has unexpected fields
+        try:
+            sort_value = entry[key] if key else None
+        except KeyError:
+            raise Error('unknown key.', culprit=key)
+        records.append((sort_value, seq, values))
+
+        # estimate the memory used
+        if per_record is None:
+            if len(records) == SAMPLE_SIZE:
+                per_record = sum(record_size(r) for r in records) / SAMPLE_SIZE
+            used += record_size(records[-1])
+        else:
+            used += per_record
+        if used > memory:
+            records.sort(reverse=reverse)
+            runs.append(Run(records, directory))
+            records = []
+            used = 0
+    records.sort(reverse=reverse)
+
+    if runs:
+        narrate(f"sorting manifest using {len(runs) + 1} runs.")
+        while len(runs) >= MAX_FAN_IN:
+            runs = [
+                Run(
+                    heapq.merge(*runs[i:i+MAX_FAN_IN], reverse=reverse),
+                    directory
+                )
+                for i in range(0, len(runs), MAX_FAN_IN)
+            ]
+        records = heapq.merge(*runs, records, reverse=reverse)
+
+    return _restore(records, names)
+
+
+def _restore(records, names):
+    for record in records:
+        values = record[2]
+        if len(values) == 1 and isinstance(values[0], dict):
+            yield values[0]
+        else:
+            yield dict(zip(names, values))
@@ -23,10 +23,21 @@ import os
 import socket
 import nestedtext as nt
 from inform import Error, narrate, os_error, warn
+from quantiphy import Quantity, UnitConversion
 from .shlib import Run, set_prefs as set_shlib_prefs
 set_shlib_prefs(use_inform=True, log_cmd=True)
 
 
+# time conversions {{{1
+UnitConversion('s', 'sec second seconds')
+UnitConversion('s', 'm min minute minutes', 60)
+UnitConversion('s', 'h hr hour hours', 60*60)
+UnitConversion('s', 'd day days', 24*60*60)
+UnitConversion('s', 'w week weeks', 7*24*60*60)
+UnitConversion('s', 'M month months', 30*24*60*60)
+UnitConversion('s', 'y year years', 365*24*60*60)
+
+
 # gethostname {{{1
 # returns short version of the hostname (the hostname without any domain name)
 def gethostname():
@@ -197,8 +208,30 @@ def when(time, relative_to=None, as_past=None, as_future=None):
     return annotate(years, 0, "year")
 
 
+# to_seconds {{{1
+def to_seconds(value, culprit=None):
+    """Converts a time interval to seconds
+
+    The interval may be a number, which is taken to be in seconds, or a string
+    that contains a number and a unit, such as 90s, 15m, 2h, 1d, or 4w.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        # m is minutes, not milli
+        return float(Quantity(value, scale='s', ignore_sf=True))
+    except (TypeError, ValueError) as e:
+        # QuantiPhyError is both a TypeError and a ValueError
+        raise Error(
+            e, culprit=culprit,
+            codicil='Expected a time interval such as 30m, 6h, 1d, or 2w.'
+        )
+
+
 # update_latest {{{1
-def update_latest(command, path, repo_size=None):
+def update_latest(command, path, repo_size=None, stats=None, reclaimable=None):
     narrate(f"updating date file for {command}: {str(path)}")
     latest = {}
     try:
@@ -215,6 +248,12 @@ def update_latest(command, path, repo_size=None):
     elif 'repository size' in latest:
         if repo_size is False:
             del latest['repository size']
+    if stats:
+        latest[f"{command} stats"] = stats
+    if reclaimable:
+        latest['reclaimable space'] = reclaimable
+    elif reclaimable is False:
+        latest.pop('reclaimable space', None)
 
     try:
         nt.dump(latest, path, sort_keys=True)
@@ -0,0 +1,189 @@
+# Walker
+#
+# Walks the local files that would be included in an archive.  Directories are
+# scanned in parallel, which helps greatly when the files are on a network file
+# system or are not in the operating system's cache.
+
+# License {{{1
+# Copyright (C) 2018-2024 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+
+# Imports {{{1
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from queue import SimpleQueue
+from inform import os_error, warn
+from .patterns import PatternMatcher
+
+# Globals {{{1
+DEFAULT_JOBS = 8
+CACHEDIR_TAG = "CACHEDIR.TAG"
+CACHEDIR_SIGNATURE = b"Signature: 8a477f597d28d172789f06886806bc55"
+
+
+# Walker class {{{1
+class Walker:
+    """Walker
+
+    Generates the paths and the status of the local files that borg would
+    include in an archive given the settings of a configuration.  Honors
+    patterns, excludes, exclude_from, patterns_from, exclude_if_present,
+    exclude_caches and one_file_system.  exclude_nodump is not supported.
+
+    Paths are given as they are in an archive: relative paths are relative to
+    the working directory and absolute paths lose their leading slash.  The
+    files themselves are accessed using the paths as given, see local_path().
+
+    settings (Emborg):
+        The settings of the active configuration.
+    jobs (int):
+        The number of directories scanned at once.
+    """
+    # constructor {{{2
+    def __init__(self, settings, jobs=DEFAULT_JOBS):
+        self.working_dir = str(settings.working_dir)
+        self.jobs = jobs
+        self.tags = set(settings.values("exclude_if_present"))
+        self.exclude_caches = settings.value("exclude_caches")
+        self.one_file_system = settings.value("one_file_system")
+        self.roots = {}
+
+        # patterns are given to borg in this order, so must be matched so
+        matcher = PatternMatcher()
+        matcher.add_patterns(settings.values("patterns"))
+        matcher.add_excludes(settings.values("excludes"))
+        for path in settings.as_paths("patterns_from", must_exist=True):
+            matcher.add_patterns(path.read_text().splitlines(), False)
+        for path in settings.as_paths("exclude_from", must_exist=True):
+            matcher.add_excludes(path.read_text().splitlines(), False)
+        self.matcher = matcher
+
+    # local_path() {{{2
+    def local_path(self, path):
+        """Converts a path produced by walk() to the path of the local file.
+
+        The path is relative to the working directory unless it is within one
+        of the absolute paths given to walk().
+        """
+        for root, local in self.roots.items():
+            if path == root:
+                return local
+            if root == ".":
+                return os.path.join(local, path)
+            if path.startswith(root + "/"):
+                return local + path[len(root):]
+        return os.path.join(self.working_dir, path)
+
+    # walk() {{{2
+    def walk(self, paths, only_directories=False):
+        """Generates (path, stat) for each file at or below the given paths.
+
+        The order in which the files are produced is not defined.  If
+        only_directories is true, just the directories that are scanned are
+        produced, including those that are excluded but whose contents are not.
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            # completed scans are queued, so results are handled as they finish
+            done = SimpleQueue()
+            pending = 0
+
+            def scan(path, local, st, device):
+                future = executor.submit(
+                    self.visit, path, local, st, device, only_directories
+                )
+                future.add_done_callback(done.put)
+
+            for path in paths:
+                # paths are stored in archives without a leading slash, but
+                # absolute paths are not relative to the working directory
+                path = str(path)
+                if os.path.isabs(path):
+                    local = os.path.normpath(path)
+                    path = local.lstrip("/") or "."
+                    self.roots[path] = local
+                else:
+                    path = path or "."
+                    local = self.local_path(path)
+                try:
+                    st = os.lstat(local)
+                except OSError as e:
+                    warn(os_error(e))
+                    continue
+                scan(path, local, st, st.st_dev)
+                pending += 1
+            while pending:
+                entries, directories = done.get().result()
+                pending -= 1
+                yield from entries
+                for directory in directories:
+                    scan(*directory)
+                    pending += 1
+
+    # visit() {{{2
+    def visit(self, path, local, st, device, only_directories=False):
+        # returns the entries to report and the directories still to visit
+        # path is used when matching patterns, local when accessing the file
+        kind = self.matcher.match(path)
+        included = kind in (None, "+")
+        if only_directories:
+            included = stat.S_ISDIR(st.st_mode)
+        if not stat.S_ISDIR(st.st_mode):
+            return ([(path, st)] if included else []), []
+        if kind == "!":
+            return [], []
+        if self.one_file_system and st.st_dev != device:
+            return [], []
+
+        try:
+            with os.scandir(local) as scanner:
+                children = list(scanner)
+        except OSError as e:
+            warn(os_error(e))
+            return ([(path, st)] if included else []), []
+        if self.is_tagged(local, children):
+            return [], []
+
+        entries = [(path, st)] if included else []
+        if only_directories:
+            children = [c for c in children if c.is_dir(follow_symlinks=False)]
+        directories = []
+        for child in children:
+            child_path = f"{path}/{child.name}" if path != "." else child.name
+            try:
+                child_st = child.stat(follow_symlinks=False)
+            except OSError as e:
+                warn(os_error(e))
+                continue
+            if stat.S_ISDIR(child_st.st_mode):
+                directories.append((child_path, child.path, child_st, device))
+            elif self.matcher.match(child_path) in (None, "+"):
+                entries.append((child_path, child_st))
+        return entries, directories
+
+    # is_tagged() {{{2
+    def is_tagged(self, local, children):
+        # directories that contain a tag are excluded, as are their contents
+        names = set(c.name for c in children)
+        if self.tags & names:
+            return True
+        if self.exclude_caches and CACHEDIR_TAG in names:
+            try:
+                tag = os.path.join(local, CACHEDIR_TAG)
+                with open(tag, "rb") as f:
+                    return f.read(len(CACHEDIR_SIGNATURE)) == CACHEDIR_SIGNATURE
+            except OSError:
+                pass
+        return False
@@ -0,0 +1,226 @@
+# Test Emborg Cache
+#
+# These tests exercise the management of Borg's local cache.
+
+# Imports {{{1
+import os
+from inform import Error
+import pytest
+from emborg.cache import BorgCache, canonical_location, files_cache_suffix
+from emborg.command import CacheCommand
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(
+        self, data_dir, config_name, repository="/backups/home", peers=None
+    ):
+        self.data_dir = data_dir
+        self.config_name = config_name
+        self.repository = repository
+        self.peers = peers or {config_name: repository}
+
+    def value(self, name, default=None):
+        assert name == "repository"
+        if isinstance(self.repository, Exception):
+            raise self.repository
+        return self.repository
+
+    def is_first_config(self):
+        return self.config_name == list(self.peers)[0]
+
+    def all_configs(self):
+        return list(self.peers)
+
+    def peer(self, config):
+        return Settings(self.data_dir, config, self.peers[config], self.peers)
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    # Borg's cache directory holding the caches of several repositories
+    directory = tmp_path / "borg"
+    monkeypatch.setenv("BORG_CACHE_DIR", str(directory))
+
+    def add(name, location=None, timestamp="2026-10-01T00:00:00.000000"):
+        cache = directory / name
+        cache.mkdir(parents=True)
+        config = ["[cache]", "version = 1"]
+        if location:
+            config.append(f"previous_location = {location}")
+        if timestamp:
+            config.append(f"timestamp = {timestamp}")
+        (cache / "config").write_text("\n".join(config) + "\n")
+        (cache / "chunks").write_bytes(bytes(1000))
+        (cache / "files").write_bytes(bytes(100))
+        (cache / "files.root").write_bytes(bytes(10))
+        return cache
+
+    add("home", "/backups/home")
+    add("media", "ssh://host/backups/media")
+    add("unknown")
+    (directory / "other").mkdir()
+    return add
+
+
+# Tests {{{1
+# canonical_location() {{{2
+@pytest.mark.parametrize("repository, location", [
+    ("/backups/home", "/backups/home"),
+    ("/backups/home/", "/backups/home"),
+    ("file:///backups/home", "/backups/home"),
+    ("host:/backups/home", "ssh://host/backups/home"),
+    ("ken@host:/backups/home", "ssh://ken@host/backups/home"),
+    ("ken@host:backups/home", "ssh://ken@host/./backups/home"),
+    ("ken@host:~/backups", "ssh://ken@host/~/backups"),
+    ("ssh://ken@host/backups/home", "ssh://ken@host/backups/home"),
+    ("ssh://ken@host:2222/backups/home", "ssh://ken@host:2222/backups/home"),
+    ("ssh://host/./backups/home", "ssh://host/./backups/home"),
+    ("ssh://host/~/backups", "ssh://host/~/backups"),
+    ("ssh://ken@[::1]:22/backups", "ssh://ken@[::1]:22/backups"),
+])
+def test_canonical_location(repository, location):
+    assert canonical_location(repository) == location
+
+
+def test_canonical_location_relative(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert canonical_location("backups") == str(tmp_path / "backups")
+
+
+# files_cache_suffix() {{{2
+def test_files_cache_suffix(tmp_path):
+    # the first config to back up to a repository uses the usual files cache
+    home = Settings(tmp_path, "home")
+    assert files_cache_suffix(home, record=False) == ""
+    assert files_cache_suffix(Settings(tmp_path, "root"), record=False) == ""
+
+    assert files_cache_suffix(home) == ""
+    assert files_cache_suffix(Settings(tmp_path, "root")) == "root"
+    assert files_cache_suffix(Settings(tmp_path, "media")) == "media"
+    assert files_cache_suffix(home) == ""
+    assert files_cache_suffix(Settings(tmp_path, "root")) == "root"
+
+    # each repository is treated separately
+    assert files_cache_suffix(Settings(tmp_path, "root", "host:backups")) == ""
+
+
+def test_files_cache_suffix_corrupt(tmp_path):
+    home = Settings(tmp_path, "home")
+    files_cache_suffix(home)
+    for path in tmp_path.iterdir():
+        path.write_text("{")
+    assert files_cache_suffix(Settings(tmp_path, "root")) == ""
+
+
+# BorgCache {{{2
+def test_cache_find(caches):
+    assert [c.path.name for c in BorgCache.find()] == ["home", "media", "unknown"]
+    [cache] = BorgCache.find("file:///backups/home/")
+    assert cache.path.name == "home"
+    assert cache.sizes() == (1110 + len((cache.path / "config").read_bytes()), {
+        "files": 100, "files.root": 10
+    })
+    assert BorgCache.find("host:/backups/home") == []
+
+
+def test_cache_resync_pending(caches):
+    [cache] = BorgCache.find("/backups/home")
+    archives = [
+        dict(name="home-1", start="2026-09-30T00:00:00.000000"),
+        dict(name="home-2", start="2026-10-02T00:00:00.000000"),
+    ]
+    assert cache.resync_pending(archives) == "home-2"
+    assert cache.resync_pending(archives[:1]) is False
+    assert cache.resync_pending(None) is None
+
+    caches("new", "/backups/new", timestamp=None)
+    [cache] = BorgCache.find("/backups/new")
+    assert cache.resync_pending(archives) is None
+
+
+def test_cache_relocate(caches, tmp_path):
+    home = BorgCache.find("/backups/home")[0].path
+    elsewhere = tmp_path / "elsewhere"
+
+    # moving out leaves a link behind
+    assert BorgCache(home).relocate(elsewhere)
+    assert home.is_symlink()
+    assert home.resolve() == elsewhere / "home"
+    assert (elsewhere / "home/chunks").is_file()
+    [cache] = BorgCache.find("/backups/home")
+    assert cache.relocate(elsewhere) is False
+
+    # moving back removes it
+    assert cache.relocate(home.parent)
+    assert not home.is_symlink()
+    assert (home / "chunks").is_file()
+    assert not (elsewhere / "home").exists()
+
+    # caches are not moved onto something else or while borg uses them
+    (elsewhere / "home").mkdir()
+    with pytest.raises(Error) as exception:
+        cache.relocate(elsewhere)
+    assert str(exception.value).endswith("already exists.")
+    (home / "lock.exclusive").mkdir()
+    with pytest.raises(Error) as exception:
+        cache.relocate(tmp_path)
+    assert str(exception.value).endswith("cache is in use.")
+
+
+def test_cache_remove(caches, tmp_path):
+    cache = BorgCache.find("/backups/home")[0]
+    cache.relocate(tmp_path / "elsewhere")
+    BorgCache(cache.path).remove()
+    assert not cache.path.is_symlink()
+    assert not (tmp_path / "elsewhere/home").exists()
+
+
+# CacheCommand.prune_stale() {{{2
+def test_cache_prune_stale(caches, tmp_path, capsys):
+    peers = dict(home="/backups/home", root="file:///backups/home/")
+    home = Settings(tmp_path, "home", peers=peers)
+    root = home.peer("root")
+
+    # only the first member of a composite configuration does anything
+    CacheCommand.prune_stale(root, [])
+    CacheCommand.prune_stale(home, ["dry-run"])
+    [removed] = capsys.readouterr().out.splitlines()
+    assert removed.startswith("removing cache of ssh://host/backups/media (")
+    assert removed.endswith(f" kB): {tmp_path}/borg/media")
+    assert len(BorgCache.find()) == 3
+
+    # caches in use or of unknown repositories are kept
+    (caches("other-home", "/backups/other") / "lock.exclusive").mkdir()
+    CacheCommand.prune_stale(home, [])
+    assert [c.path.name for c in BorgCache.find()] == [
+        "home", "other-home", "unknown"
+    ]
+
+
+def test_cache_prune_stale_unknown(caches, tmp_path):
+    # nothing is removed unless the repositories of all configs are known
+    peers = dict(home="/backups/home", media=Error("bad settings."))
+    with pytest.raises(Error) as exception:
+        CacheCommand.prune_stale(Settings(tmp_path, "home", peers=peers), [])
+    assert str(exception.value).startswith("media: bad settings.")
+    assert len(BorgCache.find()) == 3
+
+
+# CacheCommand.relocate() {{{2
+def test_cache_command_relocate(caches, tmp_path, capsys):
+    settings = Settings(tmp_path, "home")
+    elsewhere = tmp_path / "elsewhere"
+    CacheCommand.relocate(settings, str(elsewhere))
+    CacheCommand.relocate(settings, str(elsewhere))
+    assert capsys.readouterr().out.splitlines() == [
+        f"cache moved to {elsewhere}/home.",
+        f"cache is already in {elsewhere}.",
+    ]
+
+    settings = Settings(tmp_path, "home", "/backups/missing")
+    with pytest.raises(Error) as exception:
+        CacheCommand.relocate(settings, str(elsewhere))
+    assert exception.value.args == ("no cache found for repository.",)
+    assert os.path.isdir(elsewhere / "home")
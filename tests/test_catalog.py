@@ -0,0 +1,149 @@
+# Test Emborg Catalog
+#
+# These tests exercise the local copy of the list of archives in a repository.
+
+# Imports {{{1
+import json
+import arrow
+import pytest
+from emborg.catalog import ArchiveCatalog
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, data_dir, repository, **settings):
+        self.data_dir = data_dir
+        self.repository = repository
+        self.settings = settings
+
+    def value(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def resolve(self, name, value):
+        return value.format(config_name="test")
+
+
+def archive(name, id=None):
+    return dict(name=name, id=id or name.upper(), start="2026-10-17T00:00:00")
+
+
+ARCHIVES = [archive("test-1"), archive("test-2")]
+
+
+@pytest.fixture
+def repository(tmp_path):
+    # a local repository
+    repository = tmp_path / "repository"
+    repository.mkdir()
+    (repository / "index.99").write_text("")
+    return repository
+
+
+# Tests {{{1
+# transaction() {{{2
+def test_catalog_transaction(tmp_path, repository):
+    catalog = ArchiveCatalog(Settings(tmp_path, repository))
+    (repository / "index.100").write_text("")
+    (repository / "index.tmp").write_text("")
+    assert catalog.transaction() == "index.100"
+    assert catalog.is_verifiable()
+
+    remote = ArchiveCatalog(Settings(tmp_path, "host:backups"))
+    assert remote.transaction() is None
+    assert not remote.is_verifiable()
+
+
+# read() {{{2
+def test_catalog_local(tmp_path, repository):
+    # the catalog of a local repository is current until its index changes
+    catalog = ArchiveCatalog(Settings(tmp_path, repository))
+    assert catalog.read() is None
+    catalog.write(ARCHIVES, written=str(arrow.now().shift(days=-30)))
+    assert catalog.read() == ARCHIVES
+
+    (repository / "index.99").rename(repository / "index.101")
+    assert catalog.read() is None
+
+
+def test_catalog_remote(tmp_path):
+    # the catalog of a remote repository is current until it is too old
+    settings = Settings(tmp_path, "host:backups", archive_cache_lifetime="1h")
+    catalog = ArchiveCatalog(settings)
+    catalog.write(ARCHIVES, written=str(arrow.now().shift(minutes=-30)))
+    assert catalog.read() == ARCHIVES
+    catalog.write(ARCHIVES, written=str(arrow.now().shift(minutes=-90)))
+    assert catalog.read() is None
+
+    # written in the future
+    catalog.write(ARCHIVES, written=str(arrow.now().shift(minutes=10)))
+    assert catalog.read() is None
+
+    # the default lifetime is 15 minutes
+    settings.settings["archive_cache_lifetime"] = ""
+    catalog.write(ARCHIVES, written=str(arrow.now().shift(minutes=-10)))
+    assert catalog.read() == ARCHIVES
+    catalog.write(ARCHIVES, written=str(arrow.now().shift(minutes=-20)))
+    assert catalog.read() is None
+
+
+def test_catalog_key(tmp_path, repository):
+    # the catalog only applies to the repository and filters it was made for
+    ArchiveCatalog(Settings(tmp_path, repository)).write(ARCHIVES)
+    assert ArchiveCatalog(Settings(tmp_path, repository)).read() == ARCHIVES
+    assert ArchiveCatalog(Settings(tmp_path, repository, prefix="t")).read() is None
+    assert ArchiveCatalog(
+        Settings(tmp_path, repository, glob_archives="test-*")
+    ).read() is None
+
+
+def test_catalog_corrupt(tmp_path, repository):
+    catalog = ArchiveCatalog(Settings(tmp_path, repository))
+    catalog.path.write_text("{")
+    assert catalog.read() is None
+
+
+# is_latest() {{{2
+@pytest.mark.parametrize("archives, latest, agree", [
+    (ARCHIVES, archive("test-2"), True),
+    (ARCHIVES, archive("test-2", "OTHER"), False),
+    (ARCHIVES, archive("test-3"), False),
+    (ARCHIVES, None, False),
+    ([], archive("test-1"), False),
+    ([], None, True),
+])
+def test_catalog_is_latest(tmp_path, archives, latest, agree):
+    catalog = ArchiveCatalog(Settings(tmp_path, "host:backups"))
+    catalog.write(archives)
+    assert catalog.is_latest(archives, latest) == agree
+    assert catalog.path.exists() == agree
+
+
+# before() {{{2
+@pytest.mark.parametrize("cmd, args, kept, revalidate", [
+    ("list", [], True, False),
+    ("mount", [], True, False),
+    ("check", [], True, True),
+    ("compact", [], True, True),
+    ("check", ["--repair"], False, False),
+    ("create", [], False, False),
+    ("prune", [], False, False),
+    ("delete", [], False, False),
+])
+def test_catalog_before(tmp_path, repository, cmd, args, kept, revalidate):
+    catalog = ArchiveCatalog(Settings(tmp_path, repository))
+    catalog.write(ARCHIVES)
+    assert catalog.before(cmd, args) == revalidate
+    assert catalog.path.exists() == kept
+
+
+def test_catalog_revalidate(tmp_path, repository):
+    # a new transaction that leaves the archives unchanged, as from compact
+    catalog = ArchiveCatalog(Settings(tmp_path, repository))
+    catalog.write(ARCHIVES)
+    assert catalog.before("compact", [])
+    (repository / "index.99").rename(repository / "index.100")
+    assert catalog.read() is None
+    catalog.revalidate()
+    assert catalog.read() == ARCHIVES
+    assert json.loads(catalog.path.read_text())["transaction"] == "index.100"
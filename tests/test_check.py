@@ -0,0 +1,70 @@
+# Test Emborg Check
+#
+# These tests exercise the rotating check without running Borg Backup.
+
+# Imports {{{1
+from inform import Error
+import pytest
+from emborg.command import CheckCommand
+from emborg.emborg import Emborg
+from emborg.rotation import COMPLETE_CHECK, PARTIAL_CHECK, CheckRotation
+
+
+# Utilities {{{1
+class Borg:
+    # stands in for the process that ran borg
+    def __init__(self, stderr, status=0):
+        self.stderr = stderr
+        self.status = status
+
+
+class Settings:
+    # stands in for the settings of a configuration, records the borg command
+    # lines that would be run
+    def __init__(self, data_dir, stderr, status=0, **settings):
+        self.data_dir = data_dir
+        self.repository = "/repos/backups"
+        self.settings = settings
+        self.stderr = stderr
+        self.status = status
+        self.commands = []
+
+    def value(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def resolve(self, name, value):
+        return value
+
+    def destination(self, archive=None):
+        return f"{self.repository}::{archive}" if archive else self.repository
+
+    def run_borg(
+        self, cmd, args=(), borg_opts=None, emborg_opts=(), strip_prefix=False,
+        **kwargs
+    ):
+        borg_opts = Emborg.borg_options(
+            self, cmd, borg_opts, emborg_opts, strip_prefix
+        )
+        self.commands.append(["borg", cmd] + borg_opts + list(args))
+        return Borg(self.stderr, self.status)
+
+
+# Tests {{{1
+# check_rotating() {{{2
+@pytest.mark.parametrize("name", ["prefix", "glob_archives"])
+def test_check_rotating_command(tmp_path, name):
+    # borg check --repository-only rejects --prefix and --glob-archives
+    settings = Settings(tmp_path, PARTIAL_CHECK, **{name: "test0-"})
+    CheckCommand.check_rotating(settings, 90, [], False)
+    assert settings.commands == [[
+        "borg", "check", "--info", "--repository-only",
+        "--max-duration", "90", "/repos/backups",
+    ]]
+    assert not CheckRotation(settings).repository_checked
+
+
+def test_check_rotating_corrupt(tmp_path):
+    settings = Settings(tmp_path, COMPLETE_CHECK, status=1, prefix="test0-")
+    with pytest.raises(Error, match="repository is corrupt"):
+        CheckCommand.check_rotating(settings, 90, [], False)
+    assert "--prefix" not in settings.commands[0]
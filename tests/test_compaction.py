@@ -0,0 +1,121 @@
+# Test Emborg Compaction
+#
+# These tests exercise the decision of when to compact a repository.
+
+# Imports {{{1
+import arrow
+import nestedtext as nt
+import pytest
+from inform import Error
+from quantiphy import Quantity
+from emborg.compaction import CompactionPolicy, reclaimed_space
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, **settings):
+        self.settings = settings
+
+    def __getattr__(self, name):
+        return self.settings.get(name)
+
+
+# Tests {{{1
+# reclaimed_space() {{{2
+def test_reclaimed_space():
+    stats = """
+                       Original size      Compressed size    Deduplicated size
+Deleted data:               -1.23 GB            -1.01 GB           -300.45 MB
+All archives:               25.77 GB            21.10 GB              4.17 GB
+"""
+    assert reclaimed_space(stats) == Quantity(300.45e6, 'B')
+    assert reclaimed_space(stats + stats.replace("300.45 MB", "2.00 GB")) == (
+        Quantity(2.30045e9, 'B')
+    )
+    assert reclaimed_space("Deleted data: 0 B 0 B 0 B") == 0
+    assert reclaimed_space("nothing deleted") is None
+    assert reclaimed_space(None) is None
+
+
+# CompactionPolicy.decide() {{{2
+@pytest.mark.parametrize("threshold, max_deferral, latest, due", [
+    (None, None, {}, True),
+    ("1GB", None, {}, False),
+    ("1GB", None, {"reclaimable space": "500 MB"}, False),
+    ("1GB", None, {"reclaimable space": "1.5 GB"}, True),
+    ("1GB", None, {"reclaimable space": "unknown"}, True),
+    ("10%", None, {"reclaimable space": "500 MB"}, True),
+    ("10%", None, {"reclaimable space": "500 MB", "repository size": "10 GB"}, False),
+    ("10%", None, {"reclaimable space": "2 GB", "repository size": "10 GB"}, True),
+    (None, "1w", {}, True),
+    (None, "1w", {"compact last run": 1}, False),
+    (None, "1w", {"compact last run": 14}, True),
+    ("1GB", "1w", {"compact last run": 1, "reclaimable space": "5 GB"}, True),
+    ("1GB", "1w", {"compact last run": 1, "reclaimable space": "5 MB"}, False),
+    ("1GB", "1w", {"compact last run": 14, "reclaimable space": "5 MB"}, True),
+])
+def test_compaction_policy(tmp_path, threshold, max_deferral, latest, due):
+    latest = dict(latest)
+    if "compact last run" in latest:
+        days_ago = latest["compact last run"]
+        latest["compact last run"] = str(arrow.now().shift(days=-days_ago))
+    settings = Settings(
+        compact_threshold = threshold,
+        compact_max_deferral = max_deferral,
+        date_file = tmp_path / "test.latest.nt",
+        data_dir = tmp_path,
+        repository = "/repos/backups",
+    )
+    policy = CompactionPolicy(settings)
+    size = latest.pop("repository size", None)
+    nt.dump({"repository size": size} if size else {}, settings.date_file)
+    nt.dump(latest, policy.path)
+    decision, reason = policy.decide()
+    assert decision == due, reason
+
+
+def test_compaction_policy_bad_threshold(tmp_path):
+    settings = Settings(
+        compact_threshold = "lots",
+        date_file = tmp_path / "test.latest.nt",
+        data_dir = tmp_path,
+        repository = "/repos/backups",
+    )
+    policy = CompactionPolicy(settings)
+    nt.dump({"reclaimable space": "5 MB"}, policy.path)
+    with pytest.raises(Error):
+        policy.decide()
+
+
+# CompactionPolicy.record() {{{2
+def test_compaction_policy_shared(tmp_path):
+    # the space freed by each config that uses the repository is pooled
+    def config(name, repository="/repos/backups"):
+        return Settings(
+            compact_threshold = "1GB",
+            date_file = tmp_path / f"{name}.latest.nt",
+            data_dir = tmp_path,
+            repository = repository,
+        )
+    home, root, other = config("home"), config("root"), config("other", "/repos/other")
+    freed = "Deleted data: -1.23 GB -1.01 GB -600 MB"
+
+    CompactionPolicy(home).record("prune", freed)
+    assert not CompactionPolicy(root).decide()[0]
+    CompactionPolicy(root).record("prune", freed)
+    assert CompactionPolicy(home).decide()[0]
+    assert not CompactionPolicy(other).decide()[0]
+    assert "prune last run" in nt.load(home.date_file)
+    assert "reclaimable space" not in nt.load(home.date_file)
+
+    # once compacted nothing is pending and the time is known to all
+    CompactionPolicy(home).compacted()
+    root_policy = CompactionPolicy(root)
+    assert not root_policy.decide()[0]
+    assert "compact last run" in root_policy.load()
+    assert "reclaimable space" not in root_policy.load()
+
+    # the freed space is unknown if borg did not report it
+    CompactionPolicy(root).record("delete", "")
+    assert CompactionPolicy(home).decide() == (True, "reclaimable space is unknown")
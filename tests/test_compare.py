@@ -0,0 +1,57 @@
+# Test Emborg Compare
+#
+# These tests exercise the parts of compare that do not need Borg Backup.
+
+# Imports {{{1
+import os
+from datetime import datetime
+import pytest
+from emborg import command
+from emborg.command import compare_status, to_microseconds
+
+
+# Utilities {{{1
+def archived_entry(path, mode=None):
+    # the attributes of path as Borg would report them in an archive
+    st = os.lstat(path)
+    mtime = datetime.fromtimestamp(st.st_mtime_ns // 10**9).replace(
+        microsecond = st.st_mtime_ns // 1000 % 10**6
+    )
+    mode = mode or ('-rw-r--r--' if os.path.isfile(path) else 'drwxr-xr-x')
+    return mode[0], mode, st.st_size, mtime.isoformat(), ''
+
+
+# Tests {{{1
+# compare_status() {{{2
+def test_compare_status_hard_link(tmp_path):
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    first.write_text("contents\n")
+    first.chmod(0o644)
+    os.link(first, second)
+    st = os.lstat(second)
+
+    # borg reports every hard link after the first with an h as the type
+    assert compare_status(archived_entry(first), st, second) == []
+    assert compare_status(archived_entry(second, 'hrw-r--r--'), st, second) == []
+    assert compare_status(archived_entry(second, 'hrwxr-xr-x'), st, second) == ['mode']
+    assert compare_status(archived_entry(second, 'drw-r--r--'), st, second) == ['type']
+
+
+# to_microseconds() {{{2
+@pytest.mark.parametrize("timestamp, expected", [
+    ("2024-03-01T12:34:56.789012+00:00", 1709296496789012),
+    ("2024-03-01T14:34:56.789012+02:00", 1709296496789012),
+    (
+        "2024-03-01T12:34:56.000001",
+        int(datetime(2024, 3, 1, 12, 34, 56).timestamp()) * 10**6 + 1
+    ),
+])
+def test_to_microseconds(timestamp, expected, monkeypatch):
+    assert to_microseconds(timestamp) == expected
+
+    # before python 3.7 datetime has no fromisoformat()
+    class before_37:
+        pass
+    monkeypatch.setattr(command, "datetime", before_37)
+    assert to_microseconds(timestamp) == expected
@@ -0,0 +1,127 @@
+# Test Emborg Contents
+#
+# These tests exercise the comparison of file contents without running Borg
+# Backup.
+
+# Imports {{{1
+from inform import Error
+import pytest
+from emborg import contents
+from emborg.contents import batch_files, compare_contents, hash_archived_files
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration, extracts files from an
+    # archive held as a dictionary, records the paths given to each process
+    def __init__(self, archive, block_size=3, extra=b""):
+        self.archive = archive
+        self.block_size = block_size
+        self.extra = extra
+        self.extracted = []
+
+    def destination(self, archive):
+        return f"/repos/backups::{archive}"
+
+    def stream_borg(self, cmd, args, emborg_opts, binary):
+        assert cmd == "extract" and args[:2] == ["--stdout", self.destination("a")]
+        paths = args[2:]
+        self.extracted.append(paths)
+        data = b"".join(self.archive[p] for p in paths) + self.extra
+        for i in range(0, len(data), self.block_size):
+            yield data[i:i + self.block_size]
+
+
+ARCHIVE = {
+    "home/a": b"first file",
+    "home/empty": b"",
+    "home/b": b"second file, a bit longer than the first",
+    "home/c": b"third",
+    "home/last": b"",
+}
+
+
+def files(archive=ARCHIVE):
+    return [(path, len(data)) for path, data in archive.items()]
+
+
+def digest(data):
+    digest = contents.new_hash()
+    digest.update(data)
+    return digest.digest()
+
+
+# Tests {{{1
+# batch_files() {{{2
+def test_batch_files_count(monkeypatch):
+    monkeypatch.setattr(contents, "MAX_BATCH_FILES", 2)
+    assert list(batch_files(files())) == [
+        [("home/a", 10), ("home/empty", 0)],
+        [("home/b", 40), ("home/c", 5)],
+        [("home/last", 0)],
+    ]
+
+
+def test_batch_files_bytes(monkeypatch):
+    monkeypatch.setattr(contents, "MAX_BATCH_BYTES", 15)
+    assert list(batch_files(files())) == [
+        [("home/a", 10), ("home/empty", 0)],
+        [("home/b", 40)],           # too large to share, but still extracted
+        [("home/c", 5), ("home/last", 0)],
+    ]
+
+
+def test_batch_files_args(monkeypatch):
+    # each path takes its length plus a separator
+    monkeypatch.setattr(contents, "MAX_BATCH_ARGS", 17)
+    assert list(batch_files(files())) == [
+        [("home/a", 10)],
+        [("home/empty", 0)],
+        [("home/b", 40), ("home/c", 5)],
+        [("home/last", 0)],
+    ]
+    assert list(batch_files([])) == []
+
+
+# hash_archived_files() {{{2
+@pytest.mark.parametrize("block_size", [1, 3, 7, 1000])
+def test_hash_archived_files(block_size):
+    # files are found in the output however it is split into blocks
+    settings = Settings(ARCHIVE, block_size)
+    digests = hash_archived_files(settings, "a", files())
+    assert digests == {
+        path: digest(data)
+        for path, data in ARCHIVE.items()
+    }
+
+
+def test_hash_archived_files_mismatch():
+    with pytest.raises(Error) as exception:
+        hash_archived_files(Settings(ARCHIVE, extra=b"?"), "a", files())
+    assert exception.value.culprit == ("a", "extract")
+    assert str(exception.value).endswith("more output than expected.")
+
+    short = dict(ARCHIVE, **{"home/c": b"3"})
+    with pytest.raises(Error) as exception:
+        hash_archived_files(Settings(short), "a", files())
+    assert str(exception.value).endswith("less output than expected.")
+
+
+# compare_contents() {{{2
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_compare_contents(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(contents, "MAX_BATCH_FILES", 2)
+    local = dict(ARCHIVE, **{"home/b": b"second file, a bit longer than the 1st"})
+    for path, data in local.items():
+        (tmp_path / path).parent.mkdir(exist_ok=True)
+        (tmp_path / path).write_bytes(data)
+    (tmp_path / "home/c").unlink()  # missing files are not reported here
+
+    settings = Settings(ARCHIVE)
+    different = compare_contents(
+        settings, "a", files(), lambda p: tmp_path / p, jobs
+    )
+    assert different == ["home/b"]
+    assert sorted(settings.extracted) == [
+        ["home/a", "home/empty"], ["home/b", "home/c"], ["home/last"]
+    ]
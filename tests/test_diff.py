@@ -0,0 +1,111 @@
+# Test Emborg Diff
+#
+# These tests exercise the parts of the diff command that do not need Borg
+# Backup.
+
+# Imports {{{1
+from emborg.command import DiffCommand
+
+
+# Utilities {{{1
+def added(path, size):
+    return dict(path=path, changes=[dict(type="added", size=size)])
+
+
+def removed(path, size):
+    return dict(path=path, changes=[dict(type="removed", size=size)])
+
+
+def modified(path, added, removed):
+    return dict(
+        path = path,
+        changes = [
+            dict(type="modified", added=added, removed=removed),
+            dict(type="mtime", old_mtime="", new_mtime=""),
+        ]
+    )
+
+
+DIFFS = [
+    added("home/ken/src/new.c", 1000),
+    removed("home/ken/src/old.c", 200),
+    modified("home/ken/src/main.c", 50, 30),
+    added("home/ken/src/lib/util.c", 4000),
+    modified("home/ken/notes", 3, 1),
+    dict(path="home/ken/doc", changes=[dict(type="added directory")]),
+]
+
+
+# Tests {{{1
+# report_differences() {{{2
+def test_diff_everything(capsys):
+    assert DiffCommand.report_differences(iter(DIFFS), "", False) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "added          1 kB home/ken/src/new.c",
+        "removed       200 B home/ken/src/old.c",
+        "modified            home/ken/src/main.c",
+        "added          4 kB home/ken/src/lib/util.c",
+        "modified            home/ken/notes",
+        "added directory     home/ken/doc",
+    ]
+
+
+def test_diff_path(capsys):
+    # without --recursive only the entries directly in the path are shown
+    diffs = iter(DIFFS[:4])
+    assert DiffCommand.report_differences(diffs, "home/ken/src", False) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "added          1 kB home/ken/src/new.c",
+        "removed       200 B home/ken/src/old.c",
+        "modified            home/ken/src/main.c",
+    ]
+
+    diffs = iter(DIFFS[:4])
+    assert DiffCommand.report_differences(diffs, "home/ken/src", True) == 1
+    assert len(capsys.readouterr().out.splitlines()) == 4
+
+
+def test_diff_all_filtered(capsys):
+    # nothing is shown, so no differences are reported
+    diffs = iter(DIFFS[3:4])
+    assert DiffCommand.report_differences(diffs, "home/ken/src", False) == 0
+    assert capsys.readouterr().out == ""
+
+
+def test_diff_none(capsys):
+    assert DiffCommand.report_differences(iter([]), "", False) == 0
+    assert capsys.readouterr().out == ""
+
+
+# report_summary() {{{2
+def test_diff_summary(capsys):
+    assert DiffCommand.report_summary(iter(DIFFS), "", 4, 20) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "   added  removed modified    +bytes    -bytes  directory",
+        "       1        0        0      4 kB       0 B  home/ken/src/lib",
+        "       1        1        1   1.05 kB     230 B  home/ken/src",
+        "       1        0        1       3 B       1 B  home/ken",
+    ]
+
+
+def test_diff_summary_depth(capsys):
+    # changes are attributed to the ancestor depth levels below the path
+    assert DiffCommand.report_summary(iter(DIFFS), "home", 1, 20) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "   added  removed modified    +bytes    -bytes  directory",
+        "       3        1        2   5.05 kB     231 B  home/ken",
+    ]
+
+
+def test_diff_summary_top(capsys):
+    assert DiffCommand.report_summary(iter(DIFFS), "", 4, 1) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1:] == [
+        "       1        0        0      4 kB       0 B  home/ken/src/lib",
+        "... and 2 more directories.",
+    ]
+
+
+def test_diff_summary_none(capsys):
+    assert DiffCommand.report_summary(iter([]), "", 2, 20) == 0
+    assert capsys.readouterr().out == ""
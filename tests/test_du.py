@@ -0,0 +1,84 @@
+# Test Emborg Du
+#
+# These tests exercise the parts of the du command that do not need Borg Backup.
+
+# Imports {{{1
+import pytest
+from inform import Error
+from emborg.command import directory_sizes
+
+
+# Utilities {{{1
+def listing(*entries):
+    # entries as listed by borg, given as 'path size' with a / suffix on
+    # directories
+    for each in entries:
+        path, size = each.split()
+        type = 'd' if path.endswith('/') else '-'
+        yield dict(path=path.rstrip('/'), type=type, size=int(size), dsize=1)
+
+
+ARCHIVE = [
+    "home/ 0",
+    "home/ken/ 0",
+    "home/ken/notes 10",
+    "home/ken/src/ 0",
+    "home/ken/src/main.c 200",
+    "home/ken/src/lib/ 0",
+    "home/ken/src/lib/util.c 3000",
+    "home/ken/empty/ 0",
+]
+
+
+# Tests {{{1
+# directory_sizes() {{{2
+def test_du_everything():
+    assert directory_sizes(listing(*ARCHIVE), '', ['size']) == {
+        '': [3210],
+        'home': [3210],
+        'home/ken': [3210],
+        'home/ken/src': [3200],
+        'home/ken/src/lib': [3000],
+        'home/ken/empty': [0],
+    }
+
+
+def test_du_path():
+    entries = listing(*ARCHIVE[3:7])
+    assert directory_sizes(entries, 'home/ken/src', ['size']) == {
+        'home/ken/src': [3200],
+        'home/ken/src/lib': [3000],
+    }
+
+
+@pytest.mark.parametrize("max_depth, expected", [
+    (0, {'home/ken': [3210]}),
+    (1, {'home/ken': [3210], 'home/ken/src': [3200], 'home/ken/empty': [0]}),
+])
+def test_du_max_depth(max_depth, expected):
+    entries = listing(*ARCHIVE[1:])
+    assert directory_sizes(entries, 'home/ken', ['size'], max_depth) == expected
+
+
+def test_du_file():
+    # a path that names a file reports the file itself
+    entries = listing("home/ken/notes 10")
+    assert directory_sizes(entries, 'home/ken/notes', ['size']) == {
+        'home/ken/notes': [10],
+    }
+    entries = listing("home/ken/notes 10")
+    assert directory_sizes(entries, 'home/ken/notes', ['size'], 0) == {
+        'home/ken/notes': [10],
+    }
+
+
+def test_du_fields():
+    entries = listing(*ARCHIVE[3:7])
+    assert directory_sizes(entries, 'home/ken/src', ['size', 'dsize'], 0) == {
+        'home/ken/src': [3200, 4],
+    }
+
+
+def test_du_missing_field():
+    with pytest.raises(Error):
+        directory_sizes(listing(*ARCHIVE), '', ['csize'])
@@ -350,3 +350,62 @@ def test_emborg_api(initialize):
                 e.report()
                 assert not e, str(e)
 
+
+# test_emborg_changes {{{2
+def test_emborg_changes(initialize_configs):
+    # diff takes the names of archives, which are not known in advance, so
+    # these are run here rather than from test-cases.nt
+    from emborg import Emborg
+
+    def emborg(*args, status=0):
+        cmd = emborg_exe + "--quiet --config test8".split() + list(args)
+        run = Run(cmd, "sOMW*")
+        assert run.status == status, run.stdout
+        return Color.strip_colors(run.stdout).splitlines()
+
+    def archives():
+        with Emborg('test8') as settings:
+            borg = settings.run_borg(
+                cmd = 'list',
+                args = ['--json', settings.destination()]
+            )
+        names = [a['archive'] for a in json.loads(borg.stdout)['archives']]
+        return [n for n in names if n.startswith('test8-')]
+
+    with cd(tests_dir):
+        added = to_path('configs/subdir/added')
+        try:
+            # the first backup with --if-changed is always made
+            before = archives()
+            added.write_text('x' * 1000)
+            emborg('create', '--if-changed')
+            after = archives()
+            assert len(after) == len(before) + 1
+
+            # but later ones only if something changed
+            emborg('create', '--if-changed')
+            assert archives() == after
+        except Error as e:
+            e.report()
+            assert not e, str(e)
+        finally:
+            rm(added)
+
+        # the added file is attributed to its directory, the files restored by
+        # earlier tests may also be reported as modified
+        older, newer = after[-2:]
+        summary = emborg('diff', '--summary', older, newer, status=1)
+        assert summary[0].split() == [
+            'added', 'removed', 'modified', '+bytes', '-bytes', 'directory'
+        ]
+        assert re.fullmatch(
+            r' +1 +0 +\d+ +1 ?kB +0 ?B +configs.symlink/subdir', summary[1]
+        ), summary[1]
+        assert emborg('diff', '--summary', newer, newer) == []
+
+        # every archive is within keep_within
+        simulated = emborg('prune', '--simulate')
+        assert simulated[-1] == (
+            f'{len(after)} archives would be kept, 0 archives would be pruned.'
+        )
+        assert simulated[0].startswith(f'{newer}  ')
@@ -0,0 +1,206 @@
+# Test Emborg Formatter
+#
+# These tests exercise the renderers used by the manifest command.
+
+# Imports {{{1
+import arrow
+import pytest
+from inform import Error
+from quantiphy import Quantity
+from emborg import formatter
+from emborg.formatter import ManifestFormatter, SizeRenderer, to_datetime
+
+
+# Utilities {{{1
+def entry(mode, **fields):
+    # an entry as listed by borg
+    values = dict(
+        path = "home/ken/notes.txt",
+        type = mode[0],
+        mode = mode,
+        user = "ken",
+        group = "staff",
+        uid = 1000,
+        gid = 100,
+        size = 123_456,
+        csize = 45_678,
+        dsize = 12_345,
+        dcsize = 4_567,
+        mtime = "2024-03-02T10:11:12.123456",
+        ctime = "2024-03-01T09:08:07.000000",
+        atime = "2024-03-02T23:59:59.999999",
+        isomtime = "2024-03-02T10:11:12.123456",
+        source = "",
+        linktarget = "",
+        num_chunks = 3,
+        unique_chunks = 2,
+        healthy = True,
+    )
+    values.update(fields)
+    return values
+
+
+ENTRIES = [
+    entry("-rw-r--r--"),
+    entry("drwxr-xr-x", path="home/ken", size=0, healthy=False),
+    entry("lrwxrwxrwx", source="notes.txt", linktarget="notes.txt", size=9),
+    entry("hrw-r--r--", source="home/ken/notes.txt"),
+    entry("prw-------", size=0),
+]
+
+
+def str_format(template, values):
+    # renders an entry as manifest did before it was compiled
+    values = dict(values)
+    values['health'] = 'healthy' if values['healthy'] else 'broken'
+    type = values['mode'][0]
+    values['Type'] = ''
+    values['extra'] = ''
+    if type == 'd':
+        values['Type'] = '/'
+    elif type == 'l':
+        values['Type'] = '@'
+        values['extra'] = ' —> ' + values['source']
+    elif type == 'h':
+        values['extra'] = ' links to ' + values['source']
+    elif type == 'p':
+        values['Type'] = '|'
+    for name, key in [('MTime', 'mtime'), ('CTime', 'ctime'), ('ATime', 'atime')]:
+        if key in values and name in template:
+            values[name] = arrow.get(values[key])
+    for name, key in [
+        ('Size', 'size'), ('CSize', 'csize'), ('DSize', 'dsize'), ('DCSize', 'dcsize')
+    ]:
+        if key in values and '{' + name in template:
+            values[name] = Quantity(values[key], "B")
+    return template.format(**values)
+
+
+def formatted(template, values):
+    formatter = ManifestFormatter(template, str, str)
+    return formatter.render(values)
+
+
+# Tests {{{1
+# SizeRenderer {{{2
+SIZES = [
+    0, 1, 9, 10, 99, 999, 1000, 1001, 1049, 1050, 1234, 9999, 99_949, 99_950,
+    999_499, 999_500, 999_999, 10**6, 123_456_789, 2**40, 10**24, 10**27,
+]
+SPECS = ["", "8", ">8", "<9", "^10", ".0", ".1", "7.2", "<6.3", "12.5", "s", ".2q"]
+
+
+@pytest.mark.parametrize("prefs", [
+    dict(),
+    dict(spacer=""),
+    dict(prec=2),
+    dict(strip_zeros=False),
+    dict(strip_radix=False),
+    dict(strip_zeros=False, strip_radix=False),
+    dict(output_sf="kM"),
+    dict(unity_sf="_"),
+])
+def test_size_renderer(prefs):
+    with Quantity.prefs(**prefs):
+        for spec in SPECS:
+            render = SizeRenderer(spec)
+            for size in SIZES:
+                assert render(size) == format(Quantity(size, 'B'), spec), (spec, size)
+
+
+# to_datetime() {{{2
+@pytest.mark.parametrize("timestamp", [
+    "2024-03-01T12:34:56.789012",
+    "2024-03-01T12:34:56+02:00",
+    "2024-03-01T12:34:56Z",
+])
+def test_to_datetime(timestamp, monkeypatch):
+    expected = arrow.get(timestamp).datetime
+    to_datetime.cache_clear()
+    assert to_datetime(timestamp) == expected
+
+    # before python 3.7 datetime has no fromisoformat()
+    class datetime:
+        pass
+    monkeypatch.setattr(formatter, "datetime", datetime)
+    to_datetime.cache_clear()
+    assert to_datetime(timestamp) == expected
+    to_datetime.cache_clear()
+
+
+# ManifestFormatter {{{2
+TEXT_SPECS = ["", "<12", ">12", "^12", ".3"]
+INT_SPECS = ["", "8", "<8", ",", "08x"]
+TIME_SPECS = ["", "YYYY-MM-DD", "YYYY-MM-DD HH:mm:ss ZZ", "MMM D"]
+SIZE_SPECS = ["", "8", "<6.2", "0.2s", ".3q", "r"]
+FIELDS = dict(
+    path = TEXT_SPECS,
+    type = TEXT_SPECS,
+    mode = TEXT_SPECS,
+    user = TEXT_SPECS,
+    group = TEXT_SPECS,
+    uid = INT_SPECS,
+    gid = INT_SPECS,
+    size = INT_SPECS,
+    csize = INT_SPECS,
+    dsize = INT_SPECS,
+    dcsize = INT_SPECS,
+    mtime = TEXT_SPECS,
+    ctime = TEXT_SPECS,
+    atime = TEXT_SPECS,
+    isomtime = TEXT_SPECS,
+    source = TEXT_SPECS,
+    linktarget = TEXT_SPECS,
+    num_chunks = INT_SPECS,
+    unique_chunks = INT_SPECS,
+    healthy = ["", "d", "<6"],
+    Type = TEXT_SPECS,
+    extra = TEXT_SPECS,
+    health = TEXT_SPECS,
+    MTime = TIME_SPECS,
+    CTime = TIME_SPECS,
+    ATime = TIME_SPECS,
+    Size = SIZE_SPECS,
+    CSize = SIZE_SPECS,
+    DSize = SIZE_SPECS,
+    DCSize = SIZE_SPECS,
+)
+
+
+@pytest.mark.parametrize("field", FIELDS)
+def test_manifest_formatter_fields(field):
+    with Quantity.prefs(spacer=""):
+        for values in ENTRIES:
+            for spec in FIELDS[field]:
+                template = f"<{{{field}:{spec}}}>" if spec else f"<{{{field}}}>"
+                assert formatted(template, values) == str_format(template, values)
+
+
+@pytest.mark.parametrize("template", [
+    "{path}",
+    "{path}{Type}",
+    "{mtime} {path}{Type}",
+    "{size:8} {path}{Type}",
+    "{Size:6.2} {path}{Type}",
+    "{user:8} {path}{Type}",
+    "{mode:10} {user:6} {group:6} {size:8} {mtime} {path}{extra}",
+    "{health:>8} {MTime:YYYY-MM-DD} {CTime} {ATime:HH:mm} {DCSize:.1} {path!r}",
+    "{{literal}} \\ \" {path.upper} {mode[0]} {path!s:>30} {Size.real}",
+    "",
+])
+def test_manifest_formatter_templates(template):
+    with Quantity.prefs(spacer=""):
+        for values in ENTRIES:
+            assert formatted(template, values) == str_format(template, values)
+
+
+def test_manifest_formatter_colors():
+    formatter = ManifestFormatter("{path}", "<{}>".format, "[{}]".format)
+    assert formatter.render(ENTRIES[0]) == "<home/ken/notes.txt>"
+    assert formatter.render(ENTRIES[1]) == "[home/ken]"
+
+
+@pytest.mark.parametrize("template", ["{color}", "{size:q}", "{path:{size}}"])
+def test_manifest_formatter_errors(template):
+    with pytest.raises(Error):
+        formatted(template, ENTRIES[0])
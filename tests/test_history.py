@@ -0,0 +1,96 @@
+# Test Emborg History
+#
+# These tests exercise how history groups the versions of a file without
+# running Borg Backup.
+
+# Imports {{{1
+from inform import Error
+import pytest
+from emborg import command
+from emborg.command import HistoryCommand
+
+
+# Utilities {{{1
+def version(size, day, mode="-rw-r--r--"):
+    return dict(mode=mode, size=size, mtime=f"2026-10-{day:02}T12:00:00.000000")
+
+
+# the contents of each archive, oldest first
+ARCHIVES = dict(
+    a1 = {"home/f": version(100, 1)},
+    a2 = {"home/f": version(100, 1)},
+    a3 = {"home/f": version(200, 3), "home/f/g": version(10, 3)},
+    a4 = {},
+    a5 = {"home/f": version(200, 3)},
+    a6 = {"home/f": version(100, 1)},
+)
+
+
+@pytest.fixture
+def history(monkeypatch, capsys):
+    # runs history against the archives above, returns what it prints
+    def list_archive(settings, archive, keys, paths, emborg_opts):
+        entries = [
+            dict(path=path, **attributes)
+            for path, attributes in ARCHIVES[archive].items()
+            if any(path == p or path.startswith(p + "/") for p in paths)
+        ]
+        return entries, None
+
+    monkeypatch.setattr(command, "get_archive_path", lambda path, s: path)
+    monkeypatch.setattr(
+        command, "get_available_archives",
+        lambda settings: [dict(name=name) for name in ARCHIVES]
+    )
+    monkeypatch.setattr(
+        command, "get_name_of_nearest_archive", lambda settings, date: date
+    )
+    monkeypatch.setattr(command, "list_archive", list_archive)
+
+    def run(*args):
+        HistoryCommand.run("history", list(args), None, [])
+        return capsys.readouterr().out.splitlines()
+    return run
+
+
+# Tests {{{1
+# runs {{{2
+def test_history_runs(history):
+    # a version that returns after a change starts a new run
+    assert history("home/f") == [
+        "home/f:",
+        "    2026-10-01 12:00:00     100 B  a1 – a2",
+        "    2026-10-03 12:00:00     200 B  a3",
+        "    absent                         a4",
+        "    2026-10-03 12:00:00     200 B  a5",
+        "    2026-10-01 12:00:00     100 B  a6",
+    ]
+
+
+def test_history_recursive(history):
+    assert history("--recursive", "home/f")[6:] == [
+        "home/f/g:",
+        "    absent                         a1 – a2",
+        "    2026-10-03 12:00:00      10 B  a3",
+        "    absent                         a4 – a6",
+    ]
+    assert "home/f/g:" not in history("home/f")
+
+
+def test_history_range(history):
+    assert history("--since", "a2", "--until", "a3", "home/f") == [
+        "home/f:",
+        "    2026-10-01 12:00:00     100 B  a2",
+        "    2026-10-03 12:00:00     200 B  a3",
+    ]
+
+
+# errors {{{2
+def test_history_errors(history):
+    with pytest.raises(Error) as exception:
+        history("home/missing")
+    assert str(exception.value) == "home/missing: not found in any archive."
+
+    with pytest.raises(Error) as exception:
+        history("--jobs", "0", "home/f")
+    assert str(exception.value) == "--jobs: expected a positive integer."
@@ -0,0 +1,176 @@
+# Test Emborg Journal
+#
+# These tests exercise the journal of changes kept by emborg watch.
+
+# Imports {{{1
+import fcntl
+import arrow
+from inform import Error
+import pytest
+from emborg import journal
+from emborg.journal import ChangeJournal, Watcher, collapse
+
+inotify_simple = pytest.importorskip("inotify_simple")
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, data_dir, working_dir, **settings):
+        self.data_dir = data_dir
+        self.working_dir = working_dir
+        self.repository = "/repos/backups"
+        self.roots = ["."]
+        self.settings = settings
+
+    def value(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def values(self, name):
+        return self.settings.get(name, [])
+
+    def as_paths(self, name, must_exist=False):
+        return []
+
+    def resolve(self, name, value):
+        return value.format(config_name="test")
+
+    def resolve_patterns(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def settings(tmp_path):
+    home = tmp_path / "home"
+    (home / "src").mkdir(parents=True)
+    data = tmp_path / "data"
+    data.mkdir()
+    return Settings(data, home, excludes=["*.o"])
+
+
+@pytest.fixture
+def lock(settings):
+    # pretends a watcher is running
+    with open(ChangeJournal(settings).lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield f
+
+
+def events(watcher):
+    # handle the events that have occurred
+    now = arrow.now().timestamp()
+    for event in watcher.inotify.read(timeout=1000):
+        watcher.handle(event, now)
+    return now
+
+
+# Tests {{{1
+# collapse() {{{2
+def test_collapse():
+    assert collapse(["a/b", "a", "ab", "a/c/d", "b/c"]) == ["a", "ab", "b/c"]
+    assert collapse(["src", "."]) == ["."]
+    assert collapse([]) == []
+
+
+# changes_since() {{{2
+def test_journal_unwatched(settings):
+    # the journal is only trusted while the watcher holds its lock
+    watcher = Watcher(settings)
+    watcher.flush(0)
+    assert ChangeJournal(settings).changes_since(arrow.now()) is None
+
+
+def test_journal_changes(settings, lock):
+    changes = ChangeJournal(settings)
+    watcher = Watcher(settings)
+    watcher.dirty = {"src": 200, "src/a": 300, "doc": 100}
+    watcher.flush(50)
+    assert changes.changes_since(arrow.get(150)) == ["src"]
+    assert changes.changes_since(arrow.get(400)) == []
+    assert changes.changes_since(None) is None
+
+    # a watcher started after the backup may have missed changes
+    assert changes.changes_since(arrow.get(40)) is None
+
+    # as may one whose queue overflowed
+    watcher.overflowed = 250
+    watcher.flush(50)
+    assert changes.changes_since(arrow.get(150)) is None
+    assert changes.changes_since(arrow.get(260)) == ["src/a"]
+
+    # and the journal says nothing about files selected differently
+    settings.settings["excludes"] = []
+    assert changes.changes_since(arrow.get(260)) is None
+
+
+# Watcher.run() {{{2
+def test_watcher_locked(settings, lock):
+    with pytest.raises(Error) as exception:
+        Watcher(settings).run()
+    assert str(exception.value).endswith("already being watched.")
+
+
+# Watcher.handle() {{{2
+def test_watcher_events(settings):
+    watcher = Watcher(settings)
+    watcher.add_tree(".")
+    home = settings.working_dir
+
+    # excluded files are ignored
+    (home / "src/main.o").write_text("")
+    events(watcher)
+    assert watcher.dirty == {}
+
+    (home / "src/main.c").write_text("")
+    now = events(watcher)
+    assert watcher.dirty == {"src": now}
+    assert watcher.urgent
+
+    # new directories are watched as they appear
+    watcher.dirty = {}
+    (home / "doc").mkdir()
+    events(watcher)
+    assert watcher.dirty.keys() == {"."}
+    (home / "doc/notes").write_text("")
+    events(watcher)
+    assert watcher.dirty.keys() == {".", "doc"}
+
+
+def test_watcher_overflow(settings, monkeypatch):
+    monkeypatch.setattr(journal, "MAX_DIRTY", 2)
+    watcher = Watcher(settings)
+    watcher.mark("a", 10)
+    watcher.mark("b", 20)
+    assert watcher.overflowed is None
+
+    # too many directories to track
+    watcher.mark("c", 30)
+    assert watcher.overflowed == 30
+    assert watcher.dirty == {}
+
+    # too many events for the kernel to queue
+    overflow = inotify_simple.Event(-1, inotify_simple.flags.Q_OVERFLOW, 0, "")
+    watcher.urgent = False
+    watcher.handle(overflow, 40)
+    assert watcher.overflowed == 40
+    assert watcher.urgent
+
+
+def test_watcher_refresh(settings):
+    # changes from before the last backup are forgotten
+    watcher = Watcher(settings)
+    watcher.dirty = {"a": 10, "b": 30}
+    watcher.snapshot.path.write_text(
+        '{"started": "%s"}' % arrow.get(20).isoformat()
+    )
+    watcher.refresh()
+    assert watcher.last_backup == 20
+    assert watcher.dirty == {"b": 30}
+
+    # and a directory changed again after the backup is written at once
+    watcher.urgent = False
+    watcher.mark("a", 40)
+    assert watcher.urgent
+    watcher.urgent = False
+    watcher.mark("b", 40)
+    assert not watcher.urgent
@@ -0,0 +1,163 @@
+# Test Emborg Manifests
+#
+# These tests exercise the local copies of the file listings of archives.
+
+# Imports {{{1
+import os
+import pytest
+from inform import Error
+from emborg.manifests import ManifestCache, format_fields, MANIFESTS_DIR
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, data_dir, repository="/repos/backups", size="1MiB"):
+        self.data_dir = data_dir
+        self.repository = repository
+        self.size = size
+
+    def value(self, name, default=None):
+        assert name == "manifest_cache_size"
+        return self.size
+
+
+def entry(n, **kwargs):
+    entry = dict(
+        path = f"home/user/file{n}",
+        type = "-",
+        mode = "-rw-r--r--",
+        user = "user",
+        group = "user",
+        uid = 1000,
+        gid = 1000,
+        healthy = True,
+        source = "",
+        size = n * 1000,
+        mtime = "2026-10-17T00:00:00.000000",
+        ctime = "2026-10-17T00:00:00.000000",
+        atime = "2026-10-17T00:00:00.000000",
+    )
+    entry.update(kwargs)
+    return entry
+
+
+ENTRIES = [entry(n) for n in range(100)]
+
+
+def fill(cache, archive_id, entries=ENTRIES):
+    return list(cache.fill(archive_id, f"archive-{archive_id}", entries))
+
+
+def listings(cache):
+    return sorted(p.stem for p in cache.root.glob("*/*.manifest"))
+
+
+# Tests {{{1
+# format_fields() {{{2
+def test_format_fields():
+    fields = format_fields("{mode} {size:8} {path}{NL}")
+    assert fields == {"mode", "size", "path", "NL"}
+    assert format_fields("{mtime.year}{extra[0]}") == {"mtime", "extra"}
+    assert format_fields("no fields") == set()
+
+
+# size_limit() {{{2
+def test_manifests_size(tmp_path):
+    assert ManifestCache(Settings(tmp_path, size="1MiB")).limit == 2**20
+    assert ManifestCache(Settings(tmp_path, size="1 kB")).limit == 1000
+    assert not ManifestCache(Settings(tmp_path, size=None)).enabled
+    assert not ManifestCache(Settings(tmp_path, size="")).enabled
+    with pytest.raises(Error) as exception:
+        ManifestCache(Settings(tmp_path, size="lots"))
+    assert exception.value.culprit == ("manifest_cache_size",)
+
+
+# usable() {{{2
+def test_manifests_usable(tmp_path):
+    cache = ManifestCache(Settings(tmp_path))
+    assert cache.usable({"path", "size", "mtime"})
+    assert not cache.usable({"path", "health"})
+    assert not ManifestCache(Settings(tmp_path, size=None)).usable({"path"})
+
+
+# fill() and read() {{{2
+def test_manifests_round_trip(tmp_path):
+    cache = ManifestCache(Settings(tmp_path))
+    assert cache.read("A") is None
+    assert fill(cache, "A") == ENTRIES
+    assert listings(cache) == ["A"]
+
+    # basic fields are always returned, others only when requested
+    basic = "path type mode user group uid gid healthy source".split()
+    entries = list(cache.read("A"))
+    assert entries == [{k: e[k] for k in basic} for e in ENTRIES]
+    entries = list(cache.read("A", {"size", "mtime"}))
+    assert entries == [
+        {k: e[k] for k in basic + ["size", "mtime"]} for e in ENTRIES
+    ]
+
+    # listings are kept per repository
+    other = ManifestCache(Settings(tmp_path, repository="host:backups"))
+    assert other.read("A") is None
+
+
+def test_manifests_large(tmp_path):
+    # columns that span several compressed blocks
+    cache = ManifestCache(Settings(tmp_path, size="100MiB"))
+    entries = [
+        entry(n, path=f"home/user/{n:06d}/" + "x" * (n % 50))
+        for n in range(50_000)
+    ]
+    fill(cache, "A", entries)
+    assert [(e["path"], e["size"]) for e in cache.read("A", {"size"})] == [
+        (e["path"], e["size"]) for e in entries
+    ]
+
+
+def test_manifests_unexpected(tmp_path):
+    cache = ManifestCache(Settings(tmp_path))
+
+    # entries missing a field or with the wrong type are passed on uncached
+    entries = ENTRIES[:10] + [entry(10, uid="root")]
+    assert fill(cache, "A", entries) == entries
+    entries = ENTRIES[:10] + [{"path": "home/user/file10"}]
+    assert fill(cache, "A", entries) == entries
+    assert listings(cache) == []
+
+    # nor are listings that are not consumed completely
+    generator = cache.fill("A", "archive-A", ENTRIES)
+    next(generator)
+    generator.close()
+    assert listings(cache) == []
+
+
+def test_manifests_corrupt(tmp_path):
+    cache = ManifestCache(Settings(tmp_path))
+    fill(cache, "A")
+    path = cache.path("A")
+    path.write_bytes(b"something else\n")
+    assert cache.read("A") is None
+    assert not path.exists()
+
+
+# trim() {{{2
+def test_manifests_trim(tmp_path):
+    cache = ManifestCache(Settings(tmp_path))
+    other = ManifestCache(Settings(tmp_path, repository="host:backups"))
+    for n, archive_id in enumerate("ABC"):
+        fill(cache, archive_id)
+        os.utime(cache.path(archive_id), (n, n))
+    fill(other, "D")
+    os.utime(other.path("D"), (3, 3))
+    size = cache.path("A").stat().st_size
+    assert listings(cache) == ["A", "B", "C", "D"]
+
+    # reading a listing marks it as recently used
+    cache.read("A")
+
+    # the least recently used listings are dropped, whatever the repository
+    cache.limit = 2.5 * size
+    cache.trim()
+    assert listings(cache) == ["A", "D"]
+    assert (tmp_path / MANIFESTS_DIR).is_dir()
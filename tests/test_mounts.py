@@ -0,0 +1,69 @@
+# Test Emborg Mount Sessions
+#
+# These tests exercise the bookkeeping of archives left mounted, without
+# mounting anything.
+
+# Imports {{{1
+import json
+from emborg.mounts import MountSessions
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, data_dir, repository, **settings):
+        self.data_dir = data_dir
+        self.repository = repository
+        self.settings = settings
+        self.commands = []
+
+    def value(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def repository_sharers(self):
+        raise AssertionError("other configurations should not be read")
+
+    def run_borg(self, cmd, args=(), **kwargs):
+        self.commands.append([cmd] + [str(a) for a in args])
+
+
+# Tests {{{1
+# MountSessions() {{{2
+def test_mounts_shared_by_repository(tmp_path):
+    home = MountSessions(Settings(tmp_path, "/repos/backups"))
+    root = MountSessions(Settings(tmp_path, "file:///repos//backups/"))
+    other = MountSessions(Settings(tmp_path, "backups:repos/backups"))
+    assert home.path == root.path
+    assert home.path != other.path
+    assert home.path.parent == tmp_path
+
+
+# before() {{{2
+def test_mounts_before_without_sessions(tmp_path):
+    # nothing is read unless a session was left by a config of the repository
+    settings = Settings(tmp_path, "/repos/backups")
+    MountSessions.before(settings, "create")
+    assert settings.commands == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_mounts_before_reaps_sessions(tmp_path):
+    # sessions left by another config are reaped, stale ones are discarded
+    mounted = tmp_path / "mnt"
+    left = Settings(tmp_path, "/repos/backups", mount_idle_timeout="1h")
+    sessions = MountSessions(left)
+    sessions.save({
+        str(mounted): dict(archive="", last_used="2026-10-17", timeout=3600)
+    })
+
+    settings = Settings(tmp_path, "/repos/backups")
+    MountSessions.before(settings, "list")
+    assert not sessions.path.exists()
+    assert settings.commands == []
+
+
+def test_mounts_before_mount(tmp_path):
+    sessions = MountSessions(Settings(tmp_path, "/repos/backups"))
+    sessions.path.write_text(json.dumps({"/mnt": dict(archive="")}))
+    MountSessions.before(Settings(tmp_path, "/repos/backups"), "mount")
+    assert sessions.path.exists()
@@ -0,0 +1,135 @@
+# Test Emborg Progress
+#
+# These tests exercise the parsing of the JSON messages Borg writes to its
+# standard error when run with --log-json and --progress.
+
+# Imports {{{1
+import json
+import nestedtext as nt
+import pytest
+from emborg import progress
+from emborg.progress import ProgressMonitor
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, data_dir, **latest):
+        self.data_dir = data_dir
+        self.date_file = data_dir / "test.latest.nt"
+        if latest:
+            nt.dump(latest, self.date_file)
+
+    def resolve(self, name, value):
+        return value.format(config_name="test")
+
+
+def message(type, **fields):
+    # a line of the standard error of borg
+    return json.dumps(dict(type=type, **fields)) + "\n"
+
+
+class Clock:
+    # stands in for time.monotonic()
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(progress.time, "monotonic", clock)
+    return clock
+
+
+# Tests {{{1
+# ProgressMonitor.update() {{{2
+def test_progress_messages(tmp_path):
+    # log messages and listed files are kept as text, progress is consumed
+    monitor = ProgressMonitor(Settings(tmp_path), "create")
+    assert monitor.update("not json\n") == "not json\n"
+    assert monitor.update(message(
+        "log_message", levelname="INFO", message="Creating archive"
+    )) == "Creating archive\n"
+    assert monitor.update(message(
+        "file_status", status="A", path="home/ken/notes"
+    )) == "A home/ken/notes\n"
+    assert monitor.update(message(
+        "archive_progress", nfiles=1, original_size=100, compressed_size=50,
+        deduplicated_size=25, path="home/ken/notes",
+    )) is None
+    assert monitor.update(message("question_prompt", message="Continue?")) is None
+
+    progress = monitor.progress
+    assert (progress.files, progress.bytes) == (1, 100)
+    assert (progress.compressed, progress.deduplicated) == (50, 25)
+    assert progress.path == "home/ken/notes"
+
+
+def test_progress_statuses(tmp_path):
+    # the status of each file is counted even if it is not listed
+    monitor = ProgressMonitor(Settings(tmp_path), "create", listing=False)
+    for status in "AAUMU-":
+        assert monitor.update(message("file_status", status=status, path="p")) is None
+    assert monitor.statuses == dict(A=2, U=2, M=1, **{"-": 1})
+
+
+def test_progress_finished(tmp_path):
+    # the final message does not reset the progress
+    monitor = ProgressMonitor(Settings(tmp_path), "create")
+    monitor.update(message("archive_progress", nfiles=3, original_size=300))
+    monitor.update(message("archive_progress", finished=True))
+    assert (monitor.progress.files, monitor.progress.bytes) == (3, 300)
+
+
+def test_progress_percent(tmp_path, clock):
+    reported = []
+    monitor = ProgressMonitor(Settings(tmp_path), "check", callback=reported.append)
+    monitor.update(message(
+        "progress_percent", current=10, total=110, message="Checking segments"
+    ))
+    clock.now += 10
+    monitor.update(message(
+        "progress_percent", current=20, total=110, message="Checking segments"
+    ))
+    progress = monitor.progress
+    assert (progress.current, progress.total) == (20, 110)
+    assert progress.rate == 1
+    assert progress.eta == 90
+    assert progress.elapsed == 10
+    assert len(reported) == 2
+    assert "18.2%" in progress.render()
+
+    monitor.update(message("progress_message", message="Compacting segments"))
+    assert progress.message == "Compacting segments"
+
+
+def test_progress_expected(tmp_path, clock):
+    # the size of the archive is estimated from the previous one
+    settings = Settings(
+        tmp_path, **{"create stats": {"original size": "1 kB"}}
+    )
+    monitor = ProgressMonitor(settings, "create")
+    assert monitor.expected == 1000
+    monitor.update(message("archive_progress", original_size=0))
+    clock.now += 2
+    monitor.update(message("archive_progress", original_size=200))
+    assert monitor.progress.rate == 100
+    assert monitor.progress.eta == 8
+
+
+# ProgressMonitor.write() {{{2
+def test_progress_status_file(tmp_path):
+    monitor = ProgressMonitor(Settings(tmp_path), "create")
+    monitor.update(message("archive_progress", nfiles=2, original_size=10))
+    status = json.loads((tmp_path / "test.progress.json").read_text())
+    assert status["command"] == "create"
+    assert status["files"] == 2
+    assert not status["finished"]
+
+    monitor.finish()
+    assert monitor.progress.finished
+    assert not (tmp_path / "test.progress.json").exists()
@@ -0,0 +1,102 @@
+# Test Emborg Pruning
+#
+# These tests exercise the local simulation of Borg's prune rules.
+
+# Imports {{{1
+import arrow
+from emborg.pruning import simulate_prune
+
+
+# Utilities {{{1
+def archives(*days, checkpoints=()):
+    # archives as given by borg list --json, one per day at 10am
+    return [
+        dict(
+            name = f"home-{day}" + (".checkpoint" if day in checkpoints else ""),
+            time = f"{day}T10:00:00.000000",
+        )
+        for day in days
+    ]
+
+
+def fates(archives, rules, now=None):
+    return [
+        (archive["name"], reason and reason.partition("rule: ")[2].rstrip(")"))
+        for archive, reason in simulate_prune(archives, rules, now)
+    ]
+
+
+# Tests {{{1
+# simulate_prune() {{{2
+def test_prune_daily():
+    days = [f"2024-01-{d:02}" for d in range(1, 8)]
+    assert fates(archives(*days), dict(daily=3)) == [
+        ("home-2024-01-07", "daily #1"),
+        ("home-2024-01-06", "daily #2"),
+        ("home-2024-01-05", "daily #3"),
+        ("home-2024-01-04", None),
+        ("home-2024-01-03", None),
+        ("home-2024-01-02", None),
+        ("home-2024-01-01", None),
+    ]
+
+
+def test_prune_keeps_newest_of_each_period():
+    # two archives on one day, only the later is kept by the daily rule
+    found = archives("2024-01-02", "2024-01-01")
+    found.append(dict(name="home-early", time="2024-01-02T08:00:00"))
+    assert fates(found, dict(daily=5)) == [
+        ("home-2024-01-02", "daily #1"),
+        ("home-early", None),
+        ("home-2024-01-01", "daily #2"),
+    ]
+
+
+def test_prune_rules_combine():
+    # rules are applied in order, later rules skip archives already kept
+    days = ["2024-03-02", "2024-03-01", "2024-02-15", "2024-02-01", "2024-01-10"]
+    assert fates(archives(*days), dict(daily=1, monthly=2)) == [
+        ("home-2024-03-02", "daily #1"),
+        ("home-2024-03-01", None),
+        ("home-2024-02-15", "monthly #1"),
+        ("home-2024-02-01", None),
+        ("home-2024-01-10", "monthly #2"),
+    ]
+
+
+def test_prune_oldest_kept_when_short():
+    days = ["2024-03-02", "2024-02-01", "2024-01-10"]
+    assert fates(archives(*days), dict(monthly=5)) == [
+        ("home-2024-03-02", "monthly #1"),
+        ("home-2024-02-01", "monthly #2"),
+        ("home-2024-01-10", "monthly #3"),
+    ]
+    assert fates(archives(*days), dict(yearly=3)) == [
+        ("home-2024-03-02", "yearly #1"),
+        ("home-2024-02-01", None),
+        ("home-2024-01-10", "yearly[oldest] #2"),
+    ]
+
+
+def test_prune_within():
+    days = ["2024-01-05", "2024-01-04", "2024-01-03", "2024-01-01"]
+    now = arrow.get("2024-01-05T12:00:00", tzinfo="local")
+    assert fates(archives(*days), dict(within=2*24*3600), now) == [
+        ("home-2024-01-05", "within #1"),
+        ("home-2024-01-04", "within #2"),
+        ("home-2024-01-03", None),
+        ("home-2024-01-01", None),
+    ]
+
+
+def test_prune_checkpoints():
+    # only the latest checkpoint is kept, and only if newer than the latest
+    # archive; checkpoints are not counted by the rules
+    days = ["2024-01-04", "2024-01-03", "2024-01-02", "2024-01-01"]
+    found = archives(*days, checkpoints=["2024-01-04", "2024-01-02"])
+    assert fates(found, dict(daily=1)) == [
+        ("home-2024-01-04.checkpoint", ""),
+        ("home-2024-01-03", "daily #1"),
+        ("home-2024-01-02.checkpoint", None),
+        ("home-2024-01-01", None),
+    ]
@@ -0,0 +1,92 @@
+# Test Emborg Sorting
+#
+# These tests exercise the sorting of manifest listings in bounded memory.
+
+# Imports {{{1
+import random
+import tempfile
+import pytest
+from inform import Error
+from emborg import sorting
+from emborg.sorting import sort_entries, top_entries
+
+
+# Utilities {{{1
+def manifest(count, seed=0):
+    # a listing with many duplicate sizes so that stability matters
+    rand = random.Random(seed)
+    return [
+        dict(path=f"dir{i % 7}/file{i}", size=rand.randrange(20), user="ken")
+        for i in range(count)
+    ]
+
+
+# Tests {{{1
+# sort_entries() {{{2
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("key", ["size", "path", None])
+def test_sort_entries_in_memory(key, reverse):
+    entries = manifest(200)
+    expected = sorted(entries, key=lambda e: e[key]) if key else list(entries)
+    if reverse:
+        expected.reverse()
+    assert list(sort_entries(iter(entries), key, reverse, 1e9)) == expected
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_sort_entries_spilled(monkeypatch, reverse):
+    # little memory forces many runs, a small fan in forces several merges
+    monkeypatch.setattr(sorting, "SAMPLE_SIZE", 10)
+    monkeypatch.setattr(sorting, "MAX_FAN_IN", 3)
+    entries = manifest(2000)
+    expected = sorted(entries, key=lambda e: e["size"])
+    if reverse:
+        expected.reverse()
+    assert list(sort_entries(iter(entries), "size", reverse, 5000)) == expected
+
+
+def test_sort_entries_spill_directory(monkeypatch, tmp_path):
+    # runs are spilled to the given directory
+    directories = []
+
+    def temporary_file(dir=None):
+        directories.append(dir)
+        return make_temporary_file(dir=dir)
+    make_temporary_file = tempfile.TemporaryFile
+    monkeypatch.setattr(sorting.tempfile, "TemporaryFile", temporary_file)
+    monkeypatch.setattr(sorting, "SAMPLE_SIZE", 10)
+    monkeypatch.setattr(sorting, "MAX_FAN_IN", 3)
+    entries = manifest(500)
+    expected = sorted(entries, key=lambda e: e["size"])
+    assert list(sort_entries(iter(entries), "size", False, 5000, tmp_path)) == expected
+    assert len(directories) > 3
+    assert set(directories) == {tmp_path}
+
+
+def test_sort_entries_unexpected_fields():
+    entries = manifest(10)
+    entries[3] = dict(path="odd", size=4)
+    expected = sorted(entries, key=lambda e: e["size"])
+    assert list(sort_entries(iter(entries), "size", False, 1e9)) == expected
+
+
+def test_sort_entries_unknown_key():
+    with pytest.raises(Error):
+        list(sort_entries(iter(manifest(10)), "color", False, 1e9))
+
+
+# top_entries() {{{2
+@pytest.mark.parametrize("count", [1, 5, 50, 500])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_top_entries(count, reverse):
+    # same as the last entries of a stable sort
+    entries = manifest(300)
+    expected = sorted(entries, key=lambda e: e["size"])[-count:]
+    if reverse:
+        expected.reverse()
+    assert top_entries(iter(entries), "size", count, reverse) == expected
+
+
+def test_top_entries_unknown_key():
+    with pytest.raises(Error):
+        top_entries(iter(manifest(10)), "color", 3, False)
@@ -0,0 +1,149 @@
+# Test Emborg Walker
+#
+# These tests exercise the local walk over the files that would be backed up.
+
+# Imports {{{1
+import os
+import stat
+import pytest
+from inform import Error
+from emborg.walker import CACHEDIR_SIGNATURE, Walker
+
+
+# Utilities {{{1
+class Settings:
+    # stands in for the settings of a configuration
+    def __init__(self, **settings):
+        self.settings = settings
+
+    def value(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def values(self, name):
+        return self.settings.get(name, [])
+
+    def as_paths(self, name, must_exist=False):
+        return []
+
+    @property
+    def working_dir(self):
+        return self.settings["working_dir"]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    # a directory tree to back up
+    files = """
+        notes.txt
+        notes.txt~
+        build/main.o
+        build/main.c
+        src/main.c
+        src/main.o
+        src/keep.o
+        cache/data
+        private/secret
+        private/.nobackup
+        tagged/data
+        tagged/CACHEDIR.TAG
+        untagged/CACHEDIR.TAG
+    """.split()
+    for name in files:
+        path = tmp_path / "home" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+    (tmp_path / "home/tagged/CACHEDIR.TAG").write_bytes(CACHEDIR_SIGNATURE)
+    return tmp_path / "home"
+
+
+def walk(root, **settings):
+    # the files under root that would be backed up, relative to root
+    walker = Walker(Settings(working_dir="/", **settings))
+    found = []
+    for path, st in walker.walk([root]):
+        path = os.path.join("/", path)
+        if not stat.S_ISDIR(st.st_mode):
+            found.append(os.path.relpath(path, root))
+    return sorted(found)
+
+
+def test_walker_everything(tree):
+    assert len(walk(tree)) == 13
+
+
+def test_walker_excludes(tree):
+    found = walk(tree, excludes=[f"{tree}/build", "*~", "sh:**/*.o"])
+    assert "notes.txt" in found
+    assert "notes.txt~" not in found
+    assert not [f for f in found if f.startswith("build/")]
+    assert "src/main.c" in found
+    assert "src/main.o" not in found
+
+
+def test_walker_patterns(tree):
+    # the first pattern that matches decides
+    found = walk(tree, patterns=[
+        f"+ {tree}/src/keep.o",
+        "- sh:**/*.o",
+        f"! {tree}/cache",
+        "P fm",
+        f"- {tree}/notes.txt?",
+    ])
+    assert "src/keep.o" in found
+    assert "src/main.o" not in found
+    assert "build/main.o" not in found
+    assert "build/main.c" in found
+    assert "cache/data" not in found
+    assert "notes.txt" in found
+    assert "notes.txt~" not in found
+
+
+def test_walker_patterns_precede_excludes(tree):
+    found = walk(tree, patterns=[f"+ {tree}/src/keep.o"], excludes=["*.o"])
+    assert "src/keep.o" in found
+    assert "src/main.o" not in found
+
+
+def test_walker_regex_patterns(tree):
+    found = walk(tree, excludes=[r"re:\.o$", "pp:" + str(tree / "cache")])
+    assert not [f for f in found if f.endswith(".o")]
+    assert "cache/data" not in found
+    assert "build/main.c" in found
+
+
+def test_walker_tags(tree):
+    found = walk(tree)
+    assert "private/secret" in found
+    assert "tagged/data" in found
+
+    found = walk(tree, exclude_if_present=[".nobackup"], exclude_caches=True)
+    assert not [f for f in found if f.startswith("private/")]
+    assert not [f for f in found if f.startswith("tagged/")]
+    assert "untagged/CACHEDIR.TAG" in found
+
+
+def test_walker_unknown_pattern(tree):
+    with pytest.raises(Error):
+        walk(tree, patterns=["* anything"])
+
+
+def test_walker_working_dir(tree, tmp_path):
+    # absolute roots are read in place even if the working directory is not /
+    working_dir = tmp_path / "elsewhere"
+    working_dir.mkdir()
+    (working_dir / "local.txt").write_text("local")
+    walker = Walker(Settings(working_dir=str(working_dir)))
+
+    found = dict(walker.walk([tree, "local.txt"]))
+    archived = str(tree).lstrip("/")
+    assert f"{archived}/src/main.c" in found
+    assert "local.txt" in found
+    assert not [p for p in found if p.startswith("/")]
+    for path in found:
+        assert os.path.exists(walker.local_path(path))
+    assert walker.local_path(f"{archived}/notes.txt") == f"{tree}/notes.txt"
+    assert walker.local_path("local.txt") == f"{working_dir}/local.txt"
+
+    # paths within an absolute root may be walked again in archive form
+    found = [p for p, st in walker.walk([f"{archived}/src"])]
+    assert f"{archived}/src/main.c" in found